@@ -0,0 +1,494 @@
+"""Замеры производительности слоя данных на синтетических данных (Kivy не нужен).
+
+    python finance_bench.py generate --records 100000 --out data.json
+    python finance_bench.py run --sizes 1k,10k,100k --repeat 5 --output results.json
+    python finance_bench.py compare baseline.json results.json --threshold 1.25
+
+Это не тесты: run печатает таблицу и сохраняет результаты в JSON (время одной
+операции в секундах, минимум/медиана/среднее по повторам), а compare сравнивает
+два таких файла по медианам и завершается с кодом 1, если что-то замедлилось
+сильнее порога. Данные каждого размера генерируются один раз за запуск,
+сценарии, меняющие данные, получают свежую копию каталога.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from finance_core import (
+    DEFAULT_RATES, RECORD_TABLES, ColumnarLedger, DataStore, JournalStorage, JsonStorage, RateCache,
+    SqliteStorage, StatsAggregates, WriteBehindStorage, generate_report, read_statement,
+)
+
+# Размеры по умолчанию (1M — только явно: генерация и загрузка занимают минуты)
+DEFAULT_SIZES = "1k,10k,100k"
+DEFAULT_REPEAT = 3
+# Кошельки синтетических данных: имя, валюта, доля записей
+BENCH_WALLETS = (("Основной", "RUB", 0.45), ("Карта Сбер", "RUB", 0.3), ("Наличные", "RUB", 0.1),
+                 ("USD счёт", "USD", 0.1), ("Копилка", "EUR", 0.05))
+BENCH_EXPENSE_CATEGORIES = ("Продукты", "Транспорт", "Кафе", "Жильё", "Связь", "Здоровье", "Одежда",
+                            "Развлечения", "Подарки", "Образование", "Путешествия", "Без категории")
+BENCH_INCOME_CATEGORIES = ("Зарплата", "Фриланс", "Проценты", "Кэшбэк")
+# Доли доходов и записей в корзине, период, за который разбросаны даты
+BENCH_INCOME_SHARE = 0.2
+BENCH_TRASH_SHARE = 0.05
+BENCH_YEARS = 3
+
+
+def parse_size(text):
+    """"10k" -> 10000, "1M" -> 1000000."""
+    text = text.strip()
+    factor = {"k": 1000, "K": 1000, "m": 1000000, "M": 1000000}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+def size_label(records):
+    if records >= 1000000 and records % 1000000 == 0:
+        return f"{records // 1000000}M"
+    if records >= 1000 and records % 1000 == 0:
+        return f"{records // 1000}k"
+    return str(records)
+
+
+# ---------------------------
+# Синтетические данные
+# ---------------------------
+def generate_data(records, seed=0, now=None):
+    """Документ data.json с records записями (доходы, расходы и корзина).
+
+    Даты идут по возрастанию за последние BENCH_YEARS лет (как при обычном
+    вводе), суммы распределены логнормально и пересчитаны в валюту кошелька,
+    балансы согласованы с записями (opening_balance + доходы − расходы).
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    start = now - timedelta(days=365 * BENCH_YEARS)
+    span = int((now - start).total_seconds() // 60)
+    minutes = sorted(rng.randrange(span) for _ in range(records))
+    names = [w[0] for w in BENCH_WALLETS]
+    currency_of = {w[0]: w[1] for w in BENCH_WALLETS}
+    weights = [w[2] for w in BENCH_WALLETS]
+    wallet_choice = rng.choices(names, weights, k=records)
+    opening = {name: round(rng.uniform(1000, 100000) / DEFAULT_RATES[currency_of[name]], 2) for name in names}
+    net = dict.fromkeys(names, 0.0)
+
+    data = {"wallets": [], "incomes": [], "expenses": [], "categories": [], "deleted_records": []}
+    deleted_at = now.strftime("%d.%m.%Y %H:%M:%S")
+    for i in range(records):
+        wallet = wallet_choice[i]
+        currency = currency_of[wallet]
+        income = rng.random() < BENCH_INCOME_SHARE
+        if income:
+            rub = rng.lognormvariate(10.3, 0.6)
+            category = rng.choice(BENCH_INCOME_CATEGORIES)
+        else:
+            rub = rng.lognormvariate(6.5, 1.1)
+            category = rng.choice(BENCH_EXPENSE_CATEGORIES)
+        rec = {
+            "id": i + 1,
+            "currency": currency,
+            "amount": round(rub / DEFAULT_RATES[currency], 2) or 0.01,
+            "wallet": wallet,
+            "category": category,
+            "date": (start + timedelta(minutes=minutes[i])).strftime("%d.%m.%Y %H:%M"),
+        }
+        key = "incomes" if income else "expenses"
+        if rng.random() < BENCH_TRASH_SHARE:
+            # Запись в корзине на баланс не влияет
+            rec["deleted_at"] = deleted_at
+            rec["record_type"] = key
+            data["deleted_records"].append(rec)
+            continue
+        data[key].append(rec)
+        net[wallet] += rec["amount"] if income else -rec["amount"]
+
+    data["wallets"] = [{"name": name, "currency": currency_of[name], "balance": round(opening[name] + net[name], 2),
+                        "opening_balance": opening[name]} for name in names]
+    data["categories"] = list(BENCH_INCOME_CATEGORIES + BENCH_EXPENSE_CATEGORIES)
+    data["currencies"] = dict(DEFAULT_RATES)
+    data["last_rates_update"] = now.strftime("%d.%m.%Y %H:%M")
+    data["next_id"] = records + 1
+    return data
+
+
+def write_statement(path, rows, seed=0):
+    """CSV-выписка из rows строк для сценария импорта."""
+    rng = random.Random(seed)
+    today = datetime.now()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("Дата операции;Сумма операции;Категория\n")
+        for _ in range(rows):
+            day = today - timedelta(days=rng.randrange(365))
+            amount = -rng.lognormvariate(6.5, 1.1) if rng.random() > BENCH_INCOME_SHARE else rng.lognormvariate(10, 0.5)
+            f.write(f"{day:%d.%m.%Y};{amount:.2f};{rng.choice(BENCH_EXPENSE_CATEGORIES)}\n")
+
+
+# ---------------------------
+# Сценарии
+# ---------------------------
+class BenchEnv:
+    """Каталог с данными одного размера для одного прогона сценария."""
+
+    def __init__(self, workdir, records):
+        self.workdir = workdir
+        self.records = records
+        self.data_file = os.path.join(workdir, "data.json")
+        self.elapsed = None
+        self.ops = 1
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    @contextmanager
+    def timer(self, ops=1):
+        """Замеряемый участок; ops — сколько операций в нём (время делится на ops)."""
+        started = time.perf_counter()
+        yield
+        self.elapsed = time.perf_counter() - started
+        self.ops = ops
+
+    def open_store(self):
+        """DataStore поверх журнала с отложенной записью — как в приложении."""
+        storage = WriteBehindStorage(JournalStorage(self.data_file, self.data_file + ".journal"))
+        return storage, DataStore(storage)
+
+
+# Имя -> (функция, меняет ли данные)
+SCENARIOS = {}
+
+
+def scenario(name, mutates=False):
+    def register(func):
+        SCENARIOS[name] = (func, mutates)
+        return func
+    return register
+
+
+@scenario("load_data")
+def bench_load_data(env):
+    with env.timer():
+        JsonStorage(env.data_file).load()
+
+
+@scenario("open_store")
+def bench_open_store(env):
+    """Загрузка вместе с индексами, колоночным журналом и агрегатами (запуск приложения)."""
+    storage = WriteBehindStorage(JournalStorage(env.data_file, env.data_file + ".journal"))
+    with env.timer():
+        DataStore(storage)
+    storage.close()
+
+
+@scenario("load_sqlite", mutates=True)
+def bench_load_sqlite(env):
+    db = SqliteStorage(env.path("data.db"))
+    db.save(JsonStorage(env.data_file).load())
+    with env.timer():
+        db.load()
+    db.close()
+
+
+@scenario("save_data", mutates=True)
+def bench_save_data(env):
+    """Полная перезапись data.json с бэкапом (режим FINANCE_STORAGE=json)."""
+    storage = JsonStorage(env.data_file)
+    data = storage.load()
+    with env.timer():
+        storage.save(data)
+
+
+@scenario("save_sqlite", mutates=True)
+def bench_save_sqlite(env):
+    data = JsonStorage(env.data_file).load()
+    db = SqliteStorage(env.path("data.db"))
+    with env.timer():
+        db.save(data)
+    db.close()
+
+
+@scenario("save_record", mutates=True)
+def bench_save_record(env, count=100):
+    storage, store = env.open_store()
+    wallet = store.data["wallets"][0]["name"]
+    with env.timer(count):
+        for i in range(count):
+            store.add_record("expenses", wallet, "Продукты", 10.0 + i)
+        storage.flush()
+    storage.close()
+
+
+def _move_to_trash(env, pick, count=100):
+    """Переносит в корзину count расходов, выбранных pick(список, count)."""
+    storage, store = env.open_store()
+    ids = [rec["id"] for rec in pick(store.data["expenses"], count)]
+    with env.timer(len(ids)):
+        for rec_id in ids:
+            store.move_to_trash("expenses", rec_id)
+        storage.flush()
+    storage.close()
+
+
+@scenario("move_to_trash", mutates=True)
+def bench_move_to_trash(env):
+    """Записи равномерно по всему списку, начиная с самой старой."""
+    _move_to_trash(env, lambda records, count: records[::max(1, len(records) // count)][:count])
+
+
+@scenario("move_to_trash_head", mutates=True)
+def bench_move_to_trash_head(env):
+    """Самые старые записи — удаление из начала списка."""
+    _move_to_trash(env, lambda records, count: records[:count])
+
+
+@scenario("move_to_trash_tail", mutates=True)
+def bench_move_to_trash_tail(env):
+    """Самые новые записи — удаление с конца списка."""
+    _move_to_trash(env, lambda records, count: records[-count:])
+
+
+@scenario("delete_wallet", mutates=True)
+def bench_delete_wallet(env):
+    storage, store = env.open_store()
+    with env.timer():
+        store.delete_wallet(BENCH_WALLETS[0][0])
+        storage.flush()
+    storage.close()
+
+
+@scenario("numbering_id", mutates=True)
+def bench_numbering_id(env, count=10000):
+    storage, store = env.open_store()
+    with env.timer(count):
+        for _ in range(count):
+            store.allocate_id()
+    storage.close()
+
+
+@scenario("aggregate_by_day")
+def bench_aggregate_by_day(env):
+    """Суммы по дням и категориям с нуля (векторно из колоночного журнала) и ряд по месяцам."""
+    data = JsonStorage(env.data_file).load()
+    columns = ColumnarLedger()
+    columns.reset(data)
+    with env.timer():
+        aggregates = StatsAggregates(columns)
+        aggregates.reset(data)
+        aggregates.series("expenses", granularity="month")
+
+
+@scenario("record_query")
+def bench_record_query(env, count=20):
+    """Страницы списков: последние записи и выборка с фильтром (замена get_record_data)."""
+    storage, store = env.open_store()
+    with env.timer(count):
+        for i in range(count):
+            store.query.query("expenses", limit=50)
+            store.query.query("expenses", category=BENCH_EXPENSE_CATEGORIES[i % 5], min_amount=1000, limit=500)
+    storage.close()
+
+
+@scenario("generate_report", mutates=True)
+def bench_generate_report(env):
+    storage, store = env.open_store()
+    rates = RateCache(env.path("rates_cache.json"))
+    with env.timer():
+        generate_report(store.data, store.columns, rates, lock=store.lock, fmt="txt", base_dir=env.workdir)
+    storage.close()
+
+
+@scenario("export_csv", mutates=True)
+def bench_export_csv(env):
+    storage, store = env.open_store()
+    rates = RateCache(env.path("rates_cache.json"))
+    with env.timer():
+        generate_report(store.data, store.columns, rates, lock=store.lock, fmt="csv", base_dir=env.workdir)
+    storage.close()
+
+
+@scenario("import_statement", mutates=True)
+def bench_import_statement(env):
+    """Импорт выписки размером в десятую часть данных (не меньше 100 строк)."""
+    rows = max(env.records // 10, 100)
+    path = env.path("statement.csv")
+    write_statement(path, rows)
+    storage, store = env.open_store()
+    with env.timer(rows):
+        store.import_statement(read_statement(path), wallet=BENCH_WALLETS[0][0])
+        storage.flush()
+    storage.close()
+
+
+# ---------------------------
+# Запуск и сравнение
+# ---------------------------
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(sizes, names, repeat, base_dir, log=print):
+    """Прогоняет сценарии names на каждом размере repeat раз. Возвращает список результатов."""
+    results = []
+    for records in sizes:
+        size_dir = os.path.join(base_dir, size_label(records))
+        os.makedirs(size_dir, exist_ok=True)
+        source = os.path.join(size_dir, "data.json")
+        started = time.perf_counter()
+        with open(source, "w", encoding="utf-8") as f:
+            json.dump(generate_data(records), f, ensure_ascii=False)
+        log(f"# {size_label(records)}: данные сгенерированы за {time.perf_counter() - started:.1f} с")
+
+        for name in names:
+            func, mutates = SCENARIOS[name]
+            runs = []
+            ops = 1
+            for attempt in range(repeat):
+                workdir = size_dir
+                if mutates:
+                    workdir = tempfile.mkdtemp(dir=base_dir)
+                    shutil.copy(source, workdir)
+                env = BenchEnv(workdir, records)
+                try:
+                    func(env)
+                finally:
+                    if mutates:
+                        shutil.rmtree(workdir, ignore_errors=True)
+                runs.append(env.elapsed / env.ops)
+                ops = env.ops
+            result = {
+                "scenario": name,
+                "records": records,
+                "ops": ops,
+                "runs": runs,
+                "min": min(runs),
+                "median": statistics.median(runs),
+                "mean": statistics.fmean(runs),
+            }
+            results.append(result)
+            log(f"{name:<18} {size_label(records):>5}  медиана {format_seconds(result['median']):>10}"
+                f"  мин {format_seconds(result['min']):>10}  (операций за прогон: {ops})")
+    return results
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} с"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} мс"
+    return f"{seconds * 1e6:.1f} мкс"
+
+
+def compare_results(old, new, threshold):
+    """Сравнение двух файлов результатов по медианам. Возвращает список замедлений."""
+    baseline = {(r["scenario"], r["records"]): r for r in old["results"]}
+    regressions = []
+    for r in new["results"]:
+        base = baseline.get((r["scenario"], r["records"]))
+        if base is None or not base["median"]:
+            continue
+        ratio = r["median"] / base["median"]
+        mark = "  <-- медленнее" if ratio > threshold else ""
+        print(f"{r['scenario']:<18} {size_label(r['records']):>5}  {format_seconds(base['median']):>10}"
+              f" -> {format_seconds(r['median']):>10}  x{ratio:.2f}{mark}")
+        if ratio > threshold:
+            regressions.append((r["scenario"], r["records"], ratio))
+    return regressions
+
+
+def cmd_generate(args):
+    data = generate_data(parse_size(args.records), seed=args.seed)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    print(f"{args.out}: записей {sum(len(data[k]) for k in RECORD_TABLES)}")
+    return 0
+
+
+def cmd_run(args):
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        print(f"Неизвестные сценарии: {', '.join(unknown)}; есть: {', '.join(SCENARIOS)}", file=sys.stderr)
+        return 2
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    base_dir = tempfile.mkdtemp(prefix="finance_bench_")
+    try:
+        results = run_benchmarks(sizes, names, args.repeat, base_dir)
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты: {args.output}")
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = compare_results(old, new, args.threshold)
+    if regressions:
+        print(f"Замедлений больше чем в {args.threshold} раза: {len(regressions)}")
+        return 1
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="finance_bench", description="Замеры производительности FinanceTracker")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="сгенерировать data.json")
+    gen.add_argument("--records", default="10k", help="число записей: 1000, 10k, 1M…")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--out", default="data.json")
+    gen.set_defaults(handler=cmd_generate)
+
+    run = commands.add_parser("run", help="прогнать сценарии")
+    run.add_argument("--sizes", default=DEFAULT_SIZES, help=f"размеры через запятую (по умолчанию {DEFAULT_SIZES})")
+    run.add_argument("--scenarios", default=None, help=f"сценарии через запятую: {', '.join(SCENARIOS)}")
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run.add_argument("--output", default=None, help="файл для результатов в JSON")
+    run.set_defaults(handler=cmd_run)
+
+    cmp = commands.add_parser("compare", help="сравнить два файла результатов")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=1.25, help="допустимое замедление медианы (по умолчанию 1.25)")
+    cmp.set_defaults(handler=cmd_compare)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
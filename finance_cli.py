@@ -0,0 +1,162 @@
+"""Пакетные операции с данными без графического интерфейса (Kivy не нужен).
+
+    python finance_cli.py report --format csv --from 01.01.2024 --to 31.03.2024
+    python finance_cli.py export records.jsonl
+    python finance_cli.py import statement.csv --wallet "Карта Сбер"
+    python finance_cli.py import statement.ofx --wallet "Карта Сбер"
+    python finance_cli.py recompute-balances
+
+Данные берутся из текущего каталога (или --data-dir) в том же режиме хранения,
+что и у приложения (FINANCE_STORAGE или --storage). Приложение при этом лучше закрыть:
+оба процесса пишут в одни и те же файлы.
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+
+from finance_core import (
+    IMPORT_COLUMNS, RATES_FILE, REPORT_FORMATS, STORAGE_MODE,
+    DataStore, RateCache, collect_report, configure_perf, generate_report, open_storage, parse_record_filter, read_statement,
+    statement_format,
+)
+
+# Сколько ошибок импорта печатать
+IMPORT_ERRORS_SHOWN = 20
+
+
+def report_filters(args):
+    """Фильтры отчёта из аргументов: {start, end, wallet, category}."""
+    conditions = parse_record_filter(args.wallet, args.category, args.date_from, args.date_to)
+    return {name: conditions.get(name) for name in ("start", "end", "wallet", "category")}
+
+
+def cmd_report(store, rates, args):
+    path = generate_report(store.data, store.columns, rates, fmt=args.format,
+                           base_dir=args.out_dir, **report_filters(args))
+    if not path:
+        return 1
+    print(path)
+    return 0
+
+
+def cmd_export(store, rates, args):
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if fmt not in ("csv", "jsonl"):
+        print(f"Неизвестный формат выгрузки: {fmt} (csv или jsonl)", file=sys.stderr)
+        return 2
+    report = collect_report(store.data, store.columns, rates, **report_filters(args))
+    REPORT_FORMATS[fmt](args.output, report)
+    print(args.output)
+    return 0
+
+
+def cmd_import(store, rates, args):
+    mapping = {}
+    for item in args.map:
+        field, _, column = item.partition("=")
+        if field not in IMPORT_COLUMNS or not column:
+            print(f"Неверное сопоставление «{item}»: нужно поле=столбец, поля: {', '.join(IMPORT_COLUMNS)}",
+                  file=sys.stderr)
+            return 2
+        mapping[field] = column
+    fmt = args.format or statement_format(args.input)
+    options = {}
+    if args.encoding:
+        options["encoding"] = args.encoding
+    if fmt == "csv":
+        options.update(mapping=mapping or None, delimiter=args.delimiter)
+    rows = read_statement(args.input, fmt, **options)
+    batch = store.import_statement(rows, wallet=args.wallet, default_category=args.category)
+    if batch.get("failed"):
+        print(batch["failed"], file=sys.stderr)
+        return 1
+    counts = {key: len(records) for key, records in batch["records"].items()}
+    print(f"Импортировано записей: {sum(counts.values())} (доходов {counts['incomes']}, "
+          f"расходов {counts['expenses']}), пропущено строк: {len(batch['errors'])}")
+    for line, reason in batch["errors"][:IMPORT_ERRORS_SHOWN]:
+        print(f"  строка {line}: {reason}")
+    if len(batch["errors"]) > IMPORT_ERRORS_SHOWN:
+        print(f"  … и ещё {len(batch['errors']) - IMPORT_ERRORS_SHOWN}")
+    return 0
+
+
+def cmd_recompute_balances(store, rates, args):
+    changed = store.recompute_balances()
+    for name, (old, new) in changed.items():
+        print(f"{name}: {old:.2f} -> {new:.2f}")
+    print(f"Исправлено балансов: {len(changed)}")
+    return 0
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--from", dest="date_from", default="", help="начальная дата, дд.мм.гггг")
+    parser.add_argument("--to", dest="date_to", default="", help="конечная дата включительно, дд.мм.гггг")
+    parser.add_argument("--wallet", default="", help="только этот кошелёк")
+    parser.add_argument("--category", default="", help="только эта категория")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="finance_cli", description="Пакетные операции с данными FinanceTracker")
+    parser.add_argument("--data-dir", default=".", help="каталог с data.json / data.db (по умолчанию текущий)")
+    parser.add_argument("--storage", choices=("journal", "json", "sqlite"), default=STORAGE_MODE,
+                        help="режим хранения (по умолчанию FINANCE_STORAGE или journal)")
+    parser.add_argument("--perf-log", default=None, metavar="ФАЙЛ",
+                        help="дописывать замеры (load_data, save_data, generate_report) строками JSON в файл")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report = commands.add_parser("report", help="отчёт в TXT, CSV, JSON Lines или DOCX")
+    report.add_argument("--format", choices=sorted(REPORT_FORMATS), default="txt")
+    report.add_argument("--out-dir", default=None, help="каталог для отчёта (по умолчанию каталог данных)")
+    add_filter_arguments(report)
+    report.set_defaults(handler=cmd_report)
+
+    export = commands.add_parser("export", help="выгрузка записей в CSV или JSON Lines")
+    export.add_argument("output", help="файл выгрузки (.csv или .jsonl)")
+    export.add_argument("--format", choices=("csv", "jsonl"), default=None)
+    add_filter_arguments(export)
+    export.set_defaults(handler=cmd_export)
+
+    imp = commands.add_parser("import", help="загрузка выписки (CSV, OFX) или выгрузки JSON Lines")
+    imp.add_argument("input", help="файл выписки")
+    imp.add_argument("--format", choices=("csv", "ofx", "jsonl"), default=None,
+                     help="формат (по умолчанию — по расширению)")
+    imp.add_argument("--wallet", default=None,
+                     help="кошелёк для всех строк (для OFX — если номер счёта не совпадает с именем кошелька)")
+    imp.add_argument("--category", default="Без категории", help="категория для строк без категории")
+    imp.add_argument("--map", action="append", default=[], metavar="ПОЛЕ=СТОЛБЕЦ",
+                     help="столбец CSV для поля date, amount, type, wallet, category или currency")
+    imp.add_argument("--delimiter", default=None, help="разделитель CSV (по умолчанию определяется)")
+    imp.add_argument("--encoding", default=None, help="кодировка файла, например cp1251")
+    imp.set_defaults(handler=cmd_import)
+
+    recompute = commands.add_parser("recompute-balances", help="пересчитать балансы кошельков по записям")
+    recompute.set_defaults(handler=cmd_recompute_balances)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Пути к файлам вывода считаем от каталога запуска, а не от каталога данных
+    for name in ("output", "input", "out_dir", "perf_log"):
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.chdir(args.data_dir)
+    configure_perf(log_file=args.perf_log)
+
+    storage = open_storage(args.storage)
+    try:
+        store = DataStore(storage)
+        rates = RateCache(RATES_FILE)
+        try:
+            return args.handler(store, rates, args)
+        except (OSError, ValueError, csv.Error) as e:
+            logging.error(f"{args.command}: {e}")
+            return 1
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2846 @@
+"""Ядро учёта финансов без Kivy: хранилище, индексы, колоночный журнал, курсы, отчёты.
+
+Модуль не импортирует Kivy, поэтому его используют и экраны приложения (main.py),
+и пакетные операции из командной строки (finance_cli.py), и скрипты на сервере.
+"""
+import json
+import time
+import os
+import re
+import sqlite3
+import numpy as np
+from datetime import datetime, timedelta, date
+from bisect import bisect_left, insort
+from itertools import islice
+from threading import Thread, Lock, RLock, Condition, current_thread
+from contextlib import contextmanager, nullcontext
+import functools
+import shutil
+import logging
+
+# Сообщения ядра идут в журнал, а не в stdout: stdout принадлежит приложению и finance_cli.py
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------
+# Замеры производительности
+# ---------------------------
+# FINANCE_PERF=1 — включить замеры при запуске (в приложении их также включает кнопка в меню)
+PERF_ENABLED = os.environ.get("FINANCE_PERF") == "1"
+# FINANCE_PERF_LOG=путь — дописывать каждый замер строкой JSON в этот файл
+PERF_LOG_FILE = os.environ.get("FINANCE_PERF_LOG")
+
+
+class _NullSpan:
+    """Замер при выключенном мониторе: ничего не делает."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("monitor", "name", "fields", "started")
+
+    def __init__(self, monitor, name, fields):
+        self.monitor = monitor
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.monitor._finish(self.name, time.perf_counter() - self.started, self.fields)
+        return False
+
+    def set(self, **fields):
+        """Дополняет замер полями, известными только в конце (байты, число записей)."""
+        self.fields.update(fields)
+
+
+class PerfMonitor:
+    """Спаны (длительность участков кода) и счётчики для поиска медленных мест.
+
+    Выключенный монитор почти ничего не стоит: span() возвращает общий пустой
+    контекст, count() сразу выходит. Включённый копит по каждому имени число
+    вызовов, суммарное, последнее и максимальное время и передаёт каждый замер
+    приёмникам из sinks (например, JsonLinesSink). Спаны закрываются из любых потоков.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.sinks = []
+        self.spans = {}
+        self.counters = {}
+        self._lock = Lock()
+
+    def span(self, name, **fields):
+        """Контекст замера: with perf.span("save_data", ops=3) as span: ... span.set(bytes=n)."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, fields)
+
+    def count(self, name, value=1):
+        """Увеличивает счётчик name на value."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _finish(self, name, seconds, fields):
+        with self._lock:
+            stat = self.spans.get(name)
+            if stat is None:
+                stat = self.spans[name] = {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0, "fields": {}}
+            stat["count"] += 1
+            stat["total"] += seconds
+            stat["last"] = seconds
+            stat["max"] = max(stat["max"], seconds)
+            stat["fields"] = fields
+            sinks = list(self.sinks)
+        if not sinks:
+            return
+        event = {"ts": datetime.now().isoformat(timespec="milliseconds"), "span": name,
+                 "ms": round(seconds * 1000, 3), "thread": current_thread().name}
+        event.update(fields)
+        for sink in sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                logger.error(f"Ошибка записи замера {name}: {e}")
+
+    def snapshot(self):
+        """Копия накопленной статистики: ({имя: {...}}, {счётчик: значение})."""
+        with self._lock:
+            return ({name: dict(stat) for name, stat in self.spans.items()}, dict(self.counters))
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+
+class JsonLinesSink:
+    """Приёмник замеров: одна JSON-строка на замер в файле (можно читать построчно)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def __call__(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+perf = PerfMonitor()
+
+
+def configure_perf(enabled=None, log_file=None):
+    """Включает замеры (по умолчанию — по FINANCE_PERF) и файл журнала замеров (FINANCE_PERF_LOG)."""
+    perf.enabled = PERF_ENABLED if enabled is None else enabled
+    log_file = log_file or PERF_LOG_FILE
+    if log_file and not any(getattr(sink, "path", None) == log_file for sink in perf.sinks):
+        perf.sinks.append(JsonLinesSink(log_file))
+        perf.enabled = True
+    return perf
+
+
+def timed(name):
+    """Декоратор: замер каждого вызова функции спаном name (если замеры включены)."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not perf.enabled:
+                return func(*args, **kwargs)
+            with perf.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ---------------------------
+# Работа с JSON (хранение данных)
+# ---------------------------
+DATA_FILE = "data.json"
+JOURNAL_FILE = DATA_FILE + ".journal"
+DB_FILE = "data.db"
+# "journal" — снимок data.json + журнал операций, "json" — перезапись файла целиком,
+# "sqlite" — база data.db (при первом запуске переносит данные из data.json)
+STORAGE_MODE = os.environ.get("FINANCE_STORAGE", "journal")
+# После скольких операций журнал сворачивается в новый снимок
+JOURNAL_COMPACT_THRESHOLD = 500
+# Отложенная запись: пауза после последнего изменения и максимальная задержка пачки, сек
+WRITE_BEHIND_DELAY = 0.5
+WRITE_BEHIND_MAX_DELAY = 2.0
+
+
+def empty_data():
+    """Пустая структура данных приложения"""
+    return {
+        "wallets": [],
+        "incomes": [],
+        "expenses": [],
+        "categories": [],
+        "deleted_records": []
+    }
+
+
+def op_add(key, *items):
+    """Операция журнала: добавить элементы в список key."""
+    return {"op": "add", "key": key, "items": list(items)}
+
+
+def op_del(key, ids, **match):
+    """Операция журнала: удалить элементы списка key по id (для кошельков — по имени).
+
+    match — дополнительные условия на поля записи, например record_type в корзине.
+    """
+    op = {"op": "del", "key": key, "ids": list(ids)}
+    if match:
+        op["match"] = match
+    return op
+
+
+def op_upd(key, ident, **fields):
+    """Операция журнала: обновить поля элемента списка key."""
+    return {"op": "upd", "key": key, "id": ident, "fields": fields}
+
+
+def op_set(key, value):
+    """Операция журнала: заменить значение верхнего уровня."""
+    return {"op": "set", "key": key, "value": value}
+
+
+def _item_key(key, item):
+    """Ключ элемента списка: имя для кошельков, сама строка для категорий, иначе id."""
+    if key == "wallets":
+        return item.get("name")
+    if key == "categories":
+        return item
+    return item.get("id")
+
+
+def replay_journal(data, ops):
+    """Применяет операции журнала к снимку за O(N + число операций).
+
+    Списки на время проигрывания превращаются в словари seq -> элемент,
+    поэтому удаление одной записи не пересобирает весь список.
+    """
+    tables = {}
+
+    def table(key):
+        if key not in tables:
+            items = data.get(key) or []
+            entries = dict(enumerate(items))
+            by_key = {}
+            for seq, item in entries.items():
+                by_key.setdefault(_item_key(key, item), []).append(seq)
+            tables[key] = [entries, by_key, len(items)]
+        return tables[key]
+
+    for op in ops:
+        kind = op.get("op")
+        key = op.get("key")
+        if kind == "set":
+            data[key] = op.get("value")
+            tables.pop(key, None)
+            continue
+
+        t = table(key)
+        entries, by_key = t[0], t[1]
+        if kind == "add":
+            for item in op.get("items", []):
+                seq = t[2]
+                t[2] += 1
+                entries[seq] = item
+                by_key.setdefault(_item_key(key, item), []).append(seq)
+        elif kind == "del":
+            match = op.get("match") or {}
+            for ident in op.get("ids", []):
+                keep = []
+                for seq in by_key.pop(ident, []):
+                    item = entries[seq]
+                    if match and not all(item.get(f) == v for f, v in match.items()):
+                        keep.append(seq)
+                    else:
+                        del entries[seq]
+                if keep:
+                    by_key[ident] = keep
+        elif kind == "upd":
+            for seq in by_key.get(op.get("id"), []):
+                entries[seq].update(op.get("fields") or {})
+        else:
+            logger.error(f"Неизвестная операция журнала: {op}")
+
+    for key, (entries, _, _) in tables.items():
+        data[key] = list(entries.values())
+    return data
+
+
+class JsonStorage:
+    """Хранение всего документа в одном JSON-файле (перезапись при каждом сохранении)."""
+
+    # Сохраняет весь документ, поэтому при отложенной записи ему нужен снимок списков
+    needs_snapshot = True
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+
+    def load(self):
+        """Загрузка данных из файла JSON"""
+        if os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                logger.error("Поврежденный JSON файл, возвращаем дефолтные данные")
+                return empty_data()
+        return empty_data()
+
+    def save(self, data):
+        """Сохранение данных в файл JSON с бэкапом (через временный файл и атомарную замену).
+
+        Возвращает число записанных байт.
+        """
+        tmp_file = self.data_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        written = os.path.getsize(tmp_file)
+        if os.path.exists(self.data_file):
+            shutil.copy(self.data_file, self.data_file + ".bak")
+        os.replace(tmp_file, self.data_file)
+        return written
+
+    def commit(self, data, ops):
+        """Фиксирует изменения — здесь просто полная перезапись."""
+        return self.save(data)
+
+    def close(self):
+        pass
+
+
+class JournalStorage(JsonStorage):
+    """Снимок data.json + журнал операций в отдельном файле.
+
+    Каждое изменение дописывает в журнал одну короткую JSON-строку,
+    load() проигрывает журнал поверх снимка, а фоновая компактификация
+    сворачивает накопившийся журнал в новый снимок.
+    Номер последней применённой операции хранится в снимке (journal_seq),
+    поэтому повторное проигрывание после сбоя ничего не задвоит.
+    """
+
+    needs_snapshot = False
+
+    def __init__(self, data_file, journal_file, compact_threshold=JOURNAL_COMPACT_THRESHOLD):
+        super().__init__(data_file)
+        self.journal_file = journal_file
+        self.compacting_file = journal_file + ".compacting"
+        self.compact_threshold = compact_threshold
+        self.seq = 0
+        self.pending = 0
+        self._compact_thread = None
+        self._compact_lock = Lock()
+
+    def _read_ops(self, path, after_seq):
+        """Читает операции из файла журнала, пропуская уже вошедшие в снимок."""
+        ops = []
+        if not os.path.exists(path):
+            return ops
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    op = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная строка в конце журнала после аварийного завершения
+                    logger.error(f"Пропущена поврежденная строка журнала {path}")
+                    continue
+                if op.get("seq", 0) > after_seq:
+                    ops.append(op)
+        return ops
+
+    def _load_snapshot(self):
+        data = super().load()
+        return data, data.pop("journal_seq", 0)
+
+    def load(self):
+        """Загружает снимок и проигрывает поверх него журнал."""
+        data, snapshot_seq = self._load_snapshot()
+        ops = self._read_ops(self.compacting_file, snapshot_seq)
+        ops += self._read_ops(self.journal_file, snapshot_seq)
+        replay_journal(data, ops)
+        self.seq = max([snapshot_seq] + [op.get("seq", 0) for op in ops])
+        self.pending = len(ops)
+        return data
+
+    def _write_snapshot(self, data, seq):
+        """Атомарно записывает снимок с номером последней операции."""
+        snapshot = dict(data)
+        snapshot["journal_seq"] = seq
+        tmp_file = self.data_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=4)
+        written = os.path.getsize(tmp_file)
+        if os.path.exists(self.data_file):
+            shutil.copy(self.data_file, self.data_file + ".bak")
+        os.replace(tmp_file, self.data_file)
+        return written
+
+    def save(self, data):
+        """Полное сохранение: новый снимок и пустой журнал. Возвращает число записанных байт."""
+        self.wait_compaction()
+        written = self._write_snapshot(data, self.seq)
+        for path in (self.journal_file, self.compacting_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self.pending = 0
+        return written
+
+    def commit(self, data, ops):
+        """Дописывает операции в журнал (несколько сотен байт вместо всего файла).
+
+        Возвращает число записанных байт.
+        """
+        if not ops:
+            return 0
+        lines = []
+        for op in ops:
+            self.seq += 1
+            op = dict(op, seq=self.seq)
+            lines.append(json.dumps(op, ensure_ascii=False, separators=(",", ":")))
+        text = "\n".join(lines) + "\n"
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(text)
+        self.pending += len(ops)
+        if self.pending >= self.compact_threshold:
+            self.compact()
+        return len(text.encode("utf-8"))
+
+    def compact(self, wait=False):
+        """Сворачивает журнал в новый снимок в фоновом потоке.
+
+        Текущий журнал переименовывается, новые операции идут в чистый файл,
+        а поток собирает снимок только из файлов на диске — живые данные
+        приложения он не трогает.
+        """
+        with self._compact_lock:
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                return
+            if not os.path.exists(self.compacting_file):
+                if not os.path.exists(self.journal_file):
+                    return
+                os.replace(self.journal_file, self.compacting_file)
+            self.pending = 0
+            self._compact_thread = Thread(target=self._compact_worker, daemon=True)
+            self._compact_thread.start()
+        if wait:
+            self.wait_compaction()
+
+    def _compact_worker(self):
+        try:
+            data, snapshot_seq = self._load_snapshot()
+            ops = self._read_ops(self.compacting_file, snapshot_seq)
+            replay_journal(data, ops)
+            last_seq = max([snapshot_seq] + [op.get("seq", 0) for op in ops])
+            self._write_snapshot(data, last_seq)
+            os.remove(self.compacting_file)
+        except Exception as e:
+            logger.error(f"Ошибка компактификации журнала: {e}")
+
+    def wait_compaction(self):
+        thread = self._compact_thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+
+    def close(self):
+        """Дожидается фоновой компактификации перед выходом."""
+        self.wait_compaction()
+
+
+RECORD_TABLES = ("incomes", "expenses", "deleted_records")
+RECORD_FIELDS = ("id", "currency", "amount", "wallet", "category", "date", "deleted_at", "record_type")
+
+
+def _date_sort_key(date_str):
+    """"дд.мм.гггг чч:мм" -> "гггг-мм-дд чч:мм", чтобы индекс по дате сортировал хронологически."""
+    if not isinstance(date_str, str) or len(date_str) < 10 or date_str[2] != "." or date_str[5] != ".":
+        return None
+    return f"{date_str[6:10]}-{date_str[3:5]}-{date_str[0:2]}{date_str[10:]}"
+
+
+class SqliteStorage:
+    """Хранение в SQLite: отдельные таблицы для кошельков, категорий, доходов, расходов и корзины.
+
+    Каждая операция журнала превращается в один индексированный запрос,
+    а все операции одного действия пользователя выполняются в одной транзакции.
+    Прочие значения верхнего уровня (курсы валют, дата обновления) лежат в таблице meta как JSON.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS wallets (
+            name TEXT PRIMARY KEY, currency TEXT, balance, position INTEGER, extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS categories (name TEXT PRIMARY KEY, position INTEGER);
+    """
+    RECORD_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS {t} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id, currency TEXT, amount, wallet TEXT, category TEXT, date TEXT,
+            deleted_at TEXT, record_type TEXT, date_key TEXT, extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS {t}_id ON {t}(id);
+        CREATE INDEX IF NOT EXISTS {t}_wallet ON {t}(wallet);
+        CREATE INDEX IF NOT EXISTS {t}_category ON {t}(category);
+        CREATE INDEX IF NOT EXISTS {t}_date ON {t}(date_key);
+    """
+
+    needs_snapshot = False
+
+    def __init__(self, db_file, json_file=None):
+        self.db_file = db_file
+        self.json_file = json_file
+        self._lock = RLock()
+        # Курсы обновляются из фонового потока, поэтому соединение общее под замком
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript(self.SCHEMA)
+            for table in RECORD_TABLES:
+                self.conn.executescript(self.RECORD_SCHEMA.format(t=table))
+
+    # --- преобразование строк <-> словари ---
+    @staticmethod
+    def _record_row(rec):
+        extra = {k: v for k, v in rec.items() if k not in RECORD_FIELDS}
+        return tuple(rec.get(f) for f in RECORD_FIELDS) + (
+            _date_sort_key(rec.get("date")),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    @staticmethod
+    def _row_record(row):
+        rec = {f: v for f, v in zip(RECORD_FIELDS, row) if v is not None}
+        if row[-1]:
+            rec.update(json.loads(row[-1]))
+        return rec
+
+    def _insert_records(self, cur, table, records):
+        cur.executemany(
+            f"INSERT INTO {table} ({', '.join(RECORD_FIELDS)}, date_key, extra) "
+            f"VALUES ({', '.join('?' * (len(RECORD_FIELDS) + 2))})",
+            [self._record_row(r) for r in records],
+        )
+
+    def _insert_wallets(self, cur, wallets):
+        for w in wallets:
+            extra = {k: v for k, v in w.items() if k not in ("name", "currency", "balance")}
+            cur.execute(
+                "INSERT OR REPLACE INTO wallets (name, currency, balance, position, extra) "
+                "VALUES (?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM wallets), ?)",
+                (w.get("name"), w.get("currency"), w.get("balance"),
+                 json.dumps(extra, ensure_ascii=False) if extra else None),
+            )
+
+    def _insert_categories(self, cur, categories):
+        cur.executemany(
+            "INSERT OR IGNORE INTO categories (name, position) "
+            "VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM categories))",
+            [(c,) for c in categories],
+        )
+
+    def _is_empty(self):
+        row = self.conn.execute("SELECT COUNT(*) FROM meta").fetchone()
+        return row[0] == 0
+
+    def load(self):
+        """Загрузка данных из базы; при первом запуске — перенос из data.json."""
+        with self._lock:
+            if self._is_empty() and self.json_file and os.path.exists(self.json_file):
+                migrate_json_to_sqlite(self.json_file, self)
+            data = empty_data()
+            cur = self.conn.cursor()
+            for name, currency, balance, extra in cur.execute(
+                    "SELECT name, currency, balance, extra FROM wallets ORDER BY position"):
+                wallet = {"name": name, "currency": currency, "balance": balance}
+                if extra:
+                    wallet.update(json.loads(extra))
+                data["wallets"].append(wallet)
+            data["categories"] = [row[0] for row in cur.execute("SELECT name FROM categories ORDER BY position")]
+            for table in RECORD_TABLES:
+                rows = cur.execute(f"SELECT {', '.join(RECORD_FIELDS)}, extra FROM {table} ORDER BY seq")
+                data[table] = [self._row_record(row) for row in rows]
+            for key, value in cur.execute("SELECT key, value FROM meta"):
+                if not key.startswith("_"):
+                    data[key] = json.loads(value)
+            return data
+
+    def save(self, data):
+        """Полная перезапись базы в одной транзакции."""
+        with self._lock, self.conn:
+            cur = self.conn.cursor()
+            for table in ("wallets", "categories", "meta") + RECORD_TABLES:
+                cur.execute(f"DELETE FROM {table}")
+            self._insert_wallets(cur, data.get("wallets") or [])
+            self._insert_categories(cur, data.get("categories") or [])
+            for table in RECORD_TABLES:
+                self._insert_records(cur, table, data.get(table) or [])
+            cur.execute("INSERT INTO meta (key, value) VALUES ('_schema', '1')")
+            for key, value in data.items():
+                if key not in ("wallets", "categories") + RECORD_TABLES:
+                    self._set_meta(cur, key, value)
+
+    @staticmethod
+    def _set_meta(cur, key, value):
+        cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False)))
+
+    def commit(self, data, ops):
+        """Применяет операции журнала к базе одной транзакцией."""
+        with self._lock, self.conn:
+            cur = self.conn.cursor()
+            for op in ops:
+                self._apply(cur, op)
+
+    def _apply(self, cur, op):
+        kind, key = op.get("op"), op.get("key")
+        if kind != "set" and key not in ("wallets", "categories") + RECORD_TABLES:
+            logger.error(f"SQLite: неподдерживаемая операция {op}")
+            return
+        if kind == "set":
+            self._set_meta(cur, key, op.get("value"))
+        elif kind == "add":
+            items = op.get("items", [])
+            if key == "wallets":
+                self._insert_wallets(cur, items)
+            elif key == "categories":
+                self._insert_categories(cur, items)
+            else:
+                self._insert_records(cur, key, items)
+        elif kind == "del":
+            ids = op.get("ids", [])
+            if key in ("wallets", "categories"):
+                cur.executemany(f"DELETE FROM {key} WHERE name = ?", [(i,) for i in ids])
+            else:
+                match = op.get("match") or {}
+                # IS, а не =: условие «поля нет» (None) должно находить NULL
+                where = "".join(f" AND {f} IS ?" for f in match if f in RECORD_FIELDS)
+                params = tuple(v for f, v in match.items() if f in RECORD_FIELDS)
+                cur.executemany(f"DELETE FROM {key} WHERE id = ?{where}", [(i,) + params for i in ids])
+        elif kind == "upd":
+            fields = op.get("fields") or {}
+            if key == "wallets":
+                columns, where = ("currency", "balance"), "name"
+            elif key == "categories":
+                columns, where = (), "name"
+            else:
+                columns, where = RECORD_FIELDS, "id"
+            known = [f for f in fields if f in columns]
+            unknown = {f: v for f, v in fields.items() if f not in columns}
+            if unknown and key == "categories":
+                logger.error(f"SQLite: поля не сохранены в {key}: {set(unknown)}")
+            elif unknown:
+                # Прочие поля кошельков и записей лежат в JSON-колонке extra
+                row = cur.execute(f"SELECT extra FROM {key} WHERE {where} = ?", (op.get("id"),)).fetchone()
+                if row is not None:
+                    extra = json.loads(row[0]) if row[0] else {}
+                    extra.update(unknown)
+                    cur.execute(f"UPDATE {key} SET extra = ? WHERE {where} = ?",
+                                (json.dumps(extra, ensure_ascii=False), op.get("id")))
+            if known:
+                cur.execute(
+                    f"UPDATE {key} SET {', '.join(f + ' = ?' for f in known)} WHERE {where} = ?",
+                    tuple(fields[f] for f in known) + (op.get("id"),),
+                )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def migrate_json_to_sqlite(json_file, target):
+    """Разовый перенос данных из data.json (вместе с журналом, если он есть) в SQLite.
+
+    target — путь к базе или уже открытый SqliteStorage.
+    """
+    data = JournalStorage(json_file, json_file + ".journal").load()
+    db = SqliteStorage(target) if isinstance(target, str) else target
+    db.save(data)
+    logger.info(f"Данные из {json_file} перенесены в {db.db_file}")
+    return db
+
+
+def _shallow_snapshot(data):
+    """Копия списков и самих записей (без глубокого копирования значений).
+
+    Снимается под замком DataStore, поэтому фоновый поток сериализует согласованное
+    состояние, пока UI продолжает менять записи (баланс, deleted_at и т. п.).
+    """
+    def copy_items(items):
+        return [dict(item) if isinstance(item, dict) else item for item in items]
+
+    return {
+        k: copy_items(v) if isinstance(v, list) else dict(v) if isinstance(v, dict) else v
+        for k, v in list(data.items())
+    }
+
+
+class WriteBehindStorage:
+    """Отложенная запись поверх любого хранилища.
+
+    commit() только помечает данные изменёнными и копит операции, а фоновый поток
+    после паузы WRITE_BEHIND_DELAY сбрасывает всю пачку одним вызовом хранилища.
+    Серия изменений (например, удаление кошелька со всеми записями) превращается
+    в одну запись на диск, а поток интерфейса никогда не ждёт файловую систему.
+    """
+
+    def __init__(self, inner, delay=WRITE_BEHIND_DELAY, max_delay=WRITE_BEHIND_MAX_DELAY):
+        self.inner = inner
+        self.delay = delay
+        self.max_delay = max_delay
+        self._cond = Condition()
+        self._data = None
+        self._ops = []
+        self._full_save = False
+        self._dirty_since = None
+        self._deadline = None
+        self._writing = False
+        self._closed = False
+        # Замок данных приложения (DataStore.lock): копия для записи снимается под ним
+        self.lock = None
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def load(self):
+        self.flush()
+        return self.inner.load()
+
+    def commit(self, data, ops):
+        # Операции фиксируются сразу: записи могут измениться до фактической записи
+        frozen = json.loads(json.dumps(list(ops), ensure_ascii=False))
+        self._mark_dirty(data, frozen, full_save=False)
+
+    def save(self, data):
+        self._mark_dirty(data, [], full_save=True)
+
+    def _mark_dirty(self, data, ops, full_save):
+        with self._cond:
+            now = time.monotonic()
+            self._data = data
+            self._ops.extend(ops)
+            self._full_save = self._full_save or full_save
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._deadline = min(now + self.delay, self._dirty_since + self.max_delay)
+            self._cond.notify()
+
+    def _take_batch(self):
+        batch = (self._data, self._ops, self._full_save)
+        self._ops = []
+        self._full_save = False
+        self._dirty_since = None
+        self._deadline = None
+        return batch
+
+    def _write(self, batch):
+        data, ops, full_save = batch
+        with perf.span("save_data", ops=len(ops), full=full_save) as span:
+            if self.inner.needs_snapshot or full_save:
+                with self.lock or nullcontext():
+                    data = _shallow_snapshot(data)
+            written = 0
+            try:
+                if full_save:
+                    # Снимок уже содержит результат накопленных операций — повторно их не пишем
+                    written = self.inner.save(data) or 0
+                elif ops:
+                    written = self.inner.commit(data, ops) or 0
+            except Exception as e:
+                logger.error(f"Ошибка отложенной записи данных: {e}")
+            # SQLite размер записанного не сообщает
+            span.set(bytes=written)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (
+                        self._deadline is None or time.monotonic() < self._deadline):
+                    timeout = None if self._deadline is None else self._deadline - time.monotonic()
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take_batch()
+                self._writing = True
+            self._write(batch)
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def flush(self):
+        """Синхронно записывает всё накопленное (выход из приложения, перезагрузка)."""
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            if self._deadline is None:
+                return
+            batch = self._take_batch()
+            self._writing = True
+        try:
+            self._write(batch)
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.inner.close()
+
+
+def open_storage(mode=STORAGE_MODE):
+    """Хранилище выбранного режима с отложенной записью в фоновом потоке."""
+    if mode == "sqlite":
+        backend = SqliteStorage(DB_FILE, json_file=DATA_FILE)
+    elif mode == "journal":
+        backend = JournalStorage(DATA_FILE, JOURNAL_FILE)
+    else:
+        backend = JsonStorage(DATA_FILE)
+    return WriteBehindStorage(backend)
+
+
+# ---------------------------
+# Индексы записей
+# ---------------------------
+class RecordIndex:
+    """Индексы поверх app.data: id -> запись, кошелёк -> id, категория -> id, имя -> кошелёк.
+
+    Списки в app.data остаются источником истины и сохраняются на диск в прежнем виде;
+    все изменения записей и кошельков идут через add()/remove(), которые правят
+    списки на месте и сразу обновляют индексы.
+    Позиция записи в списке не хранится (удаление из начала сдвинуло бы весь хвост):
+    у записи постоянный номер слота, а позиция — число живых слотов перед ним,
+    которое дерево Фенвика отдаёт за O(log N). Удалённый слот остаётся «надгробием»;
+    когда надгробий больше, чем записей, слоты нумеруются заново.
+    За O(log N) находится только позиция: сам del из списка app.data сдвигает хвост
+    и остаётся O(N) — это один memmove указателей, без пересчёта индексов. Надгробий
+    в самом списке нет, потому что он сохраняется на диск как есть.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._listeners = []
+        self.rebuild()
+
+    def subscribe(self, listener):
+        """Подписывает объект на изменения записей.
+
+        У подписчика вызываются reset(data), record_added(key, rec) и record_removed(key, rec),
+        а при пачечных изменениях — records_added(key, recs) и records_removed(key, recs), если они есть.
+        """
+        self._listeners.append(listener)
+        listener.reset(self.data)
+
+    def _notify(self, method, *args):
+        for listener in self._listeners:
+            getattr(listener, method)(*args)
+
+    def _notify_batch(self, batch_method, method, key, recs):
+        """Пачка изменений: batch_method (records_added/records_removed) одним вызовом, иначе method по записи."""
+        for listener in self._listeners:
+            batch = getattr(listener, batch_method, None)
+            if batch is not None:
+                batch(key, recs)
+            else:
+                single = getattr(listener, method)
+                for rec in recs:
+                    single(key, rec)
+
+    def rebuild(self):
+        """Полная перестройка индексов (после загрузки данных)."""
+        # В старых файлах id доходов и расходов могут совпадать, поэтому id -> список записей
+        self._by_id = {key: {} for key in RECORD_TABLES}
+        self._by_wallet = {key: {} for key in RECORD_TABLES}
+        self._by_category = {key: {} for key in RECORD_TABLES}
+        self._slot = {}
+        self._tree = {}
+        self._next_slot = {}
+        self._dead = {}
+        for key in RECORD_TABLES:
+            for rec in self.data.setdefault(key, []):
+                self._index(key, rec)
+            self._reslot(key)
+        self._rebuild_wallets()
+        self._notify("reset", self.data)
+
+    def _rebuild_wallets(self):
+        self._wallets = {}
+        for wallet in self.data.setdefault("wallets", []):
+            self._wallets.setdefault(wallet.get("name"), wallet)
+
+    def _index(self, key, rec):
+        rid = rec.get("id")
+        self._by_id[key].setdefault(rid, []).append(rec)
+        self._by_wallet[key].setdefault(rec.get("wallet"), set()).add(rid)
+        self._by_category[key].setdefault(rec.get("category"), set()).add(rid)
+
+    def _unindex(self, key, rec):
+        rid = rec.get("id")
+        same_id = [r for r in self._by_id[key].get(rid, []) if r is not rec]
+        if same_id:
+            self._by_id[key][rid] = same_id
+        else:
+            self._by_id[key].pop(rid, None)
+        for index, field in ((self._by_wallet, "wallet"), (self._by_category, "category")):
+            value = rec.get(field)
+            if any(r.get(field) == value for r in same_id):
+                continue
+            ids = index[key].get(value)
+            if ids is not None:
+                ids.discard(rid)
+                if not ids:
+                    del index[key][value]
+
+    # --- слоты и позиции ---
+    def _reslot(self, key):
+        """Нумерует слоты списка key по текущему порядку записей (и убирает надгробия)."""
+        records = self.data.get(key, [])
+        size = len(records)
+        capacity = max(64, size * 2)
+        self._slot[key] = {id(rec): slot for slot, rec in enumerate(records)}
+        # tree[i] — число живых слотов среди (i - lowbit(i), i] (слот s хранится под номером s + 1)
+        self._tree[key] = [0] + [max(0, min(i, size) - (i - (i & -i))) for i in range(1, capacity + 1)]
+        self._next_slot[key] = size
+        self._dead[key] = 0
+
+    def _mark(self, key, slot, delta):
+        tree = self._tree[key]
+        i = slot + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _position(self, key, rec):
+        """Позиция записи в списке app.data[key]: число живых слотов перед её слотом."""
+        records = self.data[key]
+        slot = self._slot[key].get(id(rec))
+        if slot is not None:
+            tree, i, pos = self._tree[key], slot, 0
+            while i:
+                pos += tree[i]
+                i &= i - 1
+            if pos < len(records) and records[pos] is rec:
+                return pos
+        # Список изменили в обход индекса — нумеруем заново, тогда слот совпадает с позицией
+        self._reslot(key)
+        return self._slot[key].get(id(rec))
+
+    # --- записи ---
+    def get(self, key, rec_id, **match):
+        """Первая запись списка key с данным id (и полями match), либо None."""
+        for rec in self._by_id[key].get(rec_id, ()):
+            if all(rec.get(f) == v for f, v in match.items()):
+                return rec
+        return None
+
+    def records(self, key, ids):
+        """Записи списка key по набору id."""
+        by_id = self._by_id[key]
+        return [rec for rid in ids for rec in by_id.get(rid, ())]
+
+    def _append(self, key, rec):
+        records = self.data.setdefault(key, [])
+        records.append(rec)
+        slot = self._next_slot[key]
+        if slot + 1 >= len(self._tree[key]):
+            # Слоты кончились — перенумерация с запасом вдвое (вместе с только что добавленной записью)
+            self._reslot(key)
+        else:
+            self._slot[key][id(rec)] = slot
+            self._next_slot[key] = slot + 1
+            self._mark(key, slot, 1)
+        self._index(key, rec)
+
+    def add(self, key, rec):
+        """Добавляет запись в конец списка key."""
+        self._append(key, rec)
+        self._notify("record_added", key, rec)
+
+    def remove(self, key, rec_id, **match):
+        """Удаляет из списка key все записи с данным id (и полями match). Возвращает удалённые."""
+        removed = [r for r in self._by_id[key].get(rec_id, ())
+                   if all(r.get(f) == v for f, v in match.items())]
+        records = self.data[key]
+        for rec in removed:
+            pos = self._position(key, rec)
+            del records[pos]
+            self._mark(key, self._slot[key].pop(id(rec)), -1)
+            self._dead[key] += 1
+            self._unindex(key, rec)
+            self._notify("record_removed", key, rec)
+        if self._dead[key] > max(64, len(records)):
+            self._reslot(key)
+        return removed
+
+    def extend(self, key, recs):
+        """Добавляет пачку записей в конец списка key.
+
+        Подписчик с методом records_added(key, recs) получает пачку одним вызовом,
+        остальные — record_added на каждую запись.
+        """
+        recs = list(recs)
+        records = self.data.setdefault(key, [])
+        if len(recs) * 20 > len(records):
+            # Большая пачка: дешевле один раз перенумеровать слоты, чем отмечать каждую запись в дереве
+            records.extend(recs)
+            for rec in recs:
+                self._index(key, rec)
+            self._reslot(key)
+        else:
+            for rec in recs:
+                self._append(key, rec)
+        self._notify_batch("records_added", "record_added", key, recs)
+
+    def remove_by_wallet(self, key, wallet_name):
+        """Вынимает из списка key все записи кошелька за один проход. Возвращает их."""
+        return self.remove_where(key, lambda rec: rec.get("wallet") == wallet_name)
+
+    def remove_where(self, key, predicate):
+        """Вынимает из списка key все записи, для которых predicate истинен, за один проход.
+
+        Подписчики получают удалённые записи пачкой (records_removed), как и при extend().
+        """
+        records = self.data[key]
+        keep, moved = [], []
+        for rec in records:
+            (moved if predicate(rec) else keep).append(rec)
+        if not moved:
+            return moved
+        records[:] = keep
+        self._reslot(key)
+        for rec in moved:
+            self._unindex(key, rec)
+        self._notify_batch("records_removed", "record_removed", key, moved)
+        return moved
+
+    def ids_by_wallet(self, key, wallet_name):
+        return set(self._by_wallet[key].get(wallet_name, ()))
+
+    def ids_by_category(self, key, category):
+        return set(self._by_category[key].get(category, ()))
+
+    # --- кошельки ---
+    def wallet(self, name):
+        """Кошелёк по имени (первый, если имена повторяются)."""
+        return self._wallets.get(name)
+
+    def add_wallet(self, wallet):
+        self.data.setdefault("wallets", []).append(wallet)
+        self._wallets.setdefault(wallet.get("name"), wallet)
+
+    def remove_wallet(self, name):
+        """Удаляет все кошельки с данным именем."""
+        self.data["wallets"][:] = [w for w in self.data.get("wallets", []) if w.get("name") != name]
+        self._rebuild_wallets()
+
+
+class RecordQuery:
+    """Поиск записей по кошельку, категории, периоду и диапазону сумм.
+
+    Подписан на RecordIndex и держит для каждого списка вторичные индексы:
+    кошелёк -> множество записей, категория -> множество записей и два
+    отсортированных списка (дата, порядок, запись) и (сумма, порядок, запись).
+    Диапазоны дат и сумм находятся бинарным поиском, затем множества-кандидаты
+    пересекаются начиная с самого маленького. Записи идентифицируются
+    по id(rec), т. к. id в старых файлах могут повторяться. Порядок — номер
+    добавления записи: при одинаковой дате более поздняя запись считается новее.
+    Записи без даты лежат отдельно и в выдаче «новые первыми» идут в конце.
+    """
+
+    def __init__(self):
+        self.reset({})
+
+    def reset(self, data):
+        self._records = {key: {} for key in RECORD_TABLES}
+        self._date_of = {key: {} for key in RECORD_TABLES}
+        self._seq_of = {key: {} for key in RECORD_TABLES}
+        self._undated = {key: {} for key in RECORD_TABLES}
+        self._by_wallet = {key: {} for key in RECORD_TABLES}
+        self._by_category = {key: {} for key in RECORD_TABLES}
+        self._seq = 0
+        self._dates = {}
+        self._amounts = {}
+        for key in RECORD_TABLES:
+            records = data.get(key, [])
+            for rec in records:
+                self._index_sets(key, rec)
+            date_of, seq_of = self._date_of[key], self._seq_of[key]
+            self._dates[key] = sorted((d, seq_of[oid], oid) for oid, d in date_of.items() if d is not None)
+            self._amounts[key] = sorted((self._amount(rec), seq_of[id(rec)], id(rec)) for rec in records)
+
+    @staticmethod
+    def _date_key(rec):
+        date_str = rec.get("date")
+        return _date_sort_key(date_str) if day_bucket(date_str) is not None else None
+
+    @staticmethod
+    def _amount(rec):
+        try:
+            return float(rec.get("amount", 0))
+        except (TypeError, ValueError):
+            return 0.0
+
+    def _index_sets(self, key, rec):
+        oid = id(rec)
+        self._seq += 1
+        self._records[key][oid] = rec
+        self._seq_of[key][oid] = self._seq
+        date_key = self._date_of[key][oid] = self._date_key(rec)
+        if date_key is None:
+            self._undated[key][oid] = rec
+        self._by_wallet[key].setdefault(rec.get("wallet"), set()).add(oid)
+        self._by_category[key].setdefault(rec.get("category", "Без категории"), set()).add(oid)
+
+    def _entries(self, key, rec):
+        """Элементы записи в сортированных списках дат и сумм (дата — None, если её нет)."""
+        oid = id(rec)
+        seq = self._seq_of[key][oid]
+        date_key = self._date_of[key][oid]
+        return ((date_key, seq, oid) if date_key is not None else None), (self._amount(rec), seq, oid)
+
+    def record_added(self, key, rec):
+        if key not in self._records:
+            return
+        self._index_sets(key, rec)
+        date_entry, amount_entry = self._entries(key, rec)
+        if date_entry is not None:
+            insort(self._dates[key], date_entry)
+        insort(self._amounts[key], amount_entry)
+
+    def records_added(self, key, recs):
+        """Пачка записей (импорт): вместо вставки каждой — дописать и досортировать."""
+        if key not in self._records:
+            return
+        dates, amounts = self._dates[key], self._amounts[key]
+        for rec in recs:
+            self._index_sets(key, rec)
+            date_entry, amount_entry = self._entries(key, rec)
+            if date_entry is not None:
+                dates.append(date_entry)
+            amounts.append(amount_entry)
+        dates.sort()
+        amounts.sort()
+
+    def _unindex_sets(self, key, rec):
+        """Убирает запись из словарей и множеств. Возвращает False, если её нет в индексе."""
+        oid = id(rec)
+        if self._records.get(key, {}).pop(oid, None) is None:
+            return False
+        self._date_of[key].pop(oid, None)
+        self._seq_of[key].pop(oid, None)
+        self._undated[key].pop(oid, None)
+        for index, value in ((self._by_wallet[key], rec.get("wallet")),
+                             (self._by_category[key], rec.get("category", "Без категории"))):
+            members = index.get(value)
+            if members is not None:
+                members.discard(oid)
+                if not members:
+                    del index[value]
+        return True
+
+    def record_removed(self, key, rec):
+        if id(rec) not in self._records.get(key, {}):
+            return
+        entries = self._entries(key, rec)
+        self._unindex_sets(key, rec)
+        for ordered, entry in zip((self._dates[key], self._amounts[key]), entries):
+            if entry is None:
+                continue
+            pos = bisect_left(ordered, entry)
+            if pos < len(ordered) and ordered[pos] == entry:
+                del ordered[pos]
+
+    def records_removed(self, key, recs):
+        """Пачка удалённых записей (удаление кошелька, очистка корзины): сортированные списки — одним проходом."""
+        gone = {id(rec) for rec in recs if self._unindex_sets(key, rec)}
+        if not gone:
+            return
+        for ordered in (self._dates[key], self._amounts[key]):
+            ordered[:] = [item for item in ordered if item[2] not in gone]
+
+    @staticmethod
+    def _range(ordered, low, high, inclusive_high):
+        """Множество записей со значением в [low, high) (или [low, high], если inclusive_high)."""
+        lo = bisect_left(ordered, (low,)) if low is not None else 0
+        if high is None:
+            hi = len(ordered)
+        elif inclusive_high:
+            hi = bisect_left(ordered, (high, float("inf")))
+        else:
+            hi = bisect_left(ordered, (high,))
+        return {item[2] for item in ordered[lo:hi]}
+
+    def count(self, key, **conditions):
+        """Сколько записей списка key подходит под условия query (без ограничения limit)."""
+        found = self._match(key, **conditions)
+        return len(self._records[key]) if found is None else len(found)
+
+    def newest(self, key, start, stop):
+        """Записи списка key с номерами [start, stop) в порядке «новые первыми» (по дате записи).
+
+        Окно списков на экране берётся отсюда: O(log N + stop - start), без прохода по всему списку.
+        """
+        dates, records = self._dates[key], self._records[key]
+        size = len(dates)
+        result = [records[item[2]] for item in reversed(dates[max(size - stop, 0):max(size - start, 0)])]
+        if stop > size and self._undated[key]:
+            result.extend(islice(self._undated[key].values(), max(start - size, 0), stop - size))
+        return result
+
+    def _match(self, key, wallet=None, category=None, start=None, end=None,
+               min_amount=None, max_amount=None):
+        """Номера записей, подходящих под все условия; None — условий нет (подходят все)."""
+        candidates = []
+        if wallet is not None:
+            candidates.append(self._by_wallet[key].get(wallet, set()))
+        if category is not None:
+            candidates.append(self._by_category[key].get(category, set()))
+        if start is not None or end is not None:
+            candidates.append(self._range(self._dates[key], start and start.isoformat(),
+                                          end and end.isoformat(), False))
+        if min_amount is not None or max_amount is not None:
+            candidates.append(self._range(self._amounts[key], min_amount, max_amount, True))
+        found = None
+        if candidates:
+            candidates.sort(key=len)
+            found = set(candidates[0])
+            for other in candidates[1:]:
+                found &= other
+                if not found:
+                    break
+        return found
+
+    def query(self, key, limit=None, **conditions):
+        """Записи списка key, подходящие под все заданные условия, новые первыми.
+
+        Условия: wallet, category, start/end — даты (период [start, end)),
+        min_amount/max_amount — границы суммы включительно.
+        """
+        records = self._records[key]
+        found = self._match(key, **conditions)
+        date_of, seq_of = self._date_of[key], self._seq_of[key]
+        if found is not None and len(found) * 8 < len(records):
+            # Найдено немного — проще отсортировать найденное (без даты — в конце)
+            result = sorted(found, key=lambda oid: (date_of[oid] is not None, date_of[oid] or "", seq_of[oid]),
+                            reverse=True)[:limit]
+            return [records[oid] for oid in result]
+        # Иначе идём по индексу дат от новых к старым, пока не наберём limit
+        result = []
+        for item in reversed(self._dates[key]):
+            if found is None or item[2] in found:
+                result.append(records[item[2]])
+                if limit is not None and len(result) >= limit:
+                    return result
+        result.extend(rec for oid, rec in self._undated[key].items() if found is None or oid in found)
+        return result[:limit] if limit is not None else result
+
+
+def parse_record_filter(wallet="", category="", start_text="", end_text="", min_text="", max_text=""):
+    """Условия поиска из полей формы (пустые поля — без ограничения).
+
+    Даты вводятся как дд.мм.гггг (конечная включается). ValueError — при неверном формате.
+    """
+    conditions = {}
+    if wallet:
+        conditions["wallet"] = wallet
+    if category:
+        conditions["category"] = category
+    if (start_text or "").strip():
+        conditions["start"] = datetime.strptime(start_text.strip(), "%d.%m.%Y").date()
+    if (end_text or "").strip():
+        conditions["end"] = datetime.strptime(end_text.strip(), "%d.%m.%Y").date() + timedelta(days=1)
+    if (min_text or "").strip():
+        conditions["min_amount"] = float(min_text.strip().replace(",", "."))
+    if (max_text or "").strip():
+        conditions["max_amount"] = float(max_text.strip().replace(",", "."))
+    return conditions
+
+
+# ---------------------------
+# Агрегаты для статистики
+# ---------------------------
+def day_bucket(date_str):
+    """День записи (date) по строке "дд.мм.гггг чч:мм" (None, если дата некорректна)."""
+    if _date_sort_key(date_str) is None or not (date_str[0:2] + date_str[3:5] + date_str[6:10]).isdigit():
+        return None
+    try:
+        return date(int(date_str[6:10]), int(date_str[3:5]), int(date_str[0:2]))
+    except ValueError:
+        return None
+
+
+# Уровни свёртки временных рядов: подпись в интерфейсе -> код
+STATS_GRANULARITIES = {
+    "По дням": "day",
+    "По неделям": "week",
+    "По месяцам": "month",
+    "По кварталам": "quarter",
+    "По годам": "year",
+}
+
+
+def period_start(day, granularity):
+    """Начало периода (неделя с понедельника, месяц, квартал, год), в который попадает day."""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    if granularity == "year":
+        return date(day.year, 1, 1)
+    return day
+
+
+def stats_range(name, start_text="", end_text="", today=None):
+    """Границы периода [start, end) в датах; None — без ограничения.
+
+    Для «Свой период» даты вводятся как дд.мм.гггг, конечная дата включается.
+    """
+    today = today or date.today()
+    if name == "Последние 30 дней":
+        return today - timedelta(days=29), today + timedelta(days=1)
+    if name == "Этот год":
+        return date(today.year, 1, 1), date(today.year + 1, 1, 1)
+    if name == "Свой период":
+        start = end = None
+        if (start_text or "").strip():
+            start = datetime.strptime(start_text.strip(), "%d.%m.%Y").date()
+        if (end_text or "").strip():
+            end = datetime.strptime(end_text.strip(), "%d.%m.%Y").date() + timedelta(days=1)
+        return start, end
+    return None, None
+
+
+class StatsAggregates:
+    """Суммы доходов и расходов по дням и расходов по категориям.
+
+    Подписан на RecordIndex: добавление записи прибавляет её сумму,
+    удаление (в том числе перенос в корзину) — вычитает, поэтому
+    экран статистики всегда актуален без пересчёта всей истории.
+    Для каждой корзины хранится число записей, чтобы пустые корзины
+    исчезали без накопленной ошибки округления.
+    Дни — настоящие даты с годом; их отсортированный список (days) позволяет
+    выбирать период бинарным поиском и сворачивать его в недели, месяцы, кварталы и годы.
+    version растёт при каждом изменении — по нему экран понимает, что пора перерисовать графики.
+    """
+
+    def __init__(self, columns=None):
+        # ColumnarLedger (подписанный раньше) — начальные суммы берутся из него векторно
+        self.columns = columns
+        self.reset({})
+
+    def reset(self, data):
+        self.by_day = {"incomes": {}, "expenses": {}}
+        self.days = {"incomes": [], "expenses": []}
+        self.by_category = {}
+        self._counts = {}
+        self.version = getattr(self, "version", 0) + 1
+        if self.columns is None:
+            for key in ("incomes", "expenses"):
+                for rec in data.get(key, []):
+                    self._apply(key, rec, 1)
+            return
+        for key in ("incomes", "expenses"):
+            days, sums, counts = self.columns.group_by_period(key, "D")
+            totals = self.by_day[key]
+            for day, amount, count in zip(days.astype(object), sums, counts):
+                totals[day] = float(amount)
+                self._counts[(id(totals), day)] = int(count)
+            # group_by_period уже отсортирован по времени
+            self.days[key] = list(totals)
+        for category, (amount, count) in self.columns.group_by_category("expenses").items():
+            self.by_category[category] = amount
+            self._counts[(id(self.by_category), category)] = count
+
+    def record_added(self, key, rec):
+        self._apply(key, rec, 1)
+
+    def record_removed(self, key, rec):
+        self._apply(key, rec, -1)
+
+    def _bump(self, totals, bucket, amount, sign):
+        """Меняет сумму корзины. Возвращает 1, если корзина появилась, -1 — если исчезла."""
+        count_key = (id(totals), bucket)
+        count = self._counts.get(count_key, 0) + sign
+        if count <= 0:
+            self._counts.pop(count_key, None)
+            return -1 if totals.pop(bucket, None) is not None else 0
+        self._counts[count_key] = count
+        created = bucket not in totals
+        totals[bucket] = totals.get(bucket, 0) + sign * amount
+        return 1 if created else 0
+
+    def _apply(self, key, rec, sign):
+        if key not in self.by_day:
+            return
+        try:
+            amount = float(rec.get("amount", 0))
+        except (TypeError, ValueError):
+            amount = 0
+        day = day_bucket(rec.get("date"))
+        if day is not None:
+            change = self._bump(self.by_day[key], day, amount, sign)
+            days = self.days[key]
+            if change > 0:
+                insort(days, day)
+            elif change < 0:
+                del days[bisect_left(days, day)]
+        if key == "expenses":
+            self._bump(self.by_category, rec.get("category", "Без категории"), amount, sign)
+        self.version += 1
+
+    def series(self, key, start=None, end=None, granularity="day"):
+        """Суммы за [start, end), свёрнутые до granularity: {начало периода: сумма}.
+
+        Нужный диапазон дней находится бинарным поиском, вся история не просматривается.
+        """
+        days = self.days[key]
+        lo = bisect_left(days, start) if start is not None else 0
+        hi = bisect_left(days, end) if end is not None else len(days)
+        totals = self.by_day[key]
+        result = {}
+        for day in days[lo:hi]:
+            period = period_start(day, granularity)
+            result[period] = result.get(period, 0) + totals[day]
+        return result
+
+
+class ColumnarLedger:
+    """Колоночное представление доходов и расходов на NumPy.
+
+    Для каждого списка хранятся массивы дат (datetime64[m]), сумм (float64),
+    кодов категорий, кошельков и валют. Строится один раз при загрузке (даты разбираются
+    пачкой), новые записи дописываются в конец, удалённые помечаются в alive.
+    Группировки по дню/месяцу/категории и суммы за период считаются векторно.
+    """
+
+    KEYS = ("incomes", "expenses")
+    FIELDS = (("ids", np.int64), ("dates", "datetime64[m]"), ("amounts", np.float64),
+              ("category", np.int32), ("wallet", np.int32), ("currency", np.int32), ("alive", np.bool_))
+
+    def __init__(self):
+        self.reset({})
+
+    # --- построение и обновление ---
+    def reset(self, data):
+        self.categories = []
+        self._category_codes = {}
+        self.wallets = []
+        self._wallet_codes = {}
+        self.currencies = []
+        self._currency_codes = {}
+        self._blocks = {}
+        for key in self.KEYS:
+            self._build(key, data.get(key, []))
+
+    @staticmethod
+    def _code(value, names, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    @staticmethod
+    def _minute(date_str):
+        """Строка даты записи в формате, понятном datetime64."""
+        return _date_sort_key(date_str) if day_bucket(date_str) is not None else "NaT"
+
+    @staticmethod
+    def _amount(rec):
+        try:
+            return float(rec.get("amount", 0))
+        except (TypeError, ValueError):
+            return 0.0
+
+    @staticmethod
+    def _rec_id(rec):
+        try:
+            return int(rec.get("id", -1))
+        except (TypeError, ValueError):
+            return -1
+
+    @staticmethod
+    def _parse_dates(strings):
+        try:
+            return np.array(strings, dtype="datetime64[m]")
+        except ValueError:
+            # Некорректное время в отдельных записях — разбираем по одной
+            parsed = []
+            for value in strings:
+                try:
+                    parsed.append(np.datetime64(value, "m"))
+                except ValueError:
+                    parsed.append(np.datetime64("NaT"))
+            return np.array(parsed, dtype="datetime64[m]")
+
+    def _build(self, key, records):
+        size = len(records)
+        capacity = max(64, size * 2)
+        arrays = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.FIELDS}
+        arrays["dates"][:] = np.datetime64("NaT")
+        if size:
+            arrays["ids"][:size] = [self._rec_id(r) for r in records]
+            arrays["dates"][:size] = self._parse_dates([self._minute(r.get("date")) for r in records])
+            arrays["amounts"][:size] = [self._amount(r) for r in records]
+            arrays["category"][:size] = [
+                self._code(r.get("category", "Без категории"), self.categories, self._category_codes)
+                for r in records]
+            arrays["wallet"][:size] = [
+                self._code(r.get("wallet"), self.wallets, self._wallet_codes) for r in records]
+            arrays["currency"][:size] = [
+                self._code(r.get("currency", "RUB"), self.currencies, self._currency_codes) for r in records]
+            arrays["alive"][:size] = True
+        self._blocks[key] = {
+            "arrays": arrays,
+            "size": size,
+            "rows": {id(rec): row for row, rec in enumerate(records)},
+        }
+
+    def record_added(self, key, rec):
+        block = self._blocks.get(key)
+        if block is None:
+            return
+        arrays = block["arrays"]
+        row = block["size"]
+        if row == len(arrays["alive"]):
+            for name in arrays:
+                grown = np.zeros(row * 2, dtype=arrays[name].dtype)
+                if name == "dates":
+                    grown[:] = np.datetime64("NaT")
+                grown[:row] = arrays[name]
+                arrays[name] = grown
+        arrays["ids"][row] = self._rec_id(rec)
+        arrays["dates"][row] = self._parse_dates([self._minute(rec.get("date"))])[0]
+        arrays["amounts"][row] = self._amount(rec)
+        arrays["category"][row] = self._code(
+            rec.get("category", "Без категории"), self.categories, self._category_codes)
+        arrays["wallet"][row] = self._code(rec.get("wallet"), self.wallets, self._wallet_codes)
+        arrays["currency"][row] = self._code(rec.get("currency", "RUB"), self.currencies, self._currency_codes)
+        arrays["alive"][row] = True
+        block["rows"][id(rec)] = row
+        block["size"] = row + 1
+
+    def record_removed(self, key, rec):
+        block = self._blocks.get(key)
+        if block is None:
+            return
+        row = block["rows"].pop(id(rec), None)
+        if row is not None:
+            block["arrays"]["alive"][row] = False
+
+    # --- запросы ---
+    def _select(self, key, start=None, end=None, wallet=None, category=None, dated=False):
+        """Маска живых строк с фильтрами: дата в [start, end), кошелёк, категория."""
+        block = self._blocks[key]
+        size = block["size"]
+        arrays = {name: a[:size] for name, a in block["arrays"].items()}
+        mask = arrays["alive"].copy()
+        if dated or start is not None or end is not None:
+            mask &= ~np.isnat(arrays["dates"])
+        if start is not None:
+            mask &= arrays["dates"] >= np.datetime64(start, "m")
+        if end is not None:
+            mask &= arrays["dates"] < np.datetime64(end, "m")
+        for value, codes, column in ((wallet, self._wallet_codes, "wallet"),
+                                     (category, self._category_codes, "category")):
+            if value is not None:
+                code = codes.get(value)
+                if code is None:
+                    mask[:] = False
+                else:
+                    mask &= arrays[column] == code
+        return arrays, mask
+
+    def total(self, key, **filters):
+        """Сумма по списку key с фильтрами _select."""
+        arrays, mask = self._select(key, **filters)
+        return float(arrays["amounts"][mask].sum())
+
+    def count(self, key, **filters):
+        arrays, mask = self._select(key, **filters)
+        return int(mask.sum())
+
+    def group_by_period(self, key, unit="D", **filters):
+        """Суммы по периодам: unit "D" — дни, "W" — недели, "M" — месяцы, "Y" — годы.
+
+        Возвращает (периоды datetime64, суммы, количества записей), отсортированные по времени.
+        """
+        arrays, mask = self._select(key, dated=True, **filters)
+        periods = arrays["dates"][mask].astype(f"datetime64[{unit}]")
+        uniq, inverse = np.unique(periods, return_inverse=True)
+        sums = np.bincount(inverse, weights=arrays["amounts"][mask], minlength=len(uniq))
+        counts = np.bincount(inverse, minlength=len(uniq))
+        return uniq, sums, counts
+
+    def group_by_category(self, key, **filters):
+        """Словарь категория -> (сумма, количество записей)."""
+        arrays, mask = self._select(key, **filters)
+        codes = arrays["category"][mask]
+        sums = np.bincount(codes, weights=arrays["amounts"][mask], minlength=len(self.categories))
+        counts = np.bincount(codes, minlength=len(self.categories))
+        return {self.categories[i]: (float(sums[i]), int(counts[i])) for i in np.nonzero(counts)[0]}
+
+    def total_rub(self, key, rate, **filters):
+        """Сумма в рублях по курсу на день каждой записи.
+
+        Записи группируются по паре (валюта, день), поэтому rate(валюта, день)
+        вызывается один раз на пару, а не на каждую запись. Для записей без даты
+        день передаётся как None (последний известный курс).
+        """
+        arrays, mask = self._select(key, **filters)
+        days = arrays["dates"][mask].astype("datetime64[D]")
+        undated = np.isnat(days)
+        # Номер дня сдвинут, чтобы поместиться в младшие 32 бита; 0 — «без даты»
+        day_numbers = np.where(undated, 0, days.view(np.int64) + (1 << 31))
+        pairs = (arrays["currency"][mask].astype(np.int64) << 32) | day_numbers
+        uniq, inverse = np.unique(pairs, return_inverse=True)
+        sums = np.bincount(inverse, weights=arrays["amounts"][mask], minlength=len(uniq))
+        total = 0.0
+        for pair, amount in zip(uniq.tolist(), sums.tolist()):
+            currency = self.currencies[pair >> 32]
+            day_number = pair & 0xFFFFFFFF
+            day = None if day_number == 0 else date(1970, 1, 1) + timedelta(days=day_number - (1 << 31))
+            total += amount * rate(currency, day)
+        return total
+
+
+# Хранить записи в корзине не дольше стольких дней (None — хранить всегда)
+TRASH_RETENTION_DAYS = None
+
+# Переиспользовать id окончательно удалённых записей (как делала старая нумерация с поиском «дыр»)
+REUSE_FREED_IDS = False
+
+
+class IdAllocator:
+    """Выдача id новых записей за O(1).
+
+    Верхняя граница выданных id хранится в данных (next_id), поэтому id
+    окончательно удалённых записей не выдаются повторно после перезапуска.
+    При REUSE_FREED_IDS освобождённые id копятся в списке free_ids и выдаются первыми.
+    Методы защищены замком — id можно брать из фоновых потоков импорта.
+    """
+
+    def __init__(self, data, reuse_freed=REUSE_FREED_IDS):
+        self.data = data
+        self.reuse_freed = reuse_freed
+        self._lock = Lock()
+        high = 0
+        for key in RECORD_TABLES:
+            for rec in data.get(key, []):
+                try:
+                    high = max(high, int(rec.get("id", 0)))
+                except (ValueError, TypeError):
+                    pass
+        try:
+            stored = int(data.get("next_id") or 1)
+        except (ValueError, TypeError):
+            stored = 1
+        data["next_id"] = max(stored, high + 1)
+        if reuse_freed:
+            data.setdefault("free_ids", [])
+
+    def allocate(self):
+        """Возвращает новый id."""
+        with self._lock:
+            free_ids = self.data.get("free_ids")
+            if self.reuse_freed and free_ids:
+                return free_ids.pop()
+            new_id = self.data["next_id"]
+            self.data["next_id"] = new_id + 1
+            return new_id
+
+    def allocate_many(self, count):
+        """Резервирует сразу count id подряд (для пакетного импорта)."""
+        with self._lock:
+            start = self.data["next_id"]
+            self.data["next_id"] = start + count
+            return range(start, start + count)
+
+    def release(self, rec_id):
+        """Возвращает id окончательно удалённой записи в список свободных."""
+        if not self.reuse_freed or not isinstance(rec_id, int):
+            return
+        with self._lock:
+            self.data.setdefault("free_ids", []).append(rec_id)
+
+    def ops(self):
+        """Операции журнала для сохранения состояния счётчика."""
+        with self._lock:
+            ops = [op_set("next_id", self.data["next_id"])]
+            if self.reuse_freed:
+                ops.append(op_set("free_ids", list(self.data.get("free_ids", []))))
+            return ops
+
+
+def expired_trash_records(trash, days):
+    """Записи корзины, удалённые больше days дней назад (по deleted_at)."""
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    expired = []
+    for rec in trash:
+        deleted_key = _date_sort_key(rec.get("deleted_at"))
+        if deleted_key and deleted_key < cutoff:
+            expired.append(rec)
+    return expired
+
+
+# ---------------------------
+# Доступ к данным приложения
+# ---------------------------
+def writes_data(method):
+    """Декоратор для методов DataStore, меняющих данные.
+
+    В потоке-владельце метод выполняется под замком DataStore. Если у хранилища
+    задан dispatch (приложение передаёт перенос в основной поток через Clock),
+    вызов из другого потока не меняет данные сам, а передаётся в dispatch.
+    Без dispatch (командная строка, скрипты) метод просто берёт замок.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.dispatch is not None and current_thread() is not self.owner_thread:
+            self.dispatch(wrapper, self, *args, **kwargs)
+            return None
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class DataStore:
+    """Данные приложения вместе с индексами, агрегатами, счётчиком id и хранилищем.
+
+    Писатель один — поток, создавший DataStore (в приложении это основной поток):
+    изменения data выполняются под lock (см. writes_data и write()), под этим же
+    замком фоновая запись на диск снимает копию данных, а фоновые потоки читают
+    через read()/snapshot(). Фоновая работа (курсы, импорт, очистка корзины)
+    не меняет данные сама, а передаёт изменения владельцу через dispatch.
+    """
+
+    def __init__(self, storage, dispatch=None):
+        self.storage = storage
+        self.dispatch = dispatch
+        self.owner_thread = current_thread()
+        self.lock = RLock()
+        if hasattr(storage, "lock"):
+            storage.lock = self.lock
+        with perf.span("load_data") as span:
+            self.data = storage.load()
+            span.set(records=sum(len(self.data.get(key, [])) for key in RECORD_TABLES))
+        with perf.span("build_indexes"):
+            self.index = RecordIndex(self.data)
+            self.columns = ColumnarLedger()
+            self.index.subscribe(self.columns)
+            self.aggregates = StatsAggregates(self.columns)
+            self.index.subscribe(self.aggregates)
+            self.query = RecordQuery()
+            self.index.subscribe(self.query)
+            self.id_allocator = IdAllocator(self.data)
+
+    @contextmanager
+    def write(self):
+        """Изменение данных (только поток-владелец)."""
+        with self.lock:
+            yield self.data
+
+    @contextmanager
+    def read(self):
+        """Согласованное чтение данных из любого потока."""
+        with self.lock:
+            yield self.data
+
+    def snapshot(self, key):
+        """Копия списка записей key — для обработки в фоновом потоке."""
+        with self.lock:
+            return list(self.data.get(key, []))
+
+    def commit(self, *ops):
+        """Фиксирует изменения: операции уходят в (фоновую) запись хранилища."""
+        perf.count("commits")
+        perf.count("commit_ops", len(ops))
+        with self.lock:
+            self.storage.commit(self.data, ops)
+
+    def record_days(self):
+        """Дни, в которые есть доходы или расходы (новые первыми)."""
+        with self.lock:
+            days = set(self.aggregates.days["incomes"]) | set(self.aggregates.days["expenses"])
+        return sorted(days, reverse=True)
+
+    # --- записи и категории ---
+
+    def allocate_id(self):
+        """Нумерация id: общий счётчик для доходов, расходов и корзины, чтобы не пересекались."""
+        return self.id_allocator.allocate()
+
+    @writes_data
+    def add_record(self, key, wallet_name, category, amount, when=None):
+        """Добавляет доход (key="incomes") или расход ("expenses") и меняет баланс кошелька.
+
+        Проверки (кошелёк существует, хватает средств) — на стороне вызывающего.
+        Возвращает новую запись.
+        """
+        wallet = self.index.wallet(wallet_name)
+        sign = 1 if key == "incomes" else -1
+        record = {
+            "id": self.allocate_id(),
+            "currency": wallet.get("currency", "RUB"),
+            "amount": amount,
+            "wallet": wallet_name,
+            "category": category,
+            "date": (when or datetime.now()).strftime("%d.%m.%Y %H:%M")
+        }
+        self.index.add(key, record)
+        wallet["balance"] = float(wallet.get("balance", 0)) + sign * amount
+        self.commit(op_add(key, record), op_upd("wallets", wallet_name, balance=wallet["balance"]),
+                    *self.id_allocator.ops())
+        return record
+
+    @writes_data
+    def add_category(self, name):
+        """Добавляет категорию; False — такая уже есть."""
+        if name in self.data["categories"]:
+            return False
+        self.data["categories"].append(name)
+        self.commit(op_add("categories", name))
+        return True
+
+    @writes_data
+    def remove_category(self, name):
+        """Удаляет категорию (записи с ней не трогаются); False — такой нет."""
+        if name not in self.data["categories"]:
+            return False
+        self.data["categories"].remove(name)
+        self.commit(op_del("categories", [name]))
+        return True
+
+    # --- импорт ---
+
+    def import_statement(self, rows, wallet=None, default_category="Без категории", progress=None,
+                         on_done=None):
+        """Импортирует строки выписки (см. read_statement): проверка без замка, запись — одной пачкой.
+
+        Возвращает результат prepare_import (число записей и ошибки по строкам). Итог записи
+        (batch["imported"], batch["failed"]) известен после apply_import — см. on_done там.
+        """
+        with self.lock:
+            wallets = {w.get("name"): w.get("currency", "RUB") for w in self.data.get("wallets", [])}
+            categories = set(self.data.get("categories", []))
+        batch = prepare_import(rows, wallets, categories, wallet, default_category, progress=progress)
+        self.apply_import(batch, on_done)
+        return batch
+
+    @writes_data
+    def apply_import(self, batch, on_done=None):
+        """Добавляет проверенные записи импорта: id выдаются подряд, баланс каждого
+        кошелька меняется один раз, все изменения сохраняются одним commit.
+
+        Если кошельки строк удалили, пока выписка проверялась, ничего не меняет и пишет
+        причину в batch["failed"] — не исключение: из фонового потока метод выполняется
+        через dispatch, и исключение не дошло бы до вызывающего. Число добавленных записей —
+        в batch["imported"]. В конце в любом случае вызывается on_done(batch).
+        """
+        missing = [name for name in batch["balances"] if self.index.wallet(name) is None]
+        if missing:
+            batch["failed"] = f"Кошельки удалены во время импорта: {', '.join(missing)}"
+            batch["imported"] = 0
+        else:
+            batch["imported"] = self._add_import(batch)
+        if on_done is not None:
+            on_done(batch)
+        return batch["imported"]
+
+    def _add_import(self, batch):
+        total = sum(len(records) for records in batch["records"].values())
+        if not total:
+            return 0
+        ids = iter(self.id_allocator.allocate_many(total))
+        ops = []
+        for key, records in batch["records"].items():
+            if not records:
+                continue
+            for rec in records:
+                rec["id"] = next(ids)
+            self.index.extend(key, records)
+            ops.append(op_add(key, *records))
+        for name, delta in batch["balances"].items():
+            wallet = self.index.wallet(name)
+            wallet["balance"] = round(float(wallet.get("balance", 0)) + delta, 2)
+            ops.append(op_upd("wallets", name, balance=wallet["balance"]))
+        new_categories = [c for c in batch["categories"] if c not in self.data["categories"]]
+        if new_categories:
+            self.data["categories"].extend(new_categories)
+            ops.append(op_add("categories", *new_categories))
+        self.commit(*ops, *self.id_allocator.ops())
+        logger.debug("Импортировано записей: %d", total)
+        return total
+
+    # --- корзина ---
+
+    @writes_data
+    def move_to_trash(self, key, rec_id):
+        """Перемещает запись в корзину, корректирует баланс и логирует шаги."""
+        rec = self.index.get(key, rec_id)
+        if not rec:
+            logger.warning("Запись id=%s для %s не найдена, корзина без изменений", rec_id, key)
+            return
+
+        # Корректируем баланс
+        wallet_name = rec.get("wallet")
+        amount = float(rec.get("amount", 0))
+        sign = -1 if key == "incomes" else 1  # Для доходов вычитаем, для расходов прибавляем
+        ops = []
+        wallet = self.index.wallet(wallet_name)
+        if wallet:
+            wallet["balance"] = float(wallet.get("balance", 0)) + sign * amount
+            ops.append(op_upd("wallets", wallet_name, balance=wallet["balance"]))
+
+        # Добавляем метку времени и тип записи
+        rec["deleted_at"] = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+        rec["record_type"] = key
+        logger.debug("В корзину добавлен id=%s, тип=%s", rec_id, key)
+
+        # Удаляем из исходного списка
+        self.index.remove(key, rec_id)
+        self.index.add("deleted_records", rec)
+        ops.append(op_del(key, [rec_id]))
+        ops.append(op_add("deleted_records", rec))
+        self.commit(*ops)
+
+    def restore_from_trash(self, rec_id):
+        """Восстановление записи из корзины с проверками и корректировкой баланса."""
+        logger.debug("Попытка восстановить id=%s. Записей в корзине: %d", rec_id, len(self.data.get("deleted_records", [])))
+        if self.restore_many_from_trash([rec_id]):
+            logger.debug("Восстановлен id=%s. Осталось в корзине: %d", rec_id, len(self.data["deleted_records"]))
+
+    @writes_data
+    def restore_many_from_trash(self, rec_ids):
+        """Восстанавливает несколько записей из корзины за один проход и одно сохранение.
+
+        Возвращает число восстановленных записей.
+        """
+        restored = []
+        seen = set()
+        for rec_id in rec_ids:
+            rec = self.index.get("deleted_records", rec_id)
+            if not rec:
+                logger.warning("Запись id=%s не найдена в корзине", rec_id)
+                continue
+            key = rec.get("record_type")
+            if key not in ["incomes", "expenses"]:
+                logger.error("Некорректный record_type при восстановлении: %s", key)
+                continue
+            if (rec_id, key) not in seen:
+                seen.add((rec_id, key))
+                restored.append(rec)
+        if not restored:
+            return 0
+
+        ops = []
+        changed_wallets = {}
+        for rec in restored:
+            key = rec["record_type"]
+            # Корректируем баланс обратно
+            wallet_name = rec.get("wallet")
+            amount = float(rec.get("amount", 0))
+            sign = 1 if key == "incomes" else -1  # Для доходов прибавляем, для расходов вычитаем
+            wallet = self.index.wallet(wallet_name)
+            if wallet:
+                wallet["balance"] = float(wallet.get("balance", 0)) + sign * amount
+                changed_wallets[wallet_name] = wallet
+            self.index.add(key, rec)
+
+        # Удаляем только конкретные записи (учитываем тип)
+        self.index.remove_where("deleted_records", lambda r: (r.get("id"), r.get("record_type")) in seen)
+
+        for key in ("incomes", "expenses"):
+            batch = [rec for rec in restored if rec["record_type"] == key]
+            if batch:
+                ops.append(op_add(key, *batch))
+                ops.append(op_del("deleted_records", [rec.get("id") for rec in batch], record_type=key))
+        for wallet_name, wallet in changed_wallets.items():
+            ops.append(op_upd("wallets", wallet_name, balance=wallet["balance"]))
+        self.commit(*ops)
+        return len(restored)
+
+    @writes_data
+    def permanently_delete_from_trash(self, rec_id):
+        """Полное удаление записи в корзине"""
+        ops = [op_del("deleted_records", [rec_id])]
+        if self.index.remove("deleted_records", rec_id):
+            ops += self._release_ids([rec_id])
+        self.commit(*ops)
+
+    def _release_ids(self, rec_ids):
+        """Отдаёт аллокатору id, которых больше нет ни в одном списке."""
+        if not self.id_allocator.reuse_freed:
+            return []
+        for rec_id in rec_ids:
+            if not any(self.index.get(key, rec_id) for key in RECORD_TABLES):
+                self.id_allocator.release(rec_id)
+        return self.id_allocator.ops()
+
+    @writes_data
+    def _purge_trash(self, predicate):
+        """Окончательно удаляет из корзины все записи, подходящие под predicate, одним сохранением."""
+        removed = self.index.remove_where("deleted_records", predicate)
+        if not removed:
+            return 0
+        # В корзине id могут повторяться (запись удаляли, восстанавливали и снова удаляли),
+        # поэтому на диске удаляем по id вместе с типом и временем удаления — ровно вынутые записи
+        groups = {}
+        for rec in removed:
+            groups.setdefault((rec.get("record_type"), rec.get("deleted_at")), []).append(rec.get("id"))
+        ops = [op_del("deleted_records", ids, record_type=record_type, deleted_at=deleted_at)
+               for (record_type, deleted_at), ids in groups.items()]
+        ops += self._release_ids([rec.get("id") for rec in removed])
+        self.commit(*ops)
+        logger.debug("Из корзины окончательно удалено записей: %d", len(removed))
+        return len(removed)
+
+    def permanently_delete_many_from_trash(self, rec_ids):
+        """Окончательно удаляет записи корзины с указанными id."""
+        rec_ids = set(rec_ids)
+        return self._purge_trash(lambda r: r.get("id") in rec_ids)
+
+    def empty_trash(self):
+        """Очищает корзину полностью."""
+        return self._purge_trash(lambda r: True)
+
+    def purge_trash_older_than(self, days):
+        """Окончательно удаляет записи, пролежавшие в корзине больше days дней.
+
+        Устаревшие записи ищутся по копии корзины в вызывающем потоке (можно в фоновом),
+        в основной поток уходит только само удаление.
+        """
+        expired = {id(rec): rec for rec in expired_trash_records(self.snapshot("deleted_records"), days)}
+        if not expired:
+            return 0
+        # Сравниваем и по id(rec), и по самой записи: словарь держит записи, их id не переиспользуются
+        return self._purge_trash(lambda r: expired.get(id(r)) is r)
+
+    # --- кошельки ---
+
+    @writes_data
+    def add_wallet(self, name, currency, balance):
+        """Добавляет новый кошелёк в данные и сохраняет их."""
+        # Начальный баланс нужен recompute_balances()
+        wallet = {"name": name, "currency": currency, "balance": balance, "opening_balance": balance}
+        self.index.add_wallet(wallet)
+        self.commit(op_add("wallets", wallet))
+
+    @writes_data
+    def delete_wallet(self, name):
+        """Удаляет кошелёк по имени и перемещает связанные записи в корзину.
+
+        Записи вынимаются одной пачкой за проход по каждому списку и сохраняются
+        одним commit; баланс не корректируется — кошелёк всё равно удаляется.
+        """
+        deleted_at = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+        moved = []
+        ops = []
+        # Переместить связанные записи в корзину
+        for key in ["incomes", "expenses"]:
+            if not self.index.ids_by_wallet(key, name):
+                continue
+            batch = self.index.remove_by_wallet(key, name)
+            for rec in batch:
+                rec["deleted_at"] = deleted_at
+                rec["record_type"] = key
+            ops.append(op_del(key, [rec.get("id") for rec in batch], wallet=name))
+            moved.extend(batch)
+        if moved:
+            self.index.extend("deleted_records", moved)
+            ops.append(op_add("deleted_records", *moved))
+        logger.debug("Кошелёк %s: в корзину перемещено записей: %d", name, len(moved))
+        # Удалить кошелек
+        self.index.remove_wallet(name)
+        ops.append(op_del("wallets", [name]))
+        self.commit(*ops)
+
+    def calculate_total_balance(self):
+        """Подсчитывает итоговый баланс по всем кошелькам."""
+        total_balance = {}
+        for wallet in self.data.get("wallets", []):
+            currency = wallet.get("currency")
+            balance = wallet.get("balance", 0)
+            try:
+                balance = float(balance)
+            except (TypeError, ValueError):
+                balance = 0
+            total_balance[currency] = total_balance.get(currency, 0) + balance
+        return total_balance
+
+    # --- курсы и балансы ---
+
+    @writes_data
+    def apply_exchange_rates(self, rates, fetched=True):
+        """Сохраняет текущие курсы в data.
+
+        fetched=False — курсы взяты из кэша: время последнего обновления не меняется.
+        """
+        ops = []
+        if self.data.get("currencies") != rates:
+            self.data["currencies"] = rates
+            ops.append(op_set("currencies", rates))
+        if fetched:
+            self.data["last_rates_update"] = datetime.now().strftime("%d.%m.%Y %H:%M")
+            ops.append(op_set("last_rates_update", self.data["last_rates_update"]))
+        if ops:
+            self.commit(*ops)
+
+    @writes_data
+    def recompute_balances(self):
+        """Пересчитывает балансы кошельков по записям: начальный баланс + доходы − расходы.
+
+        Начальный баланс (opening_balance) запоминается в add_wallet. У старых кошельков
+        его нет — при первом пересчёте он выводится из текущего баланса, так что
+        последующие пересчёты исправляют расхождения, накопившиеся после этого.
+        Возвращает {кошелёк: (старый баланс, новый)} для изменившихся кошельков.
+        """
+        changed = {}
+        ops = []
+        for wallet in self.data.get("wallets", []):
+            name = wallet.get("name")
+            try:
+                balance = float(wallet.get("balance", 0))
+            except (TypeError, ValueError):
+                balance = 0.0
+            net = self.columns.total("incomes", wallet=name) - self.columns.total("expenses", wallet=name)
+            fields = {}
+            if "opening_balance" not in wallet:
+                wallet["opening_balance"] = round(balance - net, 2)
+                fields["opening_balance"] = wallet["opening_balance"]
+            new_balance = round(float(wallet["opening_balance"]) + net, 2)
+            if abs(new_balance - balance) >= 0.005:
+                wallet["balance"] = new_balance
+                fields["balance"] = new_balance
+                changed[name] = (balance, new_balance)
+            if fields:
+                ops.append(op_upd("wallets", name, **fields))
+        if ops:
+            self.commit(*ops)
+        return changed
+
+
+# ---------------------------
+# Курсы валют
+# ---------------------------
+# Адрес можно подменить (например, локальным сервером с XML в формате ЦБ)
+CBR_DAILY_URL = os.environ.get("FINANCE_CBR_URL", "https://www.cbr.ru/scripts/XML_daily.asp")
+# Приблизительные курсы, которыми приложение пользуется, пока не загружены настоящие
+# (только при чтении — в данные не записываются, см. current_rates)
+DEFAULT_RATES = {"RUB": 1.0, "USD": 80.0, "EUR": 90.0}
+# Кэш курсов по датам
+RATES_FILE = "rates_cache.json"
+# Сколько секунд курсы за сегодня считаются свежими (повторно в тот же день не загружаем)
+RATES_CACHE_TTL = 12 * 60 * 60
+# Сколько прошедших дат догружать за один запуск
+RATES_BACKFILL_BATCH = 30
+
+
+def current_rates(data):
+    """Текущие курсы из data["currencies"], а пока настоящие не загружены — DEFAULT_RATES.
+
+    Приблизительные курсы не попадают в data, поэтому при сохранении не выдаются за загруженные.
+    """
+    return data.get("currencies") or DEFAULT_RATES
+
+
+def fetch_exchange_rates(url=None, timeout=10, on_date=None):
+    """Загружает курсы валют с сайта ЦБ РФ: {код: рублей за единицу}.
+
+    url — по умолчанию CBR_DAILY_URL; on_date — дата, на которую нужны курсы
+    (по умолчанию — текущие). Ничего не меняет в данных, поэтому может выполняться в любом потоке.
+    """
+    import requests
+    import xml.etree.ElementTree as ET
+
+    params = {"date_req": on_date.strftime("%d/%m/%Y")} if on_date is not None else None
+    response = requests.get(url or CBR_DAILY_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    # Байты, а не текст: кодировку (windows-1251) берём из XML-заголовка, а не угадываем по HTTP
+    xml_data = ET.fromstring(response.content)
+
+    rates = {"RUB": 1.0}
+    for valute in xml_data.findall("Valute"):
+        code = valute.find("CharCode").text
+        rate = float(valute.find("Value").text.replace(",", "."))
+        nominal = int(valute.find("Nominal").text)
+        rates[code] = rate / nominal
+    return rates
+
+
+class RateCache:
+    """Курсы ЦБ по датам: {"гггг-мм-дд": {код: рублей за единицу}}.
+
+    Хранится в отдельном файле rates_cache.json, чтобы не раздувать data.json.
+    Курсы за прошедшие дни не меняются и загружаются один раз; курсы за сегодня
+    считаются свежими RATES_CACHE_TTL секунд. rate(валюта, день) — два обращения
+    к словарям: день без своих курсов (выходной, ещё не загружен) один раз
+    сопоставляется ближайшему более раннему дню из кэша, и это запоминается.
+    Используется и из фонового потока загрузки, поэтому изменения идут под замком.
+    """
+
+    def __init__(self, path=RATES_FILE):
+        self.path = path
+        self._lock = Lock()
+        self._rates = {}
+        self._fetched = {}
+        self._dates = []
+        self._resolved = {}
+        self.load()
+
+    @staticmethod
+    def _day_key(day):
+        return day if isinstance(day, str) else day.isoformat()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать кэш курсов: {e}")
+            return
+        with self._lock:
+            self._rates = stored.get("rates", {})
+            self._fetched = stored.get("fetched", {})
+            self._dates = sorted(self._rates)
+            self._resolved = {}
+
+    def save(self):
+        """Атомарно записывает кэш на диск."""
+        with self._lock:
+            stored = {"rates": dict(self._rates), "fetched": dict(self._fetched)}
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stored, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить кэш курсов: {e}")
+
+    def put(self, day, rates):
+        key = self._day_key(day)
+        with self._lock:
+            if key not in self._rates:
+                insort(self._dates, key)
+            self._rates[key] = dict(rates)
+            self._fetched[key] = time.time()
+            self._resolved = {}
+
+    def get(self, day):
+        """Курсы, загруженные именно на этот день, или None."""
+        return self._rates.get(self._day_key(day))
+
+    def is_fresh(self, day, ttl=RATES_CACHE_TTL):
+        key = self._day_key(day)
+        if key not in self._rates:
+            return False
+        if key < date.today().isoformat():
+            return True
+        return time.time() - self._fetched.get(key, 0) < ttl
+
+    def missing(self, days):
+        """Дни из days, для которых курсы ещё не загружались."""
+        return [day for day in days if self._day_key(day) not in self._rates]
+
+    def rate(self, currency, day=None, default=None):
+        """Курс валюты на день (date, "гггг-мм-дд" или None — последний известный)."""
+        if currency == "RUB":
+            return 1.0
+        key = self._resolved.get(day)
+        if key is None:
+            with self._lock:
+                dates = self._dates
+                if not dates:
+                    return default
+                if day is None:
+                    key = dates[-1]
+                else:
+                    pos = bisect_left(dates, self._day_key(day) + "~") - 1
+                    # До первого дня в кэше — берём самый ранний известный курс
+                    key = dates[max(pos, 0)]
+                self._resolved[day] = key
+        return self._rates[key].get(currency, default)
+
+
+def backfill_exchange_rates(cache, days, batch=RATES_BACKFILL_BATCH):
+    """Догружает курсы на дни записей, которых ещё нет в кэше (не больше batch за раз).
+
+    Кэш сохраняется на диск один раз в конце. Возвращает число загруженных дат.
+    """
+    today = date.today()
+    loaded = 0
+    for day in cache.missing(d for d in days if d < today)[:batch]:
+        try:
+            cache.put(day, fetch_exchange_rates(on_date=day))
+        except Exception as e:
+            # Сеть недоступна — остальные даты догрузим при следующем запуске
+            logger.error(f"Не удалось загрузить курсы на {day:%d.%m.%Y}: {e}")
+            break
+        loaded += 1
+    if loaded:
+        cache.save()
+    return loaded
+
+
+# ---------------------------
+# Отчёты
+# ---------------------------
+# Как часто (в записях) генератор отчёта сообщает о прогрессе
+REPORT_PROGRESS_STEP = 1000
+
+
+def report_filter(start=None, end=None, wallet=None, category=None):
+    """Предикат записи для отчёта: дата в [start, end), кошелёк, категория (None — любые)."""
+    def matches(r):
+        if wallet is not None and r.get("wallet") != wallet:
+            return False
+        if category is not None and r.get("category", "Без категории") != category:
+            return False
+        if start is not None or end is not None:
+            day = day_bucket(r.get("date"))
+            if day is None or (start is not None and day < start) or (end is not None and day >= end):
+                return False
+        return True
+    return matches
+
+
+def collect_report(data, columns=None, rates=None, start=None, end=None, wallet=None, category=None, lock=None):
+    """Общая часть всех форматов отчёта: копии списков и итоги, посчитанные один раз.
+
+    Под lock (DataStore.lock) снимаются копии списков и векторно считаются итоги
+    по колоночному представлению; дальше форматы работают только с результатом,
+    поэтому запись файла идёт без замка и может выполняться в фоновом потоке.
+    """
+    filters = {"start": start, "end": end, "wallet": wallet, "category": category}
+    with lock or nullcontext():
+        today_rates = dict(current_rates(data))
+
+        def rate_on(currency, day):
+            # Рубли считаются по курсу на день записи (кэш курсов), иначе — по текущему
+            if rates is None:
+                return today_rates.get(currency, 1)
+            return rates.rate(currency, day, default=today_rates.get(currency, 1))
+
+        if columns is None:
+            columns = ColumnarLedger()
+            columns.reset(data)
+        months_in, sums_in, _ = columns.group_by_period("incomes", "M", **filters)
+        months_out, sums_out, _ = columns.group_by_period("expenses", "M", **filters)
+        by_month = {}
+        for month, amount in zip(np.datetime_as_string(months_in), sums_in):
+            by_month.setdefault(month, [0.0, 0.0])[0] = float(amount)
+        for month, amount in zip(np.datetime_as_string(months_out), sums_out):
+            by_month.setdefault(month, [0.0, 0.0])[1] = float(amount)
+        return {
+            "filters": filters,
+            "wallets": [dict(w) for w in data.get("wallets", []) if wallet is None or w.get("name") == wallet],
+            "records": {"incomes": list(data.get("incomes", [])), "expenses": list(data.get("expenses", []))},
+            "matches": report_filter(start, end, wallet, category),
+            "rate_on": rate_on,
+            "by_category": sorted(columns.group_by_category("expenses", **filters).items(), key=lambda x: -x[1][0]),
+            "by_month": [(month, values[0], values[1]) for month, values in sorted(by_month.items())],
+            "total_in": columns.total("incomes", **filters),
+            "total_out": columns.total("expenses", **filters),
+            "rub_in": columns.total_rub("incomes", rate_on, **filters),
+            "rub_out": columns.total_rub("expenses", rate_on, **filters),
+        }
+
+
+def iter_report_records(report, progress=None):
+    """Записи отчёта, подходящие под фильтры: (список, запись, сумма в рублях).
+
+    progress(готово, всего) вызывается каждые REPORT_PROGRESS_STEP просмотренных записей.
+    """
+    records = report["records"]
+    matches = report["matches"]
+    rate_on = report["rate_on"]
+    total = sum(len(v) for v in records.values())
+    done = 0
+    for key in ("incomes", "expenses"):
+        for r in records[key]:
+            done += 1
+            if progress is not None and done % REPORT_PROGRESS_STEP == 0:
+                progress(done, total)
+            if not matches(r):
+                continue
+            try:
+                rub = float(r.get('amount', 0)) * rate_on(r.get('currency', ''), day_bucket(r.get('date')))
+            except (TypeError, ValueError):
+                rub = 0.0
+            yield key, r, rub
+
+
+def report_header(report):
+    """Строки заголовка: дата генерации и выбранные фильтры."""
+    filters = report["filters"]
+    lines = [f"Дата генерации: {datetime.now().strftime('%d.%m.%Y %H:%M')}"]
+    start, end = filters["start"], filters["end"]
+    if start is not None or end is not None:
+        period_from = start.strftime('%d.%m.%Y') if start else "…"
+        period_to = (end - timedelta(days=1)).strftime('%d.%m.%Y') if end else "…"
+        lines.append(f"Период: {period_from} — {period_to}")
+    if filters["wallet"] is not None:
+        lines.append(f"Кошелёк: {filters['wallet']}")
+    if filters["category"] is not None:
+        lines.append(f"Категория: {filters['category']}")
+    return lines
+
+
+def write_txt_report(path, report, progress=None):
+    """Текстовый отчёт; строки пишутся в файл по мере обхода записей."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Финансовый отчёт\n")
+        for line in report_header(report):
+            f.write(line + "\n")
+        f.write("\n")
+
+        f.write("Кошельки:\n")
+        for w in report["wallets"]:
+            f.write(f"- {w.get('name','')} : {w.get('balance',0)} {w.get('currency','')}\n")
+        f.write("\n")
+
+        titles = {"incomes": "Доходы:", "expenses": "Расходы:"}
+        opened = []
+
+        def open_section(key):
+            # Заголовки пишутся и для разделов, в которые не попало ни одной записи
+            for k in titles:
+                if k in opened:
+                    continue
+                if opened:
+                    f.write("\n")
+                f.write(titles[k] + "\n")
+                opened.append(k)
+                if k == key:
+                    return
+
+        for key, r, rub in iter_report_records(report, progress):
+            if not opened or opened[-1] != key:
+                open_section(key)
+            f.write(f"- id:{r.get('id','')} | {r.get('amount',0)} {r.get('currency','')} (≈ {rub:.2f} RUB) | {r.get('category','')} | {r.get('date','')}\n")
+        open_section(None)
+        f.write("\n")
+
+        f.write("Расходы по категориям:\n")
+        for cat, (amount, count) in report["by_category"]:
+            f.write(f"- {cat}: {amount:.2f} ({count} зап.)\n")
+        f.write("\n")
+
+        f.write("По месяцам (доходы / расходы):\n")
+        for month, income, expense in report["by_month"]:
+            f.write(f"- {month[5:7]}.{month[0:4]}: {income:.2f} / {expense:.2f}\n")
+        f.write("\n")
+
+        f.write(f"Итого доходов: {report['total_in']:.2f}\n")
+        f.write(f"Итого расходов: {report['total_out']:.2f}\n")
+        f.write(f"Чистый результат: {report['total_in'] - report['total_out']:.2f}\n")
+        f.write(f"В рублях по курсу на день записи: доходы {report['rub_in']:.2f}, расходы {report['rub_out']:.2f}, "
+                f"итог {report['rub_in'] - report['rub_out']:.2f}\n")
+
+
+# Колонки выгрузки записей в CSV и JSON Lines
+EXPORT_FIELDS = ("type", "id", "date", "amount", "currency", "amount_rub", "wallet", "category")
+
+
+def _export_row(key, r, rub):
+    return {
+        "type": "income" if key == "incomes" else "expense",
+        "id": r.get("id"),
+        "date": r.get("date"),
+        "amount": r.get("amount"),
+        "currency": r.get("currency"),
+        "amount_rub": round(rub, 2),
+        "wallet": r.get("wallet"),
+        "category": r.get("category"),
+    }
+
+
+def write_csv_records(path, report, progress=None):
+    """Записи в CSV (разделитель «;», UTF-8 с BOM — открывается в Excel)."""
+    import csv
+
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS, delimiter=";")
+        writer.writeheader()
+        for key, r, rub in iter_report_records(report, progress):
+            writer.writerow(_export_row(key, r, rub))
+
+
+def write_jsonl_records(path, report, progress=None):
+    """Записи в JSON Lines: один JSON-объект на строку."""
+    with open(path, "w", encoding="utf-8") as f:
+        for key, r, rub in iter_report_records(report, progress):
+            f.write(json.dumps(_export_row(key, r, rub), ensure_ascii=False) + "\n")
+
+
+def write_docx_report(path, report, progress=None):
+    """Отчёт в DOCX (python-docx): итоги и таблицы по кошелькам, категориям и месяцам.
+
+    Отдельные записи в документ не попадают — для них есть CSV и JSON Lines.
+    """
+    from docx import Document
+
+    def add_table(headers, rows):
+        table = document.add_table(rows=1, cols=len(headers))
+        table.style = "Table Grid"
+        for cell, text in zip(table.rows[0].cells, headers):
+            cell.text = text
+        for row in rows:
+            for cell, value in zip(table.add_row().cells, row):
+                cell.text = value
+
+    document = Document()
+    document.add_heading("Финансовый отчёт", level=0)
+    for line in report_header(report):
+        document.add_paragraph(line)
+
+    document.add_heading("Итоги", level=1)
+    add_table(["", "Сумма", "В рублях"], [
+        ("Доходы", f"{report['total_in']:.2f}", f"{report['rub_in']:.2f}"),
+        ("Расходы", f"{report['total_out']:.2f}", f"{report['rub_out']:.2f}"),
+        ("Чистый результат", f"{report['total_in'] - report['total_out']:.2f}",
+         f"{report['rub_in'] - report['rub_out']:.2f}"),
+    ])
+
+    document.add_heading("Кошельки", level=1)
+    add_table(["Кошелёк", "Баланс", "Валюта"], [
+        (str(w.get("name", "")), str(w.get("balance", 0)), str(w.get("currency", ""))) for w in report["wallets"]])
+
+    document.add_heading("Расходы по категориям", level=1)
+    add_table(["Категория", "Сумма", "Записей"], [
+        (str(cat), f"{amount:.2f}", str(count)) for cat, (amount, count) in report["by_category"]])
+
+    document.add_heading("По месяцам", level=1)
+    add_table(["Месяц", "Доходы", "Расходы"], [
+        (f"{month[5:7]}.{month[0:4]}", f"{income:.2f}", f"{expense:.2f}")
+        for month, income, expense in report["by_month"]])
+
+    document.save(path)
+
+
+# Формат отчёта -> функция записи
+REPORT_FORMATS = {
+    "txt": write_txt_report,
+    "csv": write_csv_records,
+    "jsonl": write_jsonl_records,
+    "docx": write_docx_report,
+}
+
+
+def generate_report(data, columns=None, rates=None, start=None, end=None, wallet=None, category=None,
+                    progress=None, lock=None, fmt="txt", base_dir=None):
+    """Создаёт отчёт или выгрузку в формате fmt (txt, csv, jsonl, docx) в каталоге base_dir.
+
+    start/end (даты, [start, end)), wallet и category ограничивают записи и итоги.
+    progress(готово, всего) вызывается каждые REPORT_PROGRESS_STEP записей.
+    lock — замок данных (DataStore.lock), см. collect_report.
+    Возвращает путь к файлу или None при ошибке.
+    """
+    try:
+        base_dir = base_dir or os.getcwd()
+        os.makedirs(base_dir, exist_ok=True)
+
+        with perf.span("generate_report", fmt=fmt) as span:
+            writer = REPORT_FORMATS[fmt]
+            report = collect_report(data, columns, rates, start, end, wallet, category, lock)
+
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M')
+            filename = os.path.join(base_dir, f"financial_report_{timestamp}.{fmt}")
+            writer(filename, report, progress)
+            total = sum(len(v) for v in report["records"].values())
+            if progress is not None:
+                progress(total, total)
+            span.set(records=total, bytes=os.path.getsize(filename))
+        return filename
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        logger.error(f"Ошибка при создании отчёта: {e}")
+        return None
+
+
+# ---------------------------
+# Импорт выписок
+# ---------------------------
+# Сколько строк выписки проверяется за один проход (между вызовами progress)
+IMPORT_BATCH_SIZE = 5000
+# Заголовки столбцов CSV, которые узнаются без явного сопоставления (без учёта регистра)
+IMPORT_COLUMNS = {
+    "date": ("date", "дата", "дата операции", "дата платежа"),
+    "amount": ("amount", "сумма", "сумма операции", "сумма платежа"),
+    "type": ("type", "тип", "тип операции"),
+    "wallet": ("wallet", "кошелёк", "кошелек", "счёт", "счет", "account"),
+    "category": ("category", "категория"),
+    "currency": ("currency", "валюта", "валюта операции"),
+}
+# Значения столбца type (иначе доход или расход определяется знаком суммы)
+IMPORT_INCOME_TYPES = {"income", "доход", "приход", "зачисление", "credit"}
+IMPORT_EXPENSE_TYPES = {"expense", "расход", "списание", "debit"}
+# Форматы дат в выписках (первый — формат самого приложения); OFX-даты разбираются отдельно
+IMPORT_DATE_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y",
+                       "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+# Старые обозначения валют в выписках
+CURRENCY_ALIASES = {"RUR": "RUB"}
+
+
+def _statement_columns(header, mapping=None):
+    """Номера столбцов CSV для полей импорта: mapping {поле: заголовок} или IMPORT_COLUMNS."""
+    names = [h.strip().lower() for h in header]
+    columns = {}
+    for field, aliases in IMPORT_COLUMNS.items():
+        wanted = [mapping[field].strip().lower()] if mapping and field in mapping else aliases
+        for alias in wanted:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    missing = [field for field in ("date", "amount") if field not in columns]
+    if missing:
+        raise ValueError(f"В выписке нет столбцов: {', '.join(missing)} (заголовок: {header})")
+    return columns
+
+
+def read_csv_statement(path, mapping=None, delimiter=None, encoding="utf-8-sig"):
+    """Строки CSV-выписки по одной: (номер строки, {поле: текст}).
+
+    Разделитель определяется по началу файла, если не задан.
+    """
+    import csv
+
+    with open(path, encoding=encoding, newline="") as f:
+        if delimiter is None:
+            sample = f.read(64 * 1024)
+            f.seek(0)
+            try:
+                delimiter = csv.Sniffer().sniff(sample, delimiters=";,\t").delimiter
+            except csv.Error:
+                delimiter = ";"
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = _statement_columns(header, mapping)
+        for line, row in enumerate(reader, start=2):
+            if not any(cell.strip() for cell in row):
+                continue
+            yield line, {field: row[i] if i < len(row) else "" for field, i in columns.items()}
+
+
+def read_jsonl_statement(path, encoding="utf-8"):
+    """Строки выгрузки JSON Lines (формат export) по одной: (номер строки, словарь)."""
+    with open(path, encoding=encoding) as f:
+        for line, text in enumerate(f, start=1):
+            if text.strip():
+                yield line, json.loads(text)
+
+
+# Тег OFX с текстом до следующего тега: <TRNAMT>-150.00
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+def read_ofx_statement(path, encoding="utf-8", chunk_size=64 * 1024):
+    """Операции OFX-выписки (SGML 1.x и XML 2.x) по одной: (номер операции, {поле: текст}).
+
+    Файл читается кусками и разбирается по тегам, без построения дерева целиком;
+    кошелёк — номер счёта (ACCTID), валюта — CURDEF выписки.
+    """
+    account = currency = None
+    fields = None
+    number = 0
+    tail = ""
+    with open(path, encoding=encoding, errors="replace") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            text = tail + chunk
+            tail = ""
+            if chunk:
+                # Последний тег может быть разрезан границей куска — дочитаем его со следующим
+                cut = text.rfind("<")
+                if cut >= 0:
+                    text, tail = text[:cut], text[cut:]
+            for closing, tag, value in _OFX_TAG.findall(text):
+                tag = tag.upper()
+                value = value.strip()
+                if tag == "STMTTRN":
+                    if not closing:
+                        fields = {}
+                    elif fields is not None:
+                        number += 1
+                        yield number, {
+                            "date": fields.get("DTPOSTED", ""),
+                            "amount": fields.get("TRNAMT", ""),
+                            "wallet": account or "",
+                            "currency": fields.get("CURRENCY") or currency or "",
+                            "category": "",
+                        }
+                        fields = None
+                elif closing or not value:
+                    continue
+                elif fields is not None:
+                    fields[tag] = value
+                elif tag == "ACCTID":
+                    account = value
+                elif tag == "CURDEF":
+                    currency = value
+            if not chunk:
+                break
+
+
+def statement_format(path):
+    """Формат выписки по расширению файла: "ofx", "jsonl" или "csv"."""
+    ext = os.path.splitext(path)[1].lower()
+    return {".ofx": "ofx", ".qfx": "ofx", ".jsonl": "jsonl"}.get(ext, "csv")
+
+
+def read_statement(path, fmt=None, **options):
+    """Строки выписки в формате fmt ("csv", "ofx", "jsonl"; по умолчанию — по расширению)."""
+    readers = {"csv": read_csv_statement, "ofx": read_ofx_statement, "jsonl": read_jsonl_statement}
+    return readers[fmt or statement_format(path)](path, **options)
+
+
+def _parse_statement_date(text):
+    text = (text or "").strip()
+    if len(text) in (10, 16) and text[2] == "." and text[5] == "." and text[6:10].isdigit():
+        # Быстрый путь для дд.мм.гггг[ чч:мм] — strptime в несколько раз медленнее
+        try:
+            if len(text) == 10:
+                return datetime(int(text[6:10]), int(text[3:5]), int(text[0:2]))
+            if text[13] == ":":
+                return datetime(int(text[6:10]), int(text[3:5]), int(text[0:2]), int(text[11:13]), int(text[14:16]))
+        except ValueError:
+            raise ValueError(f"неверная дата «{text}»") from None
+    if len(text) >= 8 and text[:8].isdigit():
+        # OFX: ГГГГММДД[ЧЧММСС[.XXX]][[-5:EST]]
+        digits = text[:14] if text[8:14].isdigit() else text[:8]
+        return datetime.strptime(digits, "%Y%m%d%H%M%S" if len(digits) == 14 else "%Y%m%d")
+    for fmt in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"неверная дата «{text}»")
+
+
+def _parse_statement_amount(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value or "").replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"неверная сумма «{value}»") from None
+
+
+def _import_row(row, wallets, wallet, default_category):
+    """Запись импорта (без id) по строке выписки. ValueError — строка не подходит."""
+    if not isinstance(row, dict):
+        # В JSON Lines строкой может оказаться любое значение JSON, а не только объект
+        raise ValueError("строка не является объектом JSON")
+    amount = _parse_statement_amount(row.get("amount"))
+    kind = str(row.get("type") or "").strip().lower()
+    if kind in IMPORT_INCOME_TYPES:
+        key = "incomes"
+    elif kind in IMPORT_EXPENSE_TYPES:
+        key = "expenses"
+    elif kind:
+        raise ValueError(f"неизвестный тип операции «{kind}»")
+    else:
+        key = "incomes" if amount > 0 else "expenses"
+    amount = round(abs(amount), 2)
+    if not amount:
+        raise ValueError("нулевая сумма")
+    wallet_name = wallet or str(row.get("wallet") or "").strip()
+    if wallet_name not in wallets:
+        raise ValueError(f"неизвестный кошелёк «{wallet_name}»")
+    currency = wallets[wallet_name]
+    row_currency = str(row.get("currency") or "").strip().upper()
+    if row_currency and CURRENCY_ALIASES.get(row_currency, row_currency) != currency:
+        raise ValueError(f"валюта {row_currency} не совпадает с валютой кошелька {currency}")
+    when = _parse_statement_date(row.get("date"))
+    return key, {
+        "id": None,
+        "currency": currency,
+        "amount": amount,
+        "wallet": wallet_name,
+        "category": str(row.get("category") or "").strip() or default_category,
+        "date": when.strftime("%d.%m.%Y %H:%M"),
+    }
+
+
+def prepare_import(rows, wallets, categories=(), wallet=None, default_category="Без категории",
+                   batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Проверяет строки выписки пачками по batch_size и готовит их к DataStore.apply_import.
+
+    rows — (номер строки, словарь) из read_statement; wallets — {имя: валюта};
+    wallet — кошелёк для всех строк (иначе берётся из строки). Данные не меняются,
+    поэтому функция может работать в фоновом потоке. progress(проверено строк).
+    Возвращает {"records": {"incomes": [...], "expenses": [...]}, "balances": {кошелёк: изменение},
+    "categories": [новые], "errors": [(строка, причина)], "rows": всего строк}.
+    """
+    records = {"incomes": [], "expenses": []}
+    balances = {}
+    known = set(categories)
+    new_categories = []
+    errors = []
+    done = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        for line, row in chunk:
+            try:
+                key, rec = _import_row(row, wallets, wallet, default_category)
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            records[key].append(rec)
+            sign = 1 if key == "incomes" else -1
+            balances[rec["wallet"]] = balances.get(rec["wallet"], 0.0) + sign * rec["amount"]
+            if rec["category"] not in known:
+                known.add(rec["category"])
+                new_categories.append(rec["category"])
+        done += len(chunk)
+        if progress is not None:
+            progress(done)
+    return {"records": records, "balances": balances, "categories": new_categories,
+            "errors": errors, "rows": done}
@@ -1,10 +1,9 @@
-import json
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
-import requests
-import xml.etree.ElementTree as ET
-from datetime import datetime
-import matplotlib.pyplot as plt
-from kivy_garden.matplotlib import FigureCanvasKivyAgg
+import numpy as np
+from datetime import date
 from kivy.app import App
 from kivy.lang import Builder
 from kivy.uix.screenmanager import ScreenManager, Screen
@@ -16,205 +15,310 @@ from kivy.uix.scrollview import ScrollView
 from kivy.uix.popup import Popup
 from kivy.clock import Clock
 from kivy.core.window import Window
+from kivy.graphics import Color, Rectangle
+from kivy.graphics.texture import Texture
+from kivy.uix.image import Image
 from kivy.utils import platform
-from threading import Thread
-from matplotlib import use
+from threading import Thread, Condition, current_thread, main_thread
 import shutil
 import logging
+import warnings
 from kivy.uix.recycleview import RecycleView
 from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.properties import BooleanProperty, StringProperty, NumericProperty, ObjectProperty
 from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelItem
 from kivy.metrics import dp, sp
-
-use("Agg")
+from finance_core import (
+    RATES_FILE, STATS_GRANULARITIES, TRASH_RETENTION_DAYS,
+    DataStore, RateCache, open_storage, current_rates, fetch_exchange_rates, backfill_exchange_rates,
+    generate_report, parse_record_filter, day_bucket, stats_range, read_statement,
+    perf, configure_perf, timed,
+)
 
 logging.basicConfig(level=logging.ERROR)
 
-# ---------------------------
-# Работа с JSON (хранение данных)
-# ---------------------------
-DATA_FILE = "data.json"
+# matplotlib, requests и xml.etree импортируются при первом использовании:
+# главному меню они не нужны. После первого кадра их можно прогреть в фоне.
+STARTUP_WARMUP = True
+STARTUP_WARMUP_DELAY = 0.5
+# FINANCE_STARTUP_TIMING=1 — печатать время импорта, build() и первого кадра
+STARTUP_TIMING = os.environ.get("FINANCE_STARTUP_TIMING") == "1"
 
 
-def load_data():
-    """Загрузка данных из файла JSON"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            logging.error("Поврежденный JSON файл, возвращаем дефолтные данные")
-            return {
-                "wallets": [],
-                "incomes": [],
-                "expenses": [],
-                "categories": [],
-                "deleted_records": []
-            }
-    else:
-        return {
-            "wallets": [],
-            "incomes": [],
-            "expenses": [],
-            "categories": [],
-            "deleted_records": []
-        }
-
-
-def save_data(data):
-    """Сохранение данных в файл JSON с бэкапом"""
-    if os.path.exists(DATA_FILE):
-        shutil.copy(DATA_FILE, DATA_FILE + ".bak")
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-
-def update_exchange_rates(show_popup=False):
-    """Загружает курсы валют с сайта ЦБ РФ и сохраняет их в data."""
-    url = "https://www.cbr.ru/scripts/XML_daily.asp"
+def warm_up_imports():
+    """Фоновый импорт тяжёлых модулей, чтобы первый вход в статистику не ждал их."""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        xml_data = ET.fromstring(response.text)
-
-        rates = {"RUB": 1.0}
-        for valute in xml_data.findall("Valute"):
-            code = valute.find("CharCode").text
-            rate = float(valute.find("Value").text.replace(",", "."))
-            nominal = int(valute.find("Nominal").text)
-            rates[code] = rate / nominal
-
-        app = App.get_running_app()
-        app.data["currencies"] = rates
-        app.data["last_rates_update"] = datetime.now().strftime("%d.%m.%Y %H:%M")
-        save_data(app.data)
-        if show_popup:
-            popup = Popup(title="Успешно", content=Label(text="Курсы валют обновлены!"), size_hint=(0.6, 0.3))
-            popup.open()
-        return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Ошибка сети при обновлении курсов: {e}")
-        if show_popup:
-            popup = Popup(title="Ошибка", content=Label(text="Не удалось обновить курсы (проверьте интернет)."), size_hint=(0.6, 0.3))
-            popup.open()
-        return False
+        import matplotlib.figure  # noqa: F401
+        import matplotlib.backends.backend_agg  # noqa: F401
+        import matplotlib.dates  # noqa: F401
+        import requests  # noqa: F401
+        import xml.etree.ElementTree  # noqa: F401
     except Exception as e:
-        logging.error(f"Ошибка при обновлении курсов: {e}")
-        if show_popup:
-            popup = Popup(title="Ошибка", content=Label(text="Не удалось обновить курсы."), size_hint=(0.6, 0.3))
-            popup.open()
-        return False
+        logging.error(f"Не удалось прогреть импорты: {e}")
 
+# ---------------------------
+# Работа с JSON (хранение данных)
+# ---------------------------
+# Хранилище, индексы, курсы и отчёты живут в finance_core.py (без Kivy),
+# здесь — только их связь с экранами.
+storage = open_storage()
 
-def move_to_trash(key, rec_id):
-    """Перемещает запись в корзину, корректирует баланс и логирует шаги."""
-    app = App.get_running_app()
-    records = app.data.get(key) or []
-    rec = next((r for r in records if r.get("id") == rec_id), None)
-    if not rec:
-        print(f"[WARN] Запись id={rec_id} для {key} не найдена, корзина без изменений")
-        return
 
-    # Корректируем баланс
-    wallet_name = rec.get("wallet")
-    amount = float(rec.get("amount", 0))
-    sign = -1 if key == "incomes" else 1  # Для доходов вычитаем, для расходов прибавляем
-    wallet = next((w for w in app.data.get("wallets", []) if w.get("name") == wallet_name), None)
-    if wallet:
-        wallet["balance"] = float(wallet.get("balance", 0)) + sign * amount
+def call_in_main(func, *args, **kwargs):
+    """Выполняет func в основном потоке (через Clock) — dispatch для DataStore."""
+    Clock.schedule_once(lambda dt: func(*args, **kwargs))
 
-    # Добавляем метку времени и тип записи
-    rec["deleted_at"] = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-    rec["record_type"] = key
-    print(f"[DEBUG] В корзину добавлен id={rec_id}, тип={key}")
 
-    app.data.setdefault("deleted_records", []).append(rec)
-    # Удаляем из исходного списка
-    app.data[key] = [r for r in records if r.get("id") != rec_id]
-    save_data(app.data)
+# ---------------------------
+# Курсы валют
+# ---------------------------
+def show_message(title, text):
+    """Показывает сообщение; безопасно вызывать из фонового потока."""
+    Clock.schedule_once(lambda dt: Popup(title=title, content=Label(text=text), size_hint=(0.6, 0.3)).open())
 
 
-def restore_from_trash(rec_id):
-    """Восстановление записи из корзины с проверками и корректировкой баланса."""
-    app = App.get_running_app()
-    trash = app.data.get("deleted_records") or []
-    print(f"[DEBUG] Попытка восстановить id={rec_id}. Текущие ID в корзине: {[r.get('id') for r in trash]}")
+def apply_exchange_rates(rates, fetched=True):
+    """Сохраняет курсы в data и обновляет экраны.
 
-    rec = next((r for r in trash if r.get("id") == rec_id), None)
-    if not rec:
-        print(f"[WARN] Запись id={rec_id} не найдена в корзине")
+    Из фонового потока вызов переносится в основной (данные меняет только он).
+    """
+    if current_thread() is not main_thread():
+        call_in_main(apply_exchange_rates, rates, fetched)
         return
+    app = App.get_running_app()
+    app.store.apply_exchange_rates(rates, fetched)
+    if hasattr(app, "on_rates_updated"):
+        app.on_rates_updated()
 
-    key = rec.get("record_type")
-    if key not in ["incomes", "expenses"]:
-        print(f"[ERROR] Некорректный record_type при восстановлении: {key}")
-        return
 
-    # Корректируем баланс обратно
-    wallet_name = rec.get("wallet")
-    amount = float(rec.get("amount", 0))
-    sign = 1 if key == "incomes" else -1  # Для доходов прибавляем, для расходов вычитаем
-    wallet = next((w for w in app.data.get("wallets", []) if w.get("name") == wallet_name), None)
-    if wallet:
-        wallet["balance"] = float(wallet.get("balance", 0)) + sign * amount
+def update_exchange_rates(show_popup=False, force=False):
+    """Обновляет курсы валют за сегодня и догружает курсы на дни записей.
 
-    app.data.setdefault(key, []).append(rec)
+    Если курсы за сегодня уже есть в кэше и не старше RATES_CACHE_TTL,
+    сеть не опрашивается (force=True — загрузить всё равно).
+    Сеть опрашивается в вызывающем потоке, а apply_exchange_rates
+    меняет данные и экраны в основном, поэтому функцию запускают в фоновом потоке.
+    """
+    app = App.get_running_app()
+    cache = getattr(app, "rates", None)
+    today = date.today()
+    span = perf.span("update_exchange_rates", force=force)
+    try:
+        with span:
+            if cache is not None and not force and cache.is_fresh(today):
+                rates = cache.get(today)
+                apply_exchange_rates(rates, fetched=False)
+                span.set(fetched=False)
+            else:
+                rates = fetch_exchange_rates()
+                if cache is not None:
+                    cache.put(today, rates)
+                    cache.save()
+                apply_exchange_rates(rates)
+                span.set(fetched=True)
+            if show_popup:
+                show_message("Успешно", "Курсы валют обновлены!")
+            backfilled = backfill_exchange_rates(cache, app.store.record_days()) if cache is not None else 0
+            span.set(backfilled=backfilled)
+        if backfilled:
+            call_in_main(app.on_rates_updated)
+        return True
+    except Exception as e:
+        import requests
 
-    # Удаляем только конкретную запись (учитываем тип)
-    app.data["deleted_records"] = [
-        r for r in trash if not (r.get("id") == rec_id and r.get("record_type") == key)
-    ]
-    print(f"[DEBUG] Восстановлен id={rec_id}, тип={key}. Осталось в корзине: {[r.get('id') for r in app.data['deleted_records']]}")
-    save_data(app.data)
+        if isinstance(e, requests.exceptions.RequestException):
+            logging.error(f"Ошибка сети при обновлении курсов: {e}")
+            text = "Не удалось обновить курсы (проверьте интернет)."
+        else:
+            logging.error(f"Ошибка при обновлении курсов: {e}")
+            text = "Не удалось обновить курсы."
+        if show_popup:
+            show_message("Ошибка", text)
+        return False
 
 
-def permanently_delete_from_trash(rec_id):
-    """Полное удаление записи в корзине"""
-    app = App.get_running_app()
-    trash = app.data.get("deleted_records") or []
-    app.data["deleted_records"] = [r for r in trash if r.get("id") != rec_id]
-    save_data(app.data)
+def refresh_rates_in_background(show_popup=False, force=False):
+    """Запускает обновление курсов в фоновом потоке."""
+    Thread(target=update_exchange_rates, kwargs={"show_popup": show_popup, "force": force}, daemon=True).start()
 
 
 # ---------------------------
-# Доп. функции для кошельков
+# Строки списков
 # ---------------------------
-def add_wallet(name, currency, balance):
-    """Добавляет новый кошелёк в данные и сохраняет их."""
-    app = App.get_running_app()
-    wallet = {"name": name, "currency": currency, "balance": balance}
-    app.data.setdefault("wallets", []).append(wallet)
-    save_data(app.data)
+# Сколько найденных записей показывать в списке при включённом фильтре
+QUERY_RESULT_LIMIT = 500
+# Сколько строк списка форматируется сразу (видимая страница) и сколько сверх неё про запас
+LIST_PAGE_SIZE = 50
+LIST_PREFETCH = 50
+# Доля высоты списка до конца, при которой подгружается следующая страница
+LIST_LOAD_MORE_AT = 0.1
+# При скольких изменённых строках rv.data заменяется целиком, а не правится точечно
+LIST_PATCH_LIMIT = 8
+
+
+class RecordRows:
+    """Готовые строки RecycleView для доходов, расходов и корзины — окном, новые сверху.
+
+    Подписан на RecordIndex. Порядок строк задаёт order: key -> функция
+    (key, start, stop) -> записи с номерами [start, stop) от новых к старым.
+    Приложение передаёт для доходов и расходов RecordQuery.newest — порядок по дате
+    записи, поэтому восстановленные из корзины и импортированные задним числом записи
+    встают на своё место, а не над сегодняшними. Для остальных списков (корзина)
+    порядок — обратный порядку добавления, т. е. по времени удаления.
+    В списке только первые limit записей (LIST_PAGE_SIZE + LIST_PREFETCH при открытии),
+    поэтому экран открывается за постоянное время при любом размере истории;
+    следующая страница форматируется, когда список прокручен к концу (load_more()).
+    Строка форматируется один раз и кэшируется по записи. Изменения копятся
+    и применяются при следующем обращении (или в следующем кадре): окно
+    заново берётся из order, а rv.data меняется только на разницу со старым окном.
+    Все строки переформатируются только после смены курсов (invalidate()).
+    Вызывается только из основного потока (см. DataStore).
+    """
 
+    KEYS = ("incomes", "expenses", "deleted_records")
+
+    def __init__(self, formatters, order=None, page_size=LIST_PAGE_SIZE, prefetch=LIST_PREFETCH):
+        # key -> функция (key, запись) -> словарь строки для RecycleView
+        self.formatters = formatters
+        self.order = order or {}
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self._views = {}
+        self._flush_trigger = Clock.create_trigger(lambda dt: self.flush())
+        self.reset({})
+
+    def reset(self, data):
+        self._data = data
+        self._cache = {key: {} for key in self.KEYS}
+        self._rows = {key: None for key in self.KEYS}
+        self._dirty = set()
+        self._limit = {key: self.page_size + self.prefetch for key in self.KEYS}
+        for key, rv in self._views.items():
+            rv.data = list(self.rows(key))
+
+    def invalidate(self):
+        """Переформатирует строки окна (например, после загрузки курсов); размер окна сохраняется."""
+        self._dirty.clear()
+        for key in self.KEYS:
+            self._cache[key] = {}
+            if self._rows[key] is not None:
+                self._limit[key] = max(self._limit[key], len(self._rows[key]))
+                self._rows[key] = None
+        for key, rv in self._views.items():
+            rv.data = list(self.rows(key))
+
+    def _newest(self, key, start, stop):
+        """Записи [start, stop) списка key от новых к старым."""
+        order = self.order.get(key)
+        if order is not None:
+            return order(key, start, stop)
+        records = self._data.get(key, [])
+        size = len(records)
+        return records[max(size - stop, 0):max(size - start, 0)][::-1]
+
+    def record_added(self, key, rec):
+        if self._rows.get(key) is None:
+            return
+        self._dirty.add(key)
+        self._flush_trigger()
 
-def delete_wallet(name):
-    """Удаляет кошелёк по имени и перемещает связанные записи в корзину"""
-    app = App.get_running_app()
-    # Переместить связанные записи в корзину
-    for key in ["incomes", "expenses"]:
-        records = [r for r in app.data.get(key, []) if r["wallet"] == name]
-        for rec in records:
-            move_to_trash(key, rec["id"])
-    # Удалить кошелек
-    app.data["wallets"] = [wallet for wallet in app.data.get("wallets", []) if wallet["name"] != name]
-    save_data(app.data)
-
-
-def calculate_total_balance():
-    """Подсчитывает итоговый баланс по всем кошелькам."""
-    app = App.get_running_app()
-    total_balance = {}
-    for wallet in app.data.get("wallets", []):
-        currency = wallet.get("currency")
-        balance = wallet.get("balance", 0)
-        try:
-            balance = float(balance)
-        except (TypeError, ValueError):
-            balance = 0
-        total_balance[currency] = total_balance.get(currency, 0) + balance
-    return total_balance
+    def record_removed(self, key, rec):
+        if self._rows.get(key) is None:
+            return
+        # id(rec) удалённой записи может достаться новой — строку из кэша убираем сразу
+        self._cache[key].pop(id(rec), None)
+        self._dirty.add(key)
+        self._flush_trigger()
+
+    def _window(self, key):
+        """Строки первых limit записей; отформатированные раньше берутся из кэша."""
+        cache = self._cache[key]
+        fmt = self.formatters[key]
+        fresh = {}
+        rows = []
+        for rec in self._newest(key, 0, self._limit[key]):
+            row = cache.get(id(rec))
+            if row is None:
+                row = fmt(key, rec)
+            fresh[id(rec)] = row
+            rows.append(row)
+        # Выпавшие из окна строки больше не держим в кэше
+        self._cache[key] = fresh
+        return rows
+
+    @staticmethod
+    def _patch_view(rv, old, rows):
+        """Меняет rv.data со строк old на rows точечно, если различий немного."""
+        kept = {id(row) for row in rows}
+        gone = [i for i, row in enumerate(old) if id(row) not in kept]
+        was = {id(row) for row in old}
+        new = [i for i, row in enumerate(rows) if id(row) not in was]
+        if len(gone) + len(new) > LIST_PATCH_LIMIT or len(rv.data) != len(old):
+            rv.data = list(rows)
+            return
+        # Общие строки идут в том же порядке: убираем лишние, затем вставляем новые на их места
+        for i in reversed(gone):
+            del rv.data[i]
+        for i in new:
+            rv.data.insert(i, rows[i])
+
+    def flush(self, key=None):
+        """Применяет накопленные изменения к окну и к привязанному rv.data."""
+        for k in (key,) if key else self.KEYS:
+            if k not in self._dirty or self._rows[k] is None:
+                continue
+            self._dirty.discard(k)
+            old = self._rows[k]
+            rows = self._rows[k] = self._window(k)
+            rv = self._views.get(k)
+            if rv is not None:
+                self._patch_view(rv, old, rows)
+
+    def rows(self, key):
+        """Строки окна списка key, новые первыми."""
+        rows = self._rows[key]
+        if rows is None:
+            rows = self._rows[key] = self._window(key)
+        else:
+            self.flush(key)
+        return rows
+
+    def has_more(self, key):
+        return len(self.rows(key)) < len(self._data.get(key, []))
+
+    def load_more(self, key):
+        """Форматирует следующую страницу более старых записей."""
+        if not self.has_more(key):
+            return
+        rows = self._rows[key]
+        self._limit[key] = len(rows) + self.page_size
+        fmt, cache = self.formatters[key], self._cache[key]
+        added = []
+        for rec in self._newest(key, len(rows), self._limit[key]):
+            row = cache[id(rec)] = fmt(key, rec)
+            added.append(row)
+        rows.extend(added)
+        rv = self._views.get(key)
+        if rv is not None and added:
+            rv.data.extend(added)
+
+    def on_scroll(self, rv):
+        """Подгружает следующую страницу, когда список прокручен почти до конца."""
+        for key, view in self._views.items():
+            if view is rv and rv.scroll_y <= LIST_LOAD_MORE_AT:
+                self.load_more(key)
+
+    def detach(self, key):
+        """Отвязывает RecycleView списка key (например, пока на нём показан результат фильтра)."""
+        self._views.pop(key, None)
+
+    def show(self, key, rv):
+        """Привязывает RecycleView к окну: дальше rv.data меняется только на разницу."""
+        rows = self.rows(key)
+        if self._views.get(key) is not rv:
+            self._views[key] = rv
+            rv.data = list(rows)
 
 
 # ---------------------------
@@ -228,33 +332,50 @@ class WalletScreen(Screen):
     def on_pre_enter(self):
         """Обновляет список кошельков и дату курсов при открытии экрана."""
         self.update_wallet_list()
+        self.update_rates_label()
+
+    def update_rates_label(self):
         app = App.get_running_app()
         self.ids.last_update_label.text = f"Курсы обновлены: {app.data.get('last_rates_update', 'неизвестно')}"
 
     def update_rates(self):
-        """Обновляет курсы валют с сайта ЦБ РФ."""
-        update_exchange_rates(show_popup=True)
-        app = App.get_running_app()
-        self.ids.last_update_label.text = f"Курсы обновлены: {app.data.get('last_rates_update', 'неизвестно')}"
+        """Обновляет курсы валют с сайта ЦБ РФ в фоне; экран обновится, когда они придут."""
+        self.ids.last_update_label.text = "Курсы обновляются..."
+        refresh_rates_in_background(show_popup=True, force=True)
 
     def update_wallet_list(self):
-        """Обновляет список кошельков на экране."""
+        """Обновляет список кошельков на экране.
+
+        Строка кошелька переформатируется, только если изменились его баланс,
+        валюта или курс; rv.data заменяется, только если что-то изменилось.
+        """
         app = App.get_running_app()
-        rates = app.data.get("currencies", {})
+        rates = current_rates(app.data)
+        cache = getattr(self, "_wallet_rows", {})
+        self._wallet_rows = {}
         data_list = []
         for wallet in app.data.get("wallets", []):
             if not all(k in wallet for k in ("name", "currency", "balance")):
                 continue
             rate = rates.get(wallet["currency"], 1)
-            try:
-                balance = float(wallet["balance"])
-                rub_value = balance * rate
-            except (TypeError, ValueError):
-                balance = 0.0
-                rub_value = 0.0
-            text = f"Имя: {wallet['name']}, Баланс: {balance:.2f} {wallet['currency']} (≈ {rub_value:.2f} RUB)"
-            data_list.append({'text': text, 'name': wallet['name']})
-        self.ids.wallet_rv.data = data_list
+            signature = (wallet["balance"], wallet["currency"], rate)
+            cached = cache.get(wallet["name"])
+            if cached is not None and cached[0] == signature:
+                row = cached[1]
+            else:
+                try:
+                    balance = float(wallet["balance"])
+                    rub_value = balance * rate
+                except (TypeError, ValueError):
+                    balance = 0.0
+                    rub_value = 0.0
+                text = f"Имя: {wallet['name']}, Баланс: {balance:.2f} {wallet['currency']} (≈ {rub_value:.2f} RUB)"
+                row = {'text': text, 'name': wallet['name']}
+            self._wallet_rows[wallet["name"]] = (signature, row)
+            data_list.append(row)
+        rv = self.ids.wallet_rv
+        if len(rv.data) != len(data_list) or any(a is not b for a, b in zip(rv.data, data_list)):
+            rv.data = data_list
 
     def show_add_wallet_form(self, *args):
         """Показывает форму для добавления кошелька."""
@@ -321,7 +442,7 @@ class WalletScreen(Screen):
 
         try:
             balance = float(balance_text)
-            add_wallet(name, currency, balance)
+            App.get_running_app().store.add_wallet(name, currency, balance)
             self.update_wallet_list()
             self.add_wallet_popup.dismiss()
 
@@ -352,7 +473,7 @@ class WalletScreen(Screen):
 
     def delete_wallet_confirmed(self, instance):
         """Удаляет кошелёк после подтверждения."""
-        delete_wallet(self.delete_name)
+        App.get_running_app().store.delete_wallet(self.delete_name)
         self.update_wallet_list()
         self.delete_popup.dismiss()
 
@@ -362,7 +483,7 @@ class WalletScreen(Screen):
 
     def show_total_balance(self):
         """Показывает итоговый баланс по всем кошелькам."""
-        total_balance = calculate_total_balance()
+        total_balance = App.get_running_app().store.calculate_total_balance()
 
         if not total_balance:
             total_balance_text = "Нет кошельков для подсчёта баланса."
@@ -482,36 +603,164 @@ class ExpenseScreen(Screen):
 
 
     def update_lists(self):
-        """Обновляем списки"""
+        """Обновляем списки (строки берутся из кэша RecordRows или из результата фильтра)"""
         app = App.get_running_app()
-        rates = app.data.get("currencies", {})
-        incomes = app.data.get("incomes", [])
-        expenses = app.data.get("expenses", [])
-
-        income_data = self.get_record_data(incomes, rates, "incomes")
-        expense_data = self.get_record_data(expenses, rates, "expenses")
+        conditions = getattr(self, "record_filter", None)
+        with perf.span("update_lists", filtered=bool(conditions)) as span:
+            if not conditions:
+                self.ids.filter_label.text = ""
+                app.record_rows.show("incomes", self.ids.income_rv)
+                app.record_rows.show("expenses", self.ids.expense_rv)
+                span.set(rows=len(self.ids.income_rv.data) + len(self.ids.expense_rv.data))
+                return
+            found, shown = [], 0
+            for key, rv in (("incomes", self.ids.income_rv), ("expenses", self.ids.expense_rv)):
+                records = app.query.query(key, limit=QUERY_RESULT_LIMIT, **conditions)
+                app.record_rows.detach(key)
+                rv.data = [self.format_record_row(key, rec) for rec in records]
+                # Подпись — все совпадения, а в списке не больше QUERY_RESULT_LIMIT строк
+                total = app.query.count(key, **conditions)
+                found.append(f"{total} (показано {len(records)})" if total > len(records) else str(total))
+                shown += len(records)
+            span.set(rows=shown)
+            self.ids.filter_label.text = f"Фильтр: доходов {found[0]}, расходов {found[1]}"
+
+    def show_filter_form(self, *args):
+        """Форма фильтра записей: кошелёк, категория, период, диапазон сумм."""
+        from kivy.uix.spinner import Spinner
 
-        self.ids.income_rv.data = income_data
-        self.ids.expense_rv.data = expense_data
+        app = App.get_running_app()
+        any_wallet, any_category = "Все кошельки", "Все категории"
+        fields = getattr(self, "filter_fields", {})
+        box = BoxLayout(orientation="vertical", spacing=dp(10), padding=dp(12))
 
-    def get_record_data(self, records, rates, key):
-        data_list = []
-        for rec in records:
-            rid = rec.get("id", "")
-            cur = rec.get("currency", "")
-            amt = rec.get("amount", 0)
-            try:
-                amount = float(amt)
-            except (TypeError, ValueError):
-                amount = 0
-            rate = rates.get(cur, 1)
+        wallet_spinner = Spinner(
+            text=fields.get("wallet") or any_wallet,
+            values=[any_wallet] + [w.get("name") for w in app.data.get("wallets", [])],
+            size_hint_y=None, height=dp(50), font_size=sp(18))
+        category_spinner = Spinner(
+            text=fields.get("category") or any_category,
+            values=[any_category] + list(app.data.get("categories", [])),
+            size_hint_y=None, height=dp(50), font_size=sp(18))
+        box.add_widget(wallet_spinner)
+        box.add_widget(category_spinner)
+
+        inputs = {}
+        for row in ((("start_text", "С (дд.мм.гггг)", None), ("end_text", "По (дд.мм.гггг)", None)),
+                    (("min_text", "Сумма от", "float"), ("max_text", "Сумма до", "float"))):
+            line = BoxLayout(size_hint_y=None, height=dp(50), spacing=dp(8))
+            for name, hint, input_filter in row:
+                inputs[name] = TextInput(text=fields.get(name, ""), hint_text=hint, multiline=False,
+                                         input_filter=input_filter, font_size=sp(18))
+                line.add_widget(inputs[name])
+            box.add_widget(line)
+
+        buttons = BoxLayout(size_hint_y=None, height=dp(56), spacing=dp(8))
+        apply_button = Button(text="Найти", font_size=sp(18))
+        reset_button = Button(text="Сбросить", font_size=sp(18))
+        buttons.add_widget(apply_button)
+        buttons.add_widget(reset_button)
+        box.add_widget(buttons)
+
+        popup = Popup(title="Фильтр записей", content=box, size_hint=(0.9, 0.65))
+
+        def apply(*args):
+            values = {name: field.text for name, field in inputs.items()}
+            values["wallet"] = "" if wallet_spinner.text == any_wallet else wallet_spinner.text
+            values["category"] = "" if category_spinner.text == any_category else category_spinner.text
             try:
-                rub_value = amount * float(rate)
-            except Exception:
-                rub_value = 0
-            text = f"id: {rid} | {amount} {cur} | кошелёк: {rec.get('wallet', '—')} | категория: {rec.get('category', '—')} (≈ {rub_value:.2f} RUB)"
-            data_list.append({'text': text, 'rid': rid, 'key': key})
-        return data_list
+                conditions = parse_record_filter(**values)
+            except ValueError:
+                Popup(title="Ошибка", content=Label(text="Даты — дд.мм.гггг, суммы — числа"), size_hint=(0.6, 0.3)).open()
+                return
+            self.filter_fields = values
+            self.record_filter = conditions
+            popup.dismiss()
+            self.update_lists()
+
+        apply_button.bind(on_release=apply)
+        reset_button.bind(on_release=lambda *a: (popup.dismiss(), self.reset_filter()))
+        popup.open()
+
+    def reset_filter(self, *args):
+        """Возвращает полные списки записей."""
+        self.filter_fields = {}
+        self.record_filter = None
+        self.update_lists()
+
+    def show_import_form(self, *args):
+        """Форма импорта выписки (CSV, OFX): путь к файлу и кошелёк."""
+        from kivy.uix.spinner import Spinner
+
+        app = App.get_running_app()
+        from_file = "Кошелёк из выписки"
+        box = BoxLayout(orientation="vertical", spacing=dp(10), padding=dp(12))
+        path_input = TextInput(hint_text="Путь к файлу .csv или .ofx", multiline=False, font_size=sp(18),
+                               size_hint_y=None, height=dp(50))
+        wallet_spinner = Spinner(
+            text=from_file,
+            values=[from_file] + [w.get("name") for w in app.data.get("wallets", [])],
+            size_hint_y=None, height=dp(50), font_size=sp(18))
+        box.add_widget(path_input)
+        box.add_widget(wallet_spinner)
+        import_button = Button(text="Импортировать", font_size=sp(18), size_hint_y=None, height=dp(56))
+        box.add_widget(import_button)
+        popup = Popup(title="Импорт выписки", content=box, size_hint=(0.9, 0.45))
+
+        def start(*args):
+            path = path_input.text.strip()
+            if not os.path.isfile(path):
+                Popup(title="Ошибка", content=Label(text="Файл не найден"), size_hint=(0.6, 0.3)).open()
+                return
+            wallet = None if wallet_spinner.text == from_file else wallet_spinner.text
+            popup.dismiss()
+            Thread(target=self.run_import, args=(path, wallet), daemon=True).start()
+
+        import_button.bind(on_release=start)
+        popup.open()
+
+    def run_import(self, path, wallet):
+        """Фоновый поток: читает и проверяет выписку; записи добавляются в основном потоке одной пачкой."""
+        import csv
+        app = App.get_running_app()
+        try:
+            app.store.import_statement(read_statement(path), wallet=wallet, on_done=self.import_finished)
+        except (OSError, ValueError, csv.Error) as e:
+            logging.error(f"Ошибка импорта {path}: {e}")
+            show_message("Ошибка", "Не удалось прочитать выписку")
+
+    def import_finished(self, batch):
+        """Итог импорта — вызывается из apply_import в основном потоке."""
+        if batch.get("failed"):
+            logging.error(f"Импорт не выполнен: {batch['failed']}")
+            show_message("Ошибка", batch["failed"])
+            return
+        text = f"Добавлено записей: {batch['imported']}\nПропущено строк: {len(batch['errors'])}"
+        for line, reason in batch["errors"][:3]:
+            text += f"\nстрока {line}: {reason}"
+        show_message("Импорт", text)
+        self.update_lists()
+
+    @staticmethod
+    def format_record_row(key, rec):
+        """Строка RecycleView для дохода или расхода."""
+        app = App.get_running_app()
+        rates = current_rates(app.data)
+        rid = rec.get("id", "")
+        cur = rec.get("currency", "")
+        amt = rec.get("amount", 0)
+        try:
+            amount = float(amt)
+        except (TypeError, ValueError):
+            amount = 0
+        # Курс на день записи, а не сегодняшний
+        rate = app.rates.rate(cur, day_bucket(rec.get("date")), default=rates.get(cur, 1))
+        try:
+            rub_value = amount * float(rate)
+        except Exception:
+            rub_value = 0
+        text = f"id: {rid} | {amount} {cur} | кошелёк: {rec.get('wallet', '—')} | категория: {rec.get('category', '—')} (≈ {rub_value:.2f} RUB)"
+        return {'text': text, 'rid': rid, 'key': key}
 
     def save_record(self, instance):
         """Сохраняет новую запись"""
@@ -540,8 +789,7 @@ class ExpenseScreen(Screen):
             return
 
         app = App.get_running_app()
-        wallets = app.data.get("wallets")
-        wallet = next((w for w in wallets if w.get("name") == wallet_name), None)
+        wallet = app.index.wallet(wallet_name)
         if not wallet:
             Popup(title="Ошибка", content=Label(text="Выберите кошелёк или создайте новый!"), size_hint=(0.6, 0.3)).open()
             return
@@ -557,20 +805,7 @@ class ExpenseScreen(Screen):
                 Popup(title="Ошибка", content=Label(text="Недостаточно средств в кошельке!"), size_hint=(0.6, 0.3)).open()
                 return
 
-        new_id = self.numbering_id()
-        record = {
-            "id": new_id,
-            "currency": wallet.get("currency", "RUB"),
-            "amount": amount,
-            "wallet": wallet_name,
-            "category": category_name,
-            "date": datetime.now().strftime("%d.%m.%Y %H:%M")
-        }
-        app.data.setdefault(key, []).append(record)
-
-        wallet["balance"] = float(wallet.get("balance", 0)) + sign * amount
-
-        save_data(app.data)
+        app.store.add_record(key, wallet_name, category_name, amount)
         self.add_record_popup.dismiss()
         self.update_lists()
 
@@ -597,7 +832,7 @@ class ExpenseScreen(Screen):
         """Переносит запись в корзину"""
         key = self.del_key
         rid = self.del_id
-        move_to_trash(key, rid)
+        App.get_running_app().store.move_to_trash(key, rid)
         self.update_lists()
         self.del_popup.dismiss()
 
@@ -605,30 +840,6 @@ class ExpenseScreen(Screen):
         """Отмена удаления."""
         self.del_popup.dismiss()
 
-    @staticmethod
-    def numbering_id():
-        """Нумерация id: учитываем доходы, расходы и корзину, чтобы не пересекались."""
-        app = App.get_running_app()
-        all_ids = set()
-
-        for key in ["incomes", "expenses"]:
-            for record in app.data.get(key, []):
-                try:
-                    all_ids.add(int(record.get("id", 0)))
-                except (ValueError, TypeError):
-                    pass
-
-        for record in app.data.get("deleted_records", []):
-            try:
-                all_ids.add(int(record.get("id", 0)))
-            except (ValueError, TypeError):
-                pass
-
-        new_id = 1
-        while new_id in all_ids:
-            new_id += 1
-        return new_id
-
 
 class RecordRow(RecycleDataViewBehavior, BoxLayout):
     """Viewclass for record RecycleView"""
@@ -650,17 +861,11 @@ class CategoryScreen(Screen):
         name = (name or "").strip()
         if not name:
             return
-        app = App.get_running_app()
-        if name not in app.data["categories"]:
-            app.data["categories"].append(name)
-            save_data(app.data)
+        if App.get_running_app().store.add_category(name):
             self.update_category_list()
 
     def remove_category(self, name):
-        app = App.get_running_app()
-        if name in app.data["categories"]:
-            app.data["categories"].remove(name)
-            save_data(app.data)
+        if App.get_running_app().store.remove_category(name):
             self.update_category_list()
 
     def update_category_list(self):
@@ -681,188 +886,269 @@ class CategoryRow(RecycleDataViewBehavior, BoxLayout):
         super(CategoryRow, self).refresh_view_attrs(rv, index, data)
 
 
+# ---------------------------
+# Отрисовка графиков
+# ---------------------------
+CHART_HEIGHT = 400
+CHART_DPI = 100
+# Сколько точек линии оставлять на пиксель ширины графика
+CHART_POINTS_PER_PIXEL = 0.5
+# Маркеры точек рисуются только на коротких рядах
+CHART_MARKER_LIMIT = 60
+
+
+def lttb(x, y, threshold):
+    """Прореживание ряда методом Largest-Triangle-Three-Buckets.
+
+    Оставляет threshold точек (первую, последнюю и по одной из каждой корзины —
+    ту, что образует наибольший треугольник с соседями), сохраняя форму пиков.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = edges[i]
+        end = max(edges[i + 1], start + 1)
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_end = max(next_end, next_start + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def draw_income_expense_chart(fig, ax, days, income_values, expense_values, max_points=None):
+    """Линейный график доходов и расходов по датам.
+
+    Длинные ряды прореживаются LTTB до max_points точек, поэтому время
+    отрисовки не растёт вместе с историей.
+    """
+    from matplotlib.dates import date2num
+
+    if days:
+        x = date2num(days)
+        marker = "o" if len(days) <= CHART_MARKER_LIMIT else None
+        for values, label, color in ((income_values, "Доходы", "green"), (expense_values, "Расходы", "red")):
+            xs, ys = lttb(x, values, max_points) if max_points else (x, values)
+            ax.plot(xs, ys, label=label, linewidth=2, marker=marker, color=color)
+        ax.xaxis_date()
+        ax.set_title("Доходы и расходы по датам")
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Сумма")
+        ax.legend()
+        ax.grid(True)
+        fig.autofmt_xdate()
+    else:
+        ax.text(0.5, 0.5, "Нет данных для отображения", ha="center", va="center")
+
+
+def draw_category_chart(fig, ax, category_totals):
+    """Круговая диаграмма расходов по категориям."""
+    if category_totals:
+        labels = list(category_totals.keys())
+        values = list(category_totals.values())
+        ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
+        ax.set_title("Расходы по категориям")
+    else:
+        ax.text(0.5, 0.5, "Нет данных по категориям", ha="center", va="center")
+
+
+class ChartRenderer:
+    """Отрисовка графиков matplotlib (Agg) в отдельном рабочем потоке.
+
+    Поток владеет фигурами и переиспользует их между отрисовками. Готовая
+    картинка — RGBA-буфер — передаётся в основной поток через Clock.schedule_once.
+    Задания для одного графика вытесняют ещё не начатые: важен только последний вид.
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        self._jobs = {}
+        self._figures = {}
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, name, draw, size, callback, *args):
+        """Ставит в очередь отрисовку графика name размером size=(ширина, высота) в пикселях.
+
+        draw(fig, ax, *args) рисует на очищенных осях, callback(buffer, size) вызывается в основном потоке.
+        """
+        with self._cond:
+            self._jobs[name] = (draw, size, callback, args)
+            self._cond.notify()
+
+    def _figure(self, name):
+        fig = self._figures.get(name)
+        if fig is None:
+            # Только Agg без pyplot: бэкенд не выбирается глобально и поток не трогает GUI
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+            fig = Figure(dpi=CHART_DPI)
+            FigureCanvasAgg(fig)
+            fig.add_subplot(111)
+            self._figures[name] = fig
+        return fig
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                name = next(iter(self._jobs))
+                draw, size, callback, args = self._jobs.pop(name)
+            try:
+                with perf.span("render_chart", chart=name):
+                    buffer, buffer_size = self._render(name, draw, size, args)
+            except Exception as e:
+                logging.error(f"Ошибка отрисовки графика {name}: {e}")
+                continue
+            Clock.schedule_once(lambda dt, b=buffer, bs=buffer_size, cb=callback: cb(b, bs))
+
+    def _render(self, name, draw, size, args):
+        fig = self._figure(name)
+        width, height = size
+        fig.set_size_inches(max(width, 1) / CHART_DPI, max(height, 1) / CHART_DPI)
+        ax = fig.axes[0]
+        ax.clear()
+        draw(fig, ax, *args)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fig.tight_layout()
+        fig.canvas.draw()
+        return bytes(fig.canvas.buffer_rgba()), fig.canvas.get_width_height()
+
+
 class StatsScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.status_load = False
-        self.cached_incomes_by_day = None
-        self.cached_expenses_by_day = None
-        self.cached_category_totals = None
+        self.drawn_version = None
+        self.renderer = None
+        self.chart_images = {}
 
     def on_pre_enter(self):
-        if self.status_load:
+        if self.status_load and self.drawn_version != self.chart_state():
             self.update_charts()
 
-    def start_preload(self):
-        """Запускаем загрузку в потоке"""
-        Thread(target=self.preload_charts, daemon=True).start()
+    def chart_state(self):
+        """Версия данных и выбранные фильтры — то, от чего зависят графики."""
+        return (
+            App.get_running_app().aggregates.version,
+            self.ids.range_spinner.text,
+            self.ids.granularity_spinner.text,
+            self.ids.start_input.text,
+            self.ids.end_input.text,
+        )
 
-    def preload_charts(self):
-        """Берем данные для предзагрузки"""
+    def on_filter_change(self):
+        """Перерисовывает графики при смене периода или шага свёртки."""
+        if self.status_load:
+            self.update_charts()
+
+    def selected_range(self):
+        """Выбранный период [start, end) и уровень свёртки."""
+        granularity = STATS_GRANULARITIES.get(self.ids.granularity_spinner.text, "day")
         try:
-            self.fig1, self.ax1 = plt.subplots(figsize=(6, 3))
-            self.fig2, self.ax2 = plt.subplots(figsize=(4, 4))
+            start, end = stats_range(self.ids.range_spinner.text, self.ids.start_input.text, self.ids.end_input.text)
+        except ValueError:
+            Popup(title="Ошибка", content=Label(text="Даты периода вводятся как дд.мм.гггг"), size_hint=(0.6, 0.3)).open()
+            start, end = None, None
+        return start, end, granularity
 
+    def generate_report(self):
+        """Отчёт за выбранный на экране период."""
+        start, end, _ = self.selected_range()
+        fmt = self.ids.report_format_spinner.text.lower()
+        App.get_running_app().generate_report_action(start=start, end=end, fmt=fmt)
+
+    def start_preload(self):
+        """Запускаем поток отрисовки и первую отрисовку графиков в фоне"""
+        try:
+            self.renderer = ChartRenderer()
             self.status_load = True
             Clock.schedule_once(lambda dt: self.update_charts())
         except Exception as e:
             logging.error(f"Ошибка загрузки графиков: {e}")
 
-    def update_charts(self):
-        app = App.get_running_app()
-        incomes = app.data.get("incomes", [])
-        expenses = app.data.get("expenses", [])
-
-        # Кэшируем если изменилось
-        if self.cached_incomes_by_day is None:
-            self.cached_incomes_by_day = self.aggregate_by_day(incomes)
-            self.cached_expenses_by_day = self.aggregate_by_day(expenses)
-            self.cached_category_totals = self.aggregate_by_category(expenses)
-
+    def chart_image(self, name):
+        """Виджет графика: создаётся один раз и переиспользуется при каждом входе на экран."""
+        image = self.chart_images.get(name)
+        if image is None:
+            image = Image(size_hint_y=None, height=CHART_HEIGHT, fit_mode="contain")
+            self.ids.stats_box.add_widget(image)
+            self.chart_images[name] = image
+        return image
+
+    def show_chart(self, name, buffer, size):
+        """Копирует готовый RGBA-буфер в текстуру виджета (основной поток)."""
+        image = self.chart_image(name)
+        texture = image.texture
+        if texture is None or tuple(texture.size) != tuple(size):
+            texture = Texture.create(size=size, colorfmt="rgba")
+            texture.flip_vertical()
+        texture.blit_buffer(buffer, colorfmt="rgba", bufferfmt="ubyte")
+        image.texture = texture
+        image.canvas.ask_update()
+
+    def chart_size(self):
         box = self.ids.stats_box
-        box.clear_widgets()
-
-        self.ax1.clear()
-        self.ax2.clear()
-
-        days = sorted(set(self.cached_incomes_by_day.keys()) | set(self.cached_expenses_by_day.keys()))
-        income_values = [self.cached_incomes_by_day.get(d, 0) for d in days]
-        expense_values = [self.cached_expenses_by_day.get(d, 0) for d in days]
-
-        if days:
-            self.ax1.plot(days, income_values, label="Доходы", linewidth=2, marker="o", color="green")
-            self.ax1.plot(days, expense_values, label="Расходы", linewidth=2, marker="o", color="red")
-            self.ax1.set_title("Доходы и расходы по датам")
-            self.ax1.set_xlabel("Дата")
-            self.ax1.set_ylabel("Сумма")
-            self.ax1.legend()
-            self.ax1.grid(True)
-        else:
-            self.ax1.text(0.5, 0.5, "Нет данных для отображения", ha="center", va="center")
-
-        self.fig1.tight_layout()
-        graph_widget1 = FigureCanvasKivyAgg(self.fig1)
-        graph_widget1.size_hint_y = None
-        graph_widget1.height = 400
-        box.add_widget(graph_widget1)
-
-        if self.cached_category_totals:
-            labels = list(self.cached_category_totals.keys())
-            values = list(self.cached_category_totals.values())
-            self.ax2.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
-            self.ax2.set_title("Расходы по категориям")
-        else:
-            self.ax2.text(0.5, 0.5, "Нет данных по категориям", ha="center", va="center")
-
-        self.fig2.tight_layout()
-        graph_widget2 = FigureCanvasKivyAgg(self.fig2)
-        graph_widget2.size_hint_y = None
-        graph_widget2.height = 400
-        box.add_widget(graph_widget2)
-
-    def aggregate_by_day(self, records):
-        totals = {}
-        for r in records:
-            date_str = r.get("date")
-            amount = float(r.get("amount", 0))
-            if not date_str:
-                continue
-            try:
-                date = datetime.strptime(date_str, "%d.%m.%Y %H:%M")
-                key = date.strftime("%d.%m")
-            except ValueError:
-                key = "неизв."
-                continue
-            totals[key] = totals.get(key, 0) + amount
-        return totals
+        width = box.width - box.padding[0] - box.padding[2]
+        return int(width if width > 100 else Window.width), CHART_HEIGHT
 
-    def aggregate_by_category(self, expenses):
-        totals = {}
-        for e in expenses:
-            cat = e.get("category", "Без категории")
-            amount = float(e.get("amount", 0))
-            totals[cat] = totals.get(cat, 0) + amount
-        return totals
+    def update_rub_summary(self, start, end):
+        """Итоги периода в рублях по курсу на день каждой записи."""
+        app = App.get_running_app()
+        current = current_rates(app.data)
 
+        def rate_on(currency, day):
+            return app.rates.rate(currency, day, default=current.get(currency, 1))
 
-def generate_report(data):
-    import os
-    import shutil
-    from datetime import datetime
-    from kivy.app import App
-    from kivy.utils import platform
+        incomes = app.columns.total_rub("incomes", rate_on, start=start, end=end)
+        expenses = app.columns.total_rub("expenses", rate_on, start=start, end=end)
+        self.ids.rub_summary.text = f"Доходы: {incomes:.2f} RUB | Расходы: {expenses:.2f} RUB"
 
-    try:
+    @timed("update_charts")
+    def update_charts(self):
         app = App.get_running_app()
-        if app:
-            base_dir = app.user_data_dir
+        # Суммы поддерживаются инкрементально при каждом изменении записей
+        aggregates = app.aggregates
+        start, end, granularity = self.selected_range()
+        incomes_by_day = aggregates.series("incomes", start, end, granularity)
+        expenses_by_day = aggregates.series("expenses", start, end, granularity)
+        if start is None and end is None:
+            category_totals = aggregates.by_category
         else:
-            base_dir = os.getcwd()
-
-        os.makedirs(base_dir, exist_ok=True)
-
-        lines = []
-        lines.append("Финансовый отчёт")
-        lines.append(f"Дата генерации: {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-        lines.append("")
-
-        lines.append("Кошельки:")
-        for w in data.get("wallets", []):
-            lines.append(f"- {w.get('name','')} : {w.get('balance',0)} {w.get('currency','')}")
-        lines.append("")
-
-        lines.append("Доходы:")
-        for r in data.get("incomes", []):
-            lines.append(f"- id:{r.get('id','')} | {r.get('amount',0)} {r.get('currency','')} | {r.get('category','')} | {r.get('date','')}")
-        lines.append("")
-
-        lines.append("Расходы:")
-        for r in data.get("expenses", []):
-            lines.append(f"- id:{r.get('id','')} | {r.get('amount',0)} {r.get('currency','')} | {r.get('category','')} | {r.get('date','')}")
-        lines.append("")
-
-        total_in = sum(float(r.get('amount', 0)) for r in data.get('incomes', []))
-        total_out = sum(float(r.get('amount', 0)) for r in data.get('expenses', []))
-        balance = total_in - total_out
-
-        lines.append(f"Итого доходов: {total_in:.2f}")
-        lines.append(f"Итого расходов: {total_out:.2f}")
-        lines.append(f"Чистый результат: {balance:.2f}")
-        lines.append("")
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M')
-        txt_filename = os.path.join(base_dir, f"financial_report_{timestamp}.txt")
-
-        with open(txt_filename, "w", encoding="utf-8") as f:
-            f.write("\n".join(lines))
-
-        # PNG УДАЛЁН НАВСЕГДА — больше не создаётся и не возвращается
-
-        downloads_path = None
-        if platform == "android":
-            try:
-                downloads_dir = "/storage/emulated/0/Download"
-                if os.path.exists(downloads_dir):
-                    downloads_path = os.path.join(
-                        downloads_dir,
-                        f"financial_report_{timestamp}.txt"
-                    )
-                    shutil.copy(txt_filename, downloads_path)
-            except Exception as e:
-                logging.error(f"Не удалось сохранить в папку Downloads: {e}")
-
-        # Возвращаем только текстовый файл
-        return {
-            "internal": txt_filename,
-            "downloads": downloads_path
-            # "chart" — больше не возвращаем!
-        }
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        logging.error(f"Ошибка при создании отчёта: {e}")
-        return None
+            by_category = app.columns.group_by_category("expenses", start=start, end=end)
+            category_totals = {cat: amount for cat, (amount, _) in by_category.items()}
+        self.drawn_version = self.chart_state()
+        self.update_rub_summary(start, end)
+
+        days = sorted(set(incomes_by_day.keys()) | set(expenses_by_day.keys()))
+        income_values = [incomes_by_day.get(d, 0) for d in days]
+        expense_values = [expenses_by_day.get(d, 0) for d in days]
+
+        # Сами графики рисуются в потоке ChartRenderer, сюда возвращается готовая картинка
+        size = self.chart_size()
+        self.chart_image("timeline")
+        self.chart_image("categories")
+        max_points = max(int(size[0] * CHART_POINTS_PER_PIXEL), 3)
+        self.renderer.submit("timeline", draw_income_expense_chart, size,
+                             lambda buf, bs: self.show_chart("timeline", buf, bs),
+                             days, income_values, expense_values, max_points)
+        self.renderer.submit("categories", draw_category_chart, size,
+                             lambda buf, bs: self.show_chart("categories", buf, bs),
+                             dict(category_totals))
 
 
 class TrashScreen(Screen):
@@ -871,32 +1157,33 @@ class TrashScreen(Screen):
         self.update_trash_list()
 
     def update_trash_list(self):
-        """Заполняет контейнер записями из корзины"""
+        """Заполняет контейнер записями из корзины (строки берутся из кэша RecordRows)"""
+        App.get_running_app().record_rows.show("deleted_records", self.ids.trash_rv)
+
+    @staticmethod
+    def format_trash_row(key, rec):
+        """Строка RecycleView для записи в корзине."""
         app = App.get_running_app()
-        trash = app.data.get("deleted_records", [])
-        rates = app.data.get("currencies", {})
-        data_list = []
-        for rec in trash:
-            rid = rec.get("id", "")
-            cur = rec.get("currency", "")
-            amt = rec.get("amount", 0)
-            deleted_at = rec.get("deleted_at", "")
-            try:
-                amount = float(amt)
-            except (TypeError, ValueError):
-                amount = 0
-            rate = rates.get(cur, 1)
-            try:
-                rub_value = amount * float(rate)
-            except Exception:
-                rub_value = 0
-            text = f"id: {rid} | {amount} {cur} (≈ {rub_value:.2f} RUB) | Удалено: {deleted_at}"
-            data_list.append({'text': text, 'rid': rid})
-        self.ids.trash_rv.data = data_list
+        rates = current_rates(app.data)
+        rid = rec.get("id", "")
+        cur = rec.get("currency", "")
+        amt = rec.get("amount", 0)
+        deleted_at = rec.get("deleted_at", "")
+        try:
+            amount = float(amt)
+        except (TypeError, ValueError):
+            amount = 0
+        rate = app.rates.rate(cur, day_bucket(rec.get("date")), default=rates.get(cur, 1))
+        try:
+            rub_value = amount * float(rate)
+        except Exception:
+            rub_value = 0
+        text = f"id: {rid} | {amount} {cur} (≈ {rub_value:.2f} RUB) | Удалено: {deleted_at}"
+        return {'text': text, 'rid': rid}
 
     def restore_record(self, rec_id):
         """Восстанавливает запись"""
-        restore_from_trash(rec_id)
+        App.get_running_app().store.restore_from_trash(rec_id)
         self.update_trash_list()
 
     def confirm_permanently_delete_record(self, rec_id):
@@ -919,7 +1206,7 @@ class TrashScreen(Screen):
 
     def permanently_delete_confirmed(self, instance):
         """Окончательно удаляет запись"""
-        permanently_delete_from_trash(self.del_id)
+        App.get_running_app().store.permanently_delete_from_trash(self.del_id)
         self.update_trash_list()
         self.del_popup.dismiss()
 
@@ -927,6 +1214,34 @@ class TrashScreen(Screen):
         """Отмена удаления."""
         self.del_popup.dismiss()
 
+    def restore_all(self):
+        """Восстанавливает все записи корзины"""
+        app = App.get_running_app()
+        app.store.restore_many_from_trash([r.get("id") for r in list(app.data.get("deleted_records", []))])
+        self.update_trash_list()
+
+    def confirm_empty_trash(self):
+        """Подтверждение очистки корзины"""
+        box = BoxLayout(orientation="vertical", padding=10, spacing=10)
+        box.add_widget(Label(text="Удалить навсегда все записи корзины?"))
+        btn_layout = BoxLayout(size_hint_y=None, height=48, spacing=10)
+        yes = Button(text="Да")
+        no = Button(text="Нет")
+        yes.bind(on_release=self.empty_trash_confirmed)
+        no.bind(on_release=self.permanently_delete_canceled)
+        btn_layout.add_widget(yes)
+        btn_layout.add_widget(no)
+        box.add_widget(btn_layout)
+
+        self.del_popup = Popup(title="Очистка корзины", content=box, size_hint=(0.6, 0.4))
+        self.del_popup.open()
+
+    def empty_trash_confirmed(self, instance):
+        """Очищает корзину"""
+        App.get_running_app().store.empty_trash()
+        self.update_trash_list()
+        self.del_popup.dismiss()
+
 
 class TrashRow(RecycleDataViewBehavior, BoxLayout):
     """Viewclass for trash RecycleView"""
@@ -1160,6 +1475,11 @@ FinanceManager:
             text: "Корзина"
             on_release: app.root.current = "trash"
 
+        StyledButton:
+            text: "Замеры"
+            background_color: rgba("#95A5A6")
+            on_release: app.toggle_perf_overlay()
+
         StyledButton:
             text: "Выход"
             background_color: rgba("#E74C3C")
@@ -1272,6 +1592,34 @@ FinanceManager:
                 text: "Добавить запись"
                 on_release: root.show_add_ExpenseIncome_form()
 
+            StyledButton:
+                text: "Фильтр"
+                size_hint_x: 0.4
+                on_release: root.show_filter_form()
+
+            StyledButton:
+                text: "Импорт"
+                size_hint_x: 0.4
+                on_release: root.show_import_form()
+
+        BoxLayout:
+            size_hint_y: None
+            height: dp(30) if filter_label.text else 0
+            opacity: 1 if filter_label.text else 0
+            spacing: dp(10)
+
+            Label:
+                id: filter_label
+                text: ""
+                color: 0, 0, 0, 1
+                font_size: sp(15)
+
+            Button:
+                text: "Сбросить"
+                size_hint_x: 0.3
+                disabled: not filter_label.text
+                on_release: root.reset_filter()
+
         TabbedPanel:
             do_default_tab: False
             size_hint_y: 1
@@ -1285,6 +1633,7 @@ FinanceManager:
 
                     RecycleView:
                         id: income_rv
+                        on_scroll_y: app.record_rows.on_scroll(self)
                         viewclass: 'RecordRow'
                         RecycleBoxLayout:
                             default_size: None, dp(44)
@@ -1304,6 +1653,7 @@ FinanceManager:
 
                     RecycleView:
                         id: expense_rv
+                        on_scroll_y: app.record_rows.on_scroll(self)
                         viewclass: 'RecordRow'
                         RecycleBoxLayout:
                             default_size: None, dp(44)
@@ -1395,6 +1745,53 @@ FinanceManager:
             size_hint_y: None
             height: dp(40)
 
+        BoxLayout:
+            size_hint_y: None
+            height: dp(44)
+            spacing: dp(8)
+
+            Spinner:
+                id: range_spinner
+                text: "Всё время"
+                values: ["Всё время", "Последние 30 дней", "Этот год", "Свой период"]
+                font_size: sp(15)
+                on_text: root.on_filter_change()
+
+            Spinner:
+                id: granularity_spinner
+                text: "По дням"
+                values: ["По дням", "По неделям", "По месяцам", "По кварталам", "По годам"]
+                font_size: sp(15)
+                on_text: root.on_filter_change()
+
+        BoxLayout:
+            size_hint_y: None
+            height: dp(44) if range_spinner.text == "Свой период" else 0
+            opacity: 1 if range_spinner.text == "Свой период" else 0
+            disabled: range_spinner.text != "Свой период"
+            spacing: dp(8)
+
+            TextInput:
+                id: start_input
+                hint_text: "С (дд.мм.гггг)"
+                multiline: False
+                font_size: sp(15)
+                on_text_validate: root.on_filter_change()
+
+            TextInput:
+                id: end_input
+                hint_text: "По (дд.мм.гггг)"
+                multiline: False
+                font_size: sp(15)
+                on_text_validate: root.on_filter_change()
+
+        StyledLabel:
+            id: rub_summary
+            text: ""
+            font_size: sp(15)
+            size_hint_y: None
+            height: dp(30)
+
         ScrollView:
             do_scroll_x: False
             do_scroll_y: True
@@ -1406,9 +1803,21 @@ FinanceManager:
                 spacing: dp(30)
                 padding: dp(10)
 
-        StyledButton:
-            text: "Сформировать отчёт"
-            on_release: app.generate_report_action()
+        BoxLayout:
+            size_hint_y: None
+            height: dp(56)
+            spacing: dp(8)
+
+            Spinner:
+                id: report_format_spinner
+                text: "TXT"
+                values: ["TXT", "CSV", "JSONL", "DOCX"]
+                font_size: sp(15)
+                size_hint_x: 0.3
+
+            StyledButton:
+                text: "Сформировать отчёт"
+                on_release: root.generate_report()
 
         StyledButton:
             text: "Назад"
@@ -1442,6 +1851,7 @@ FinanceManager:
 
             RecycleView:
                 id: trash_rv
+                on_scroll_y: app.record_rows.on_scroll(self)
                 viewclass: 'TrashRow'
                 RecycleBoxLayout:
                     default_size: None, dp(48)
@@ -1457,6 +1867,18 @@ FinanceManager:
             height: dp(48)
             spacing: dp(10)
 
+            StyledButton:
+                text: "Восстановить всё"
+                font_size: sp(16)
+                background_color: rgba("#2E8B57")
+                on_release: root.restore_all()
+
+            StyledButton:
+                text: "Очистить"
+                font_size: sp(16)
+                background_color: rgba("#C0392B")
+                on_release: root.confirm_empty_trash()
+
             StyledButton:
                 text: "Назад"
                 background_color: rgba("#95A5A6")
@@ -1464,33 +1886,221 @@ FinanceManager:
 """
 
 
+def copy_to_downloads(filename):
+    """На Android копирует файл отчёта в общую папку «Загрузки»; возвращает путь копии."""
+    if platform != "android":
+        return None
+    try:
+        downloads_dir = "/storage/emulated/0/Download"
+        if os.path.exists(downloads_dir):
+            downloads_path = os.path.join(downloads_dir, os.path.basename(filename))
+            shutil.copy(filename, downloads_path)
+            return downloads_path
+    except Exception as e:
+        logging.error(f"Не удалось сохранить в папку Downloads: {e}")
+    return None
+
+
+# ---------------------------
+# Панель замеров
+# ---------------------------
+# Как часто перерисовывать панель замеров, сек
+PERF_OVERLAY_INTERVAL = 1.0
+
+
+class PerfOverlay(Label):
+    """Полупрозрачная панель поверх всех экранов: последние и средние длительности спанов и счётчики."""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            font_size=sp(11), color=(1, 1, 1, 1), halign="left", valign="top",
+            size_hint=(None, None), markup=False, **kwargs,
+        )
+        with self.canvas.before:
+            Color(0, 0, 0, 0.65)
+            self._background = Rectangle(pos=self.pos, size=self.size)
+        self.bind(pos=self._update_background, size=self._update_background, texture_size=self._fit)
+        self._event = None
+
+    def _update_background(self, *args):
+        self._background.pos = self.pos
+        self._background.size = self.size
+
+    def _fit(self, *args):
+        self.size = (self.texture_size[0] + dp(12), self.texture_size[1] + dp(8))
+        self.pos = (dp(4), Window.height - self.height - dp(4))
+
+    def show(self):
+        if self.parent is None:
+            Window.add_widget(self)
+        self.refresh()
+        if self._event is None:
+            self._event = Clock.schedule_interval(self.refresh, PERF_OVERLAY_INTERVAL)
+
+    def hide(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+        if self.parent is not None:
+            Window.remove_widget(self)
+
+    @staticmethod
+    def format_stats(spans, counters):
+        lines = []
+        for name, stat in sorted(spans.items()):
+            fields = " ".join(f"{key}={value}" for key, value in stat["fields"].items())
+            lines.append(
+                f"{name}: {stat['last'] * 1000:.1f} мс (ср. {stat['total'] / stat['count'] * 1000:.1f}, "
+                f"макс. {stat['max'] * 1000:.1f}, ×{stat['count']}) {fields}".rstrip()
+            )
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines) or "Замеров пока нет"
+
+    def refresh(self, *args):
+        self.text = self.format_stats(*perf.snapshot())
+
+
 # ---------------------------
 # Основное приложение
 # ---------------------------
 class FinanceApp(App):
     def build(self):
-        self.data = load_data()
-        if "currencies" not in self.data or not self.data["currencies"]:
-            logging.info("Курсы валют не найдены, загружаем с сайта ЦБ...")
-            update_exchange_rates()
-        else:
-            try:
-                Thread(target=update_exchange_rates).start()
-            except Exception as e:
-                logging.error(f"Не удалось обновить курсы при запуске: {e}")
-
-        return Builder.load_string(kv)
+        self.build_started = time.perf_counter()
+        configure_perf()
+        self.perf_overlay = None
+        self.store = DataStore(storage, dispatch=call_in_main)
+        self.record_rows = RecordRows({
+            "incomes": ExpenseScreen.format_record_row,
+            "expenses": ExpenseScreen.format_record_row,
+            "deleted_records": TrashScreen.format_trash_row,
+        }, order={"incomes": self.query.newest, "expenses": self.query.newest})
+        self.index.subscribe(self.record_rows)
+        self.rates = RateCache(RATES_FILE)
+        if not self.data.get("currencies"):
+            # Не ждём сеть: пока работаем на встроенных курсах (current_rates), настоящие придут из фона
+            logging.info("Курсы валют не найдены, загружаем с сайта ЦБ в фоне...")
+        try:
+            refresh_rates_in_background()
+        except Exception as e:
+            logging.error(f"Не удалось обновить курсы при запуске: {e}")
+
+        root = Builder.load_string(kv)
+        self.build_finished = time.perf_counter()
+        if STARTUP_TIMING:
+            Window.bind(on_flip=self.report_startup_timing)
+        return root
+
+    # Короткие имена для экранов: всё принадлежит DataStore
+    data = property(lambda self: self.store.data)
+    index = property(lambda self: self.store.index)
+    columns = property(lambda self: self.store.columns)
+    aggregates = property(lambda self: self.store.aggregates)
+    id_allocator = property(lambda self: self.store.id_allocator)
+    query = property(lambda self: self.store.query)
+
+    def on_rates_updated(self):
+        """Пересчитывает суммы в рублях на экранах после загрузки курсов."""
+        if not self.root:
+            return
+        wallets = self.root.get_screen("wallets")
+        wallets.update_wallet_list()
+        wallets.update_rates_label()
+        # Суммы в рублях в строках доходов, расходов и корзины форматируются заново
+        self.record_rows.invalidate()
+        # Итоги в рублях на экране статистики зависят от курсов — перерисуем при следующем входе
+        stats = self.root.get_screen("stats")
+        stats.drawn_version = None
+        if self.root.current == "stats" and stats.status_load:
+            stats.update_charts()
+
+    def report_startup_timing(self, *args):
+        """Печатает длительности этапов запуска после первого кадра."""
+        Window.unbind(on_flip=self.report_startup_timing)
+        now = time.perf_counter()
+        print(
+            f"[STARTUP] импорт: {(_IMPORT_FINISHED - _IMPORT_STARTED) * 1000:.0f} мс, "
+            f"build: {(self.build_finished - self.build_started) * 1000:.0f} мс, "
+            f"первый кадр: {(now - self.build_finished) * 1000:.0f} мс, "
+            f"всего: {(now - _IMPORT_STARTED) * 1000:.0f} мс"
+        )
 
     def on_start(self):
+        # Графики и прогрев импортов — уже после первого кадра
+        Clock.schedule_once(self.after_first_frame, STARTUP_WARMUP_DELAY)
+        if perf.enabled:
+            self.show_perf_overlay()
+
+    def show_perf_overlay(self):
+        if self.perf_overlay is None:
+            self.perf_overlay = PerfOverlay()
+        self.perf_overlay.show()
+
+    def toggle_perf_overlay(self):
+        """Кнопка «Замеры» в меню: включает замеры и панель или выключает их."""
+        if self.perf_overlay is not None and self.perf_overlay.parent is not None:
+            self.perf_overlay.hide()
+            # Журнал замеров в файл (FINANCE_PERF_LOG) продолжает писаться
+            perf.enabled = bool(perf.sinks)
+        else:
+            perf.enabled = True
+            self.show_perf_overlay()
+
+    def after_first_frame(self, dt):
+        if STARTUP_WARMUP:
+            Thread(target=warm_up_imports, daemon=True).start()
         try:
             stats = self.root.get_screen("stats")
             stats.start_preload()
         except Exception as e:
             logging.error(f"Не удалось сделать предзагрузку статистики: {e}")
+        if TRASH_RETENTION_DAYS:
+            Thread(target=self.apply_trash_retention, args=(TRASH_RETENTION_DAYS,), daemon=True).start()
+
+    def apply_trash_retention(self, days):
+        """Ищет в фоне устаревшие записи корзины и удаляет их в основном потоке."""
+        try:
+            self.store.purge_trash_older_than(days)
+        except Exception as e:
+            logging.error(f"Ошибка при очистке корзины по сроку хранения: {e}")
 
-    def generate_report_action(self):
+    def on_stop(self):
+        storage.close()
+
+    def generate_report_action(self, start=None, end=None, wallet=None, category=None, fmt="txt"):
+        """Формирует отчёт в фоновом потоке и показывает прогресс."""
+        from kivy.uix.progressbar import ProgressBar
+
+        if getattr(self, "report_thread", None) is not None and self.report_thread.is_alive():
+            return
+        bar = ProgressBar(max=1, value=0)
+        progress_popup = Popup(title="Формирование отчёта…", content=bar, size_hint=(0.8, 0.2), auto_dismiss=False)
+        progress_popup.open()
+
+        def on_progress(done, total):
+            def update(dt):
+                bar.max = max(total, 1)
+                bar.value = done
+            Clock.schedule_once(update)
+
+        def worker():
+            filename = generate_report(self.data, self.columns, self.rates, start=start, end=end,
+                                       wallet=wallet, category=category, progress=on_progress,
+                                       lock=self.store.lock, fmt=fmt, base_dir=self.user_data_dir)
+            result = None
+            if filename:
+                result = {"internal": filename, "downloads": copy_to_downloads(filename)}
+
+            def finish(dt):
+                progress_popup.dismiss()
+                self.show_report_result(result)
+            Clock.schedule_once(finish)
+
+        self.report_thread = Thread(target=worker, daemon=True)
+        self.report_thread.start()
+
+    def show_report_result(self, result):
         """Самая простая и стабильная версия — только txt + понятное сообщение"""
-        result = generate_report(self.data)
         if not result:
             Popup(title="Ошибка", content=Label(text="Не удалось создать отчёт")).open()
             return
@@ -1528,5 +2138,7 @@ class FinanceApp(App):
         popup.open()
         close_btn.bind(on_release=popup.dismiss)
 
+_IMPORT_FINISHED = time.perf_counter()
+
 if __name__ == "__main__":
     FinanceApp().run()
\ No newline at end of file
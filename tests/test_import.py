@@ -0,0 +1,172 @@
+import csv
+import json
+from threading import Thread
+
+import finance_cli
+from finance_core import (
+    DataStore, JsonStorage, empty_data, prepare_import, read_csv_statement, read_jsonl_statement,
+    read_ofx_statement, read_statement,
+)
+
+WALLETS = {"Карта": "RUB", "Доллары": "USD"}
+
+CSV_TEXT = (
+    "Дата операции;Сумма;Категория;Кошелёк\n"
+    "01.03.2024 10:15;-1 250,50;Продукты;Карта\n"
+    "\n"
+    "2024-03-02;50000;Зарплата;Карта\n"
+    "03.03.2024;-300;;Карта\n"
+)
+
+OFX_SGML = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<CURDEF>RUR
+<BANKACCTFROM><BANKID>044525225<ACCTID>Карта</BANKACCTFROM>
+<BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240305120000.000[+3:MSK]<TRNAMT>-150.00<NAME>Кафе</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240306<TRNAMT>1000.00</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def write(tmp_path, name, text, encoding="utf-8"):
+    path = tmp_path / name
+    path.write_text(text, encoding=encoding)
+    return str(path)
+
+
+def test_csv_statement_headers_delimiter_and_encoding(tmp_path):
+    path = write(tmp_path, "statement.csv", CSV_TEXT, encoding="cp1251")
+    rows = list(read_csv_statement(path, encoding="cp1251"))
+    # Пустая строка пропускается, номера строк — как в файле
+    assert [line for line, _ in rows] == [2, 4, 5]
+    assert rows[0][1] == {"date": "01.03.2024 10:15", "amount": "-1 250,50", "category": "Продукты",
+                          "wallet": "Карта"}
+
+
+def test_csv_statement_column_mapping(tmp_path):
+    path = write(tmp_path, "statement.csv", "Когда,Сколько\n01.03.2024,10\n")
+    rows = list(read_csv_statement(path, mapping={"date": "Когда", "amount": "Сколько"}))
+    assert rows == [(2, {"date": "01.03.2024", "amount": "10"})]
+
+
+def test_csv_statement_without_required_columns(tmp_path):
+    path = write(tmp_path, "statement.csv", "Дата;Описание\n01.03.2024;что-то\n")
+    try:
+        list(read_csv_statement(path))
+    except ValueError as e:
+        assert "amount" in str(e)
+    else:
+        raise AssertionError("ожидалась ValueError")
+
+
+def test_ofx_statement_split_across_chunks(tmp_path):
+    path = write(tmp_path, "statement.ofx", OFX_SGML)
+    # Маленькие куски режут теги посередине
+    for chunk_size in (7, 64, 64 * 1024):
+        rows = list(read_ofx_statement(path, chunk_size=chunk_size))
+        assert rows == [
+            (1, {"date": "20240305120000.000[+3:MSK]", "amount": "-150.00", "wallet": "Карта",
+                 "currency": "RUR", "category": ""}),
+            (2, {"date": "20240306", "amount": "1000.00", "wallet": "Карта", "currency": "RUR", "category": ""}),
+        ]
+
+
+def test_jsonl_statement(tmp_path):
+    lines = [{"date": "01.03.2024 10:00", "amount": 10, "type": "income", "wallet": "Карта"},
+             {"date": "02.03.2024 10:00", "amount": 5, "type": "expense", "wallet": "Карта"}]
+    path = write(tmp_path, "records.jsonl", "\n".join(json.dumps(x, ensure_ascii=False) for x in lines) + "\n\n")
+    assert list(read_jsonl_statement(path)) == [(1, lines[0]), (2, lines[1])]
+    assert list(read_statement(path)) == [(1, lines[0]), (2, lines[1])]
+
+
+def test_jsonl_statement_non_object_lines(tmp_path):
+    """Массив или строка вместо объекта — ошибка этой строки, а не всего импорта."""
+    valid = {"date": "01.03.2024 10:00", "amount": 10, "type": "income", "wallet": "Карта"}
+    path = write(tmp_path, "records.jsonl", f'[1, 2]\n"x"\n{json.dumps(valid)}\n')
+    storage, store = make_store(tmp_path)
+    done = []
+    store.import_statement(read_statement(path), on_done=done.append)
+    batch, = done
+    assert [line for line, _ in batch["errors"]] == [1, 2] and batch["imported"] == 1
+    assert "объект" in batch["errors"][0][1]
+
+
+def test_cli_import_malformed_csv(tmp_path, monkeypatch):
+    """csv.Error при разборе выписки — код 1 и сообщение, а не трассировка."""
+    make_store(tmp_path)
+    limit = csv.field_size_limit()
+    path = write(tmp_path, "s.csv", 'Дата;Сумма\n01.03.2024;"' + "9" * (limit + 1) + '"\n')
+    monkeypatch.chdir(tmp_path)
+    assert finance_cli.main(["--data-dir", str(tmp_path), "--storage", "json", "import", path]) == 1
+
+
+def test_prepare_import_records_and_balances(tmp_path):
+    rows = read_statement(write(tmp_path, "statement.csv", CSV_TEXT))
+    batch = prepare_import(rows, WALLETS, categories=["Продукты"], batch_size=2)
+    assert batch["errors"] == []
+    assert batch["rows"] == 3
+    assert [r["amount"] for r in batch["records"]["expenses"]] == [1250.5, 300.0]
+    assert [r["date"] for r in batch["records"]["incomes"]] == ["02.03.2024 00:00"]
+    assert batch["records"]["expenses"][1]["category"] == "Без категории"
+    assert batch["balances"] == {"Карта": 50000 - 1250.5 - 300}
+    assert batch["categories"] == ["Зарплата", "Без категории"]
+
+
+def test_prepare_import_error_rows():
+    rows = [
+        (2, {"date": "01.03.2024", "amount": "abc", "wallet": "Карта"}),
+        (3, {"date": "31.02.2024", "amount": "10", "wallet": "Карта"}),
+        (4, {"date": "01.03.2024", "amount": "10", "wallet": "Нет такого"}),
+        (5, {"date": "01.03.2024", "amount": "10", "wallet": "Доллары", "currency": "RUB"}),
+        (6, {"date": "01.03.2024", "amount": "0", "wallet": "Карта"}),
+        (7, {"date": "01.03.2024", "amount": "10", "wallet": "Карта", "type": "перевод"}),
+        (8, {"date": "01.03.2024", "amount": "10", "wallet": "Карта", "type": "Расход", "currency": "RUR"}),
+    ]
+    batch = prepare_import(rows, WALLETS)
+    assert [line for line, _ in batch["errors"]] == [2, 3, 4, 5, 6, 7]
+    reasons = dict(batch["errors"])
+    assert "сумма" in reasons[2] and "дата" in reasons[3] and "кошел" in reasons[4]
+    assert "валюта" in reasons[5] and "нулевая" in reasons[6] and "тип" in reasons[7]
+    assert [r["amount"] for r in batch["records"]["expenses"]] == [10.0]
+    assert batch["balances"] == {"Карта": -10.0}
+
+
+def make_store(tmp_path, dispatch=None):
+    data = empty_data()
+    data["wallets"] = [{"name": "Карта", "currency": "RUB", "balance": 100.0}]
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    storage = JsonStorage(str(path))
+    return storage, DataStore(storage, dispatch=dispatch)
+
+
+def test_import_statement_applies_batch(tmp_path):
+    storage, store = make_store(tmp_path)
+    done = []
+    batch = store.import_statement(read_statement(write(tmp_path, "s.csv", CSV_TEXT)), on_done=done.append)
+    assert done == [batch] and batch["imported"] == 3 and "failed" not in batch
+    assert store.index.wallet("Карта")["balance"] == round(100 + 50000 - 1250.5 - 300, 2)
+    saved = storage.load()
+    assert len(saved["incomes"]) == 1 and len(saved["expenses"]) == 2
+    assert len({r["id"] for r in saved["incomes"] + saved["expenses"]}) == 3
+
+
+def test_wallet_deleted_during_background_import(tmp_path):
+    """Запись импорта уходит в основной поток; кошелёк к тому времени удалён — без исключения."""
+    queued = []
+    storage, store = make_store(tmp_path, dispatch=lambda func, *args, **kwargs: queued.append((func, args, kwargs)))
+    done = []
+    rows = list(read_statement(write(tmp_path, "s.csv", CSV_TEXT)))
+    worker = Thread(target=store.import_statement, args=(rows,), kwargs={"on_done": done.append})
+    worker.start()
+    worker.join()
+    assert len(queued) == 1 and not done
+
+    store.delete_wallet("Карта")
+    func, args, kwargs = queued.pop()
+    assert func(*args, **kwargs) == 0
+    assert len(done) == 1 and "Карта" in done[0]["failed"] and done[0]["imported"] == 0
+    assert store.data["incomes"] == [] and store.data["expenses"] == []
@@ -0,0 +1,133 @@
+import json
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import finance_core
+from finance_core import (
+    DEFAULT_RATES, DataStore, JsonStorage, RateCache, backfill_exchange_rates, collect_report, current_rates,
+    empty_data, fetch_exchange_rates,
+)
+
+# Курсы по date_req (дд/мм/гггг); без даты — текущие
+SERVED = {
+    None: {"USD": "92,5000", "JPY": "61,2000"},
+    "01/03/2024": {"USD": "90,0000", "JPY": "60,0000"},
+    "04/03/2024": {"USD": "91,0000", "JPY": "60,5000"},
+}
+
+
+def val_curs(rates):
+    valutes = "".join(
+        f'<Valute ID="R0{i}"><NumCode>{i}</NumCode><CharCode>{code}</CharCode>'
+        f'<Nominal>{100 if code == "JPY" else 1}</Nominal><Name>{name}</Name><Value>{value}</Value></Valute>'
+        for i, (code, value, name) in enumerate(
+            (code, value, {"USD": "Доллар США", "JPY": "Японских иен"}[code]) for code, value in rates.items())
+    )
+    text = f'<?xml version="1.0" encoding="windows-1251"?><ValCurs Date="01.03.2024" name="Foreign Currency Market">{valutes}</ValCurs>'
+    return text.encode("cp1251")
+
+
+class CbrHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        day = query.get("date_req", [None])[0]
+        self.server.requested.append(day)
+        if day not in SERVED:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = val_curs(SERVED[day])
+        self.send_response(200)
+        # Как и у ЦБ, кодировка только в XML-заголовке
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cbr_url(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), CbrHandler)
+    server.requested = []
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/scripts/XML_daily.asp"
+    monkeypatch.setattr(finance_core, "CBR_DAILY_URL", url)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_exchange_rates_nominal_and_encoding(cbr_url):
+    rates = fetch_exchange_rates()
+    assert rates == {"RUB": 1.0, "USD": 92.5, "JPY": pytest.approx(0.612)}
+    assert fetch_exchange_rates(on_date=date(2024, 3, 1))["USD"] == 90.0
+    assert cbr_url.requested == [None, "01/03/2024"]
+
+
+def test_backfill_loads_missing_past_days(cbr_url, tmp_path):
+    cache = RateCache(str(tmp_path / "rates_cache.json"))
+    cache.put(date(2024, 3, 4), {"RUB": 1.0, "USD": 91.0})
+    days = [date(2024, 3, 1), date(2024, 3, 4), date.today() + timedelta(days=1)]
+    assert backfill_exchange_rates(cache, days) == 1
+    # Уже загруженный день и будущие дни не запрашиваются
+    assert cbr_url.requested == ["01/03/2024"]
+    assert RateCache(cache.path).get(date(2024, 3, 1))["JPY"] == pytest.approx(0.6)
+
+
+def test_backfill_stops_on_error_and_respects_batch(cbr_url, tmp_path):
+    cache = RateCache(str(tmp_path / "rates_cache.json"))
+    # 02.03 сервер не отдаёт — остальные дни догрузятся в следующий раз
+    assert backfill_exchange_rates(cache, [date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 4)]) == 1
+    assert cache.missing([date(2024, 3, 2), date(2024, 3, 4)]) == [date(2024, 3, 2), date(2024, 3, 4)]
+    cbr_url.requested.clear()
+    assert backfill_exchange_rates(cache, [date(2024, 3, 4)], batch=0) == 0
+    assert cbr_url.requested == []
+
+
+def test_rate_fallbacks(tmp_path):
+    cache = RateCache(str(tmp_path / "rates_cache.json"))
+    assert cache.rate("RUB", date(2024, 3, 1)) == 1.0
+    assert cache.rate("USD", date(2024, 3, 1), default=80.0) == 80.0
+
+    cache.put(date(2024, 3, 1), {"RUB": 1.0, "USD": 90.0})
+    cache.put(date(2024, 3, 4), {"RUB": 1.0, "USD": 91.0})
+    # Выходные — курс последнего известного дня
+    assert cache.rate("USD", date(2024, 3, 2)) == 90.0
+    assert cache.rate("USD", "2024-03-03") == 90.0
+    assert cache.rate("USD", date(2024, 3, 4)) == 91.0
+    # До первого дня в кэше — самый ранний курс, без даты — последний
+    assert cache.rate("USD", date(2024, 1, 1)) == 90.0
+    assert cache.rate("USD") == 91.0
+    assert cache.rate("EUR", date(2024, 3, 4), default=100.0) == 100.0
+    # Догруженный день заменяет запомненное сопоставление
+    cache.put(date(2024, 3, 2), {"RUB": 1.0, "USD": 95.0})
+    assert cache.rate("USD", date(2024, 3, 2)) == 95.0
+    assert cache.rate("USD", "2024-03-03") == 95.0
+
+
+def test_default_rates_are_not_persisted(tmp_path):
+    data = empty_data()
+    data.pop("currencies", None)
+    data["wallets"] = [{"name": "Доллары", "currency": "USD", "balance": 10.0}]
+    data["expenses"] = [{"id": 1, "wallet": "Доллары", "currency": "USD", "amount": 2.0,
+                         "category": "Кафе", "date": "01.03.2024 10:00"}]
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    storage = JsonStorage(str(path))
+    store = DataStore(storage)
+
+    assert current_rates(store.data) == DEFAULT_RATES
+    assert collect_report(store.data, store.columns)["rub_out"] == 2.0 * DEFAULT_RATES["USD"]
+    store.add_wallet("Евро", "EUR", 5.0)
+    assert not storage.load().get("currencies")
+
+    store.apply_exchange_rates({"RUB": 1.0, "USD": 92.5})
+    assert storage.load()["currencies"] == {"RUB": 1.0, "USD": 92.5}
+    assert current_rates(store.data)["USD"] == 92.5
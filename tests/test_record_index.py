@@ -0,0 +1,59 @@
+import random
+
+from finance_core import RecordIndex, empty_data
+
+
+def make_data(count):
+    data = empty_data()
+    data["expenses"] = [
+        {"id": i, "wallet": f"W{i % 3}", "category": f"C{i % 5}", "amount": i, "date": "01.01.2024 10:00"}
+        for i in range(1, count + 1)
+    ]
+    return data
+
+
+def assert_positions(index, data, key="expenses"):
+    for pos, rec in enumerate(data[key]):
+        assert index._position(key, rec) == pos
+        assert index.get(key, rec["id"]) is rec
+
+
+def test_remove_from_head_middle_and_tail():
+    data = make_data(200)
+    index = RecordIndex(data)
+    expected = [rec["id"] for rec in data["expenses"]]
+    for rec_id in (1, 2, 100, 57, 200, 3, 150):
+        removed = index.remove("expenses", rec_id)
+        assert [r["id"] for r in removed] == [rec_id]
+        expected.remove(rec_id)
+        assert [r["id"] for r in data["expenses"]] == expected
+        assert index.get("expenses", rec_id) is None
+        assert_positions(index, data)
+
+
+def test_remove_mixed_with_appends_and_compaction():
+    data = make_data(100)
+    index = RecordIndex(data)
+    rnd = random.Random(7)
+    next_id = 101
+    for step in range(600):
+        if step % 3 == 0:
+            index.add("expenses", {"id": next_id, "wallet": "W0", "category": "C0", "amount": 1})
+            next_id += 1
+        elif data["expenses"]:
+            rec = rnd.choice(data["expenses"])
+            index.remove("expenses", rec["id"])
+            assert rec not in data["expenses"]
+    assert_positions(index, data)
+    ids = [r["id"] for r in data["expenses"]]
+    assert ids == sorted(ids)
+    assert index.ids_by_wallet("expenses", "W0") == {r["id"] for r in data["expenses"] if r["wallet"] == "W0"}
+
+
+def test_list_changed_behind_index():
+    data = make_data(10)
+    index = RecordIndex(data)
+    data["expenses"].insert(0, data["expenses"].pop())
+    index.remove("expenses", 5)
+    assert [r["id"] for r in data["expenses"]] == [10, 1, 2, 3, 4, 6, 7, 8, 9]
+    assert_positions(index, data)
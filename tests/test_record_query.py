@@ -0,0 +1,77 @@
+from datetime import date
+
+from finance_core import RecordIndex, RecordQuery, empty_data
+
+
+class CountingQuery(RecordQuery):
+    def __init__(self):
+        super().__init__()
+        self.single_removals = 0
+
+    def record_removed(self, key, rec):
+        self.single_removals += 1
+        super().record_removed(key, rec)
+
+
+def make_index(count=300):
+    data = empty_data()
+    data["expenses"] = [
+        {"id": i, "wallet": f"W{i % 3}", "category": f"C{i % 4}", "amount": i % 50,
+         "date": f"{i % 28 + 1:02d}.{i % 12 + 1:02d}.2024 10:00"}
+        for i in range(1, count + 1)
+    ]
+    index = RecordIndex(data)
+    query = CountingQuery()
+    index.subscribe(query)
+    return data, index, query
+
+
+def expected_ids(data, wallet=None, low=None, high=None):
+    return {rec["id"] for rec in data["expenses"]
+            if (wallet is None or rec["wallet"] == wallet)
+            and (low is None or low <= rec["amount"] <= high)}
+
+
+def test_remove_where_updates_query_in_one_batch():
+    data, index, query = make_index()
+    moved = index.remove_by_wallet("expenses", "W1")
+    assert moved and query.single_removals == 0
+    assert {r["id"] for r in query.query("expenses")} == expected_ids(data)
+    assert query.query("expenses", wallet="W1") == []
+    found = query.query("expenses", min_amount=10, max_amount=20)
+    assert {r["id"] for r in found} == expected_ids(data, low=10, high=20)
+    in_march = query.query("expenses", start=date(2024, 3, 1), end=date(2024, 4, 1))
+    assert {r["id"] for r in in_march} == {r["id"] for r in data["expenses"] if ".03.2024" in r["date"]}
+    assert len(query._dates["expenses"]) == len(query._amounts["expenses"]) == len(data["expenses"])
+
+
+def test_single_removal_still_supported():
+    data, index, query = make_index(20)
+    index.remove("expenses", 5)
+    assert query.single_removals == 1
+    assert {r["id"] for r in query.query("expenses", wallet="W2")} == expected_ids(data, wallet="W2")
+
+
+def test_newest_orders_by_date_then_insertion():
+    data = empty_data()
+    data["expenses"] = [
+        {"id": 1, "wallet": "W", "category": "C", "amount": 1, "date": "01.03.2024 10:00"},
+        {"id": 2, "wallet": "W", "category": "C", "amount": 2, "date": "05.03.2024 10:00"},
+        {"id": 3, "wallet": "W", "category": "C", "amount": 3, "date": ""},
+    ]
+    index = RecordIndex(data)
+    query = RecordQuery()
+    index.subscribe(query)
+    index.add("expenses", {"id": 4, "wallet": "W", "category": "C", "amount": 4, "date": "01.03.2024 10:00"})
+    index.add("expenses", {"id": 5, "wallet": "W", "category": "C", "amount": 5, "date": "01.01.2020 10:00"})
+    assert [r["id"] for r in query.newest("expenses", 0, 10)] == [2, 4, 1, 5, 3]
+    assert [r["id"] for r in query.newest("expenses", 1, 3)] == [4, 1]
+    assert [r["id"] for r in query.newest("expenses", 4, 10)] == [3]
+
+
+def test_count_ignores_limit():
+    data, index, query = make_index()
+    assert len(query.query("expenses", wallet="W1", limit=10)) == 10
+    assert query.count("expenses", wallet="W1") == len(expected_ids(data, wallet="W1"))
+    assert query.count("expenses", wallet="W1", min_amount=5, max_amount=9) == len(expected_ids(data, "W1", 5, 9))
+    assert query.count("expenses") == len(data["expenses"])
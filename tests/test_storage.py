@@ -0,0 +1,38 @@
+import pytest
+
+from finance_core import JournalStorage, JsonStorage, SqliteStorage, WriteBehindStorage, op_add
+
+
+@pytest.fixture(params=["json", "journal", "sqlite"])
+def open_backend(request, tmp_path):
+    def open_backend():
+        if request.param == "json":
+            return JsonStorage(str(tmp_path / "data.json"))
+        if request.param == "journal":
+            return JournalStorage(str(tmp_path / "data.json"), str(tmp_path / "data.json.journal"))
+        return SqliteStorage(str(tmp_path / "data.db"))
+    return open_backend
+
+
+def test_full_save_does_not_replay_queued_ops(open_backend):
+    storage = WriteBehindStorage(open_backend(), delay=60, max_delay=60)
+    data = storage.load()
+    rec = {"id": 1, "wallet": "W", "currency": "RUB", "amount": 5.0, "category": "A", "date": "01.03.2024 10:00"}
+    data["categories"].append("A")
+    data["expenses"].append(rec)
+    storage.commit(data, [op_add("categories", "A"), op_add("expenses", rec)])
+    storage.save(data)
+    storage.close()
+    loaded = open_backend().load()
+    assert loaded["categories"] == ["A"]
+    assert loaded["expenses"] == [rec]
+
+
+def test_queued_ops_are_written_on_flush(open_backend):
+    storage = WriteBehindStorage(open_backend(), delay=60, max_delay=60)
+    data = storage.load()
+    for name in ("A", "B"):
+        data["categories"].append(name)
+        storage.commit(data, [op_add("categories", name)])
+    storage.close()
+    assert open_backend().load()["categories"] == ["A", "B"]
@@ -0,0 +1,68 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from finance_core import DataStore, JournalStorage, JsonStorage, SqliteStorage, empty_data
+
+
+def open_json(tmp_path):
+    return JsonStorage(str(tmp_path / "data.json"))
+
+
+def open_journal(tmp_path):
+    return JournalStorage(str(tmp_path / "data.json"), str(tmp_path / "data.json.journal"))
+
+
+def open_sqlite(tmp_path):
+    return SqliteStorage(str(tmp_path / "data.db"))
+
+
+@pytest.fixture(params=[open_json, open_journal, open_sqlite], ids=["json", "journal", "sqlite"])
+def open_backend(request):
+    return request.param
+
+
+def make_store(tmp_path, open_backend, trash):
+    data = empty_data()
+    data["deleted_records"] = trash
+    (tmp_path / "data.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    storage = open_backend(tmp_path)
+    if isinstance(storage, SqliteStorage):
+        storage.save(data)
+    return storage, DataStore(storage)
+
+
+def reload(tmp_path, open_backend, storage):
+    storage.close()
+    return open_backend(tmp_path).load()
+
+
+def deleted_at(days_ago):
+    return (datetime.now() - timedelta(days=days_ago)).strftime("%d.%m.%Y %H:%M:%S")
+
+
+def test_purge_trash_older_than(tmp_path, open_backend):
+    trash = [
+        {"id": 1, "record_type": "expenses", "amount": 10, "deleted_at": deleted_at(40)},
+        {"id": 2, "record_type": "incomes", "amount": 20, "deleted_at": deleted_at(5)},
+        # Тот же id и тип, но удалена недавно — должна остаться и в памяти, и на диске
+        {"id": 1, "record_type": "expenses", "amount": 30, "deleted_at": deleted_at(1)},
+        {"id": 3, "record_type": "expenses", "amount": 40},
+    ]
+    storage, store = make_store(tmp_path, open_backend, trash)
+    assert store.purge_trash_older_than(30) == 1
+    assert [r["amount"] for r in store.data["deleted_records"]] == [20, 30, 40]
+    assert store.purge_trash_older_than(30) == 0
+    assert [r["amount"] for r in reload(tmp_path, open_backend, storage)["deleted_records"]] == [20, 30, 40]
+
+
+def test_permanently_delete_records_without_deleted_at(tmp_path, open_backend):
+    trash = [
+        {"id": 1, "amount": 10},
+        {"id": 1, "record_type": "incomes", "amount": 20, "deleted_at": deleted_at(1)},
+        {"id": 2, "record_type": "expenses", "amount": 30, "deleted_at": deleted_at(1)},
+    ]
+    storage, store = make_store(tmp_path, open_backend, trash)
+    assert store.permanently_delete_many_from_trash([1]) == 2
+    assert [r["amount"] for r in reload(tmp_path, open_backend, storage)["deleted_records"]] == [30]